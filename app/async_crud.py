@@ -0,0 +1,94 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, projections, search
+from .crud import (
+    COMMENT_TREE_MAX_DEPTH, attach_comment_replies, attach_discussion_trees, discussion_load_options, user_load_options,
+)
+
+# Async counterparts of the read functions in crud.py. The list endpoints read through
+# app/projections.py in both modes: its Core queries run on the async session's connection
+# through run_sync(), so there is one implementation of each listing.
+
+async def _all(db: AsyncSession, stmt):
+    return (await db.execute(stmt)).scalars().all()
+
+async def _first(db: AsyncSession, stmt):
+    return (await db.execute(stmt.limit(1))).scalars().first()
+
+def _attach_user_trees(users):
+    for user in users:
+        attach_discussion_trees(user.discussions)
+    return users
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await _first(db, select(models.User).where(models.User.id == user_id))
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await _first(db, select(models.User).where(models.User.email == email))
+
+async def get_principal(db: AsyncSession, email: str, user_id: int = None):
+    stmt = select(models.User.id, models.User.email).where(models.User.email == email)
+    if user_id is not None:
+        stmt = stmt.where(models.User.id == user_id)
+    return (await db.execute(stmt.limit(1))).first()
+
+async def get_user_detail(db: AsyncSession, user_id: int):
+    user = await _first(db, select(models.User).options(*user_load_options()).where(models.User.id == user_id))
+    if user:
+        attach_discussion_trees(user.discussions)
+    return user
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100):
+    return await db.run_sync(lambda session: projections.get_users(session, skip=skip, limit=limit))
+
+async def get_users_page(db: AsyncSession, cursor: str = None, limit: int = 100):
+    return await db.run_sync(lambda session: projections.get_users_page(session, cursor=cursor, limit=limit))
+
+async def load_in_order(db: AsyncSession, model, ids, options=()):
+    if not ids:
+        return []
+    rows = await _all(db, select(model).options(*options).where(model.id.in_(ids)))
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+async def search_users(db: AsyncSession, name: str, skip: int = 0, limit: int = 100):
+    ids = await db.run_sync(lambda session: search.search_index.search_users(session, name, skip=skip, limit=limit))
+    return _attach_user_trees(await load_in_order(db, models.User, ids, user_load_options()))
+
+async def search_discussions(db: AsyncSession, q: str, skip: int = 0, limit: int = 100):
+    ids = await db.run_sync(lambda session: search.search_index.search_discussions(session, q, skip=skip, limit=limit))
+    return attach_discussion_trees(await load_in_order(db, models.Discussion, ids, discussion_load_options()))
+
+async def search_users_page(db: AsyncSession, name: str, cursor: str = None, limit: int = 100):
+    return await db.run_sync(lambda session: projections.search_users_page(session, name, cursor=cursor, limit=limit))
+
+async def get_discussion_detail(db: AsyncSession, discussion_id: int):
+    stmt = select(models.Discussion).options(*discussion_load_options()).where(models.Discussion.id == discussion_id)
+    discussion = await _first(db, stmt)
+    if discussion:
+        attach_comment_replies(discussion.comments)
+    return discussion
+
+async def get_discussions(db: AsyncSession, skip: int = 0, limit: int = 100):
+    return await db.run_sync(lambda session: projections.get_discussions(session, skip=skip, limit=limit))
+
+async def get_discussions_page(db: AsyncSession, cursor: str = None, limit: int = 100):
+    return await db.run_sync(lambda session: projections.get_discussions_page(session, cursor=cursor, limit=limit))
+
+async def get_discussions_by_hashtag(db: AsyncSession, hashtag: str, skip: int = 0, limit: int = 100):
+    return await db.run_sync(lambda session: projections.get_discussions_by_hashtag(session, hashtag, skip=skip, limit=limit))
+
+async def get_discussions_by_hashtag_page(db: AsyncSession, hashtag: str, cursor: str = None, limit: int = 100):
+    return await db.run_sync(lambda session: projections.get_discussions_by_hashtag_page(session, hashtag, cursor=cursor, limit=limit))
+
+async def get_comments(db: AsyncSession, discussion_id: int, skip: int = 0, limit: int = 100):
+    return await db.run_sync(lambda session: projections.get_comments(session, discussion_id, skip=skip, limit=limit))
+
+async def get_comments_page(db: AsyncSession, discussion_id: int, cursor: str = None, limit: int = 100):
+    return await db.run_sync(lambda session: projections.get_comments_page(session, discussion_id, cursor=cursor, limit=limit))
+
+async def get_comment_tree(db: AsyncSession, discussion_id: int, skip: int = 0, limit: int = 100, max_depth: int = COMMENT_TREE_MAX_DEPTH):
+    return await db.run_sync(lambda session: projections.get_comment_tree(session, discussion_id, skip=skip, limit=limit, max_depth=max_depth))
+
+async def get_comment_tree_page(db: AsyncSession, discussion_id: int, cursor: str = None, limit: int = 100, max_depth: int = COMMENT_TREE_MAX_DEPTH):
+    return await db.run_sync(lambda session: projections.get_comment_tree_page(session, discussion_id, cursor=cursor, limit=limit, max_depth=max_depth))
@@ -0,0 +1,128 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Union
+from . import async_crud, schemas
+from .crud import COMMENT_TREE_MAX_DEPTH, normalize_hashtag
+from .response_cache import cached_response_async, discussion_tag, hashtag_tag, render
+from .serializers import respond
+from .database import get_async_db
+
+# Async versions of the read-only endpoints in main.py. With DATABASE_ASYNC=1 they replace
+# their sync counterparts so reads never hold a threadpool worker while waiting on the database.
+router = APIRouter()
+
+@router.get("/users/", response_model=Union[List[schemas.User], schemas.UserPage])
+async def read_users(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    if cursor is not None:
+        try:
+            users, next_cursor = await async_crud.get_users_page(db, cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return respond(schemas.UserPage, {"items": users, "next_cursor": next_cursor})
+    return respond(List[schemas.User], await async_crud.get_users(db, skip=skip, limit=limit))
+
+@router.get("/users/{user_id}", response_model=schemas.User)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = await async_crud.get_user_detail(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return respond(schemas.User, db_user)
+
+@router.get("/users/search/", response_model=Union[List[schemas.User], schemas.UserPage])
+async def search_users(name: str, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    if cursor is not None:
+        try:
+            users, next_cursor = await async_crud.search_users_page(db, name=name, cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return respond(schemas.UserPage, {"items": users, "next_cursor": next_cursor})
+    return respond(List[schemas.User], await async_crud.search_users(db, name=name, skip=skip, limit=limit))
+
+@router.get("/discussions/", response_model=Union[List[schemas.Discussion], schemas.DiscussionPage])
+async def read_discussions(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    if cursor is not None:
+        try:
+            discussions, next_cursor = await async_crud.get_discussions_page(db, cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return respond(schemas.DiscussionPage, {"items": discussions, "next_cursor": next_cursor})
+    return respond(List[schemas.Discussion], await async_crud.get_discussions(db, skip=skip, limit=limit))
+
+@router.get("/discussions/search", response_model=List[schemas.Discussion])
+async def search_discussions(q: str, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)):
+    return respond(List[schemas.Discussion], await async_crud.search_discussions(db, q=q, skip=skip, limit=limit))
+
+@router.get("/discussions/{discussion_id}", response_model=schemas.Discussion)
+async def read_discussion(discussion_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def build():
+        db_discussion = await async_crud.get_discussion_detail(db, discussion_id=discussion_id)
+        if db_discussion is None:
+            raise HTTPException(status_code=404, detail="Discussion not found")
+        return render(schemas.Discussion, db_discussion), [discussion_tag(discussion_id)]
+    return await cached_response_async(request, build)
+
+@router.get("/discussions/hashtag/{hashtag}", response_model=Union[List[schemas.Discussion], schemas.DiscussionPage])
+async def read_discussions_by_hashtag(
+    request: Request,
+    hashtag: str,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def build():
+        if cursor is not None:
+            try:
+                discussions, next_cursor = await async_crud.get_discussions_by_hashtag_page(db, hashtag=hashtag, cursor=cursor, limit=limit)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            body = render(schemas.DiscussionPage, {"items": discussions, "next_cursor": next_cursor})
+        else:
+            discussions = await async_crud.get_discussions_by_hashtag(db, hashtag=hashtag, skip=skip, limit=limit)
+            body = render(List[schemas.Discussion], discussions)
+        tags = [hashtag_tag(normalize_hashtag(hashtag))] + [discussion_tag(d.id) for d in discussions]
+        return body, tags
+    return await cached_response_async(request, build)
+
+@router.get("/discussions/{discussion_id}/comments/", response_model=Union[List[schemas.Comment], schemas.CommentPage])
+async def read_comments(
+    discussion_id: int,
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    tree: bool = False,
+    max_depth: int = COMMENT_TREE_MAX_DEPTH,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def build():
+        try:
+            if cursor is not None:
+                if tree:
+                    comments, next_cursor = await async_crud.get_comment_tree_page(db, discussion_id=discussion_id, cursor=cursor, limit=limit, max_depth=max_depth)
+                else:
+                    comments, next_cursor = await async_crud.get_comments_page(db, discussion_id=discussion_id, cursor=cursor, limit=limit)
+                body = render(schemas.CommentPage, {"items": comments, "next_cursor": next_cursor})
+            elif tree:
+                body = render(List[schemas.Comment], await async_crud.get_comment_tree(db, discussion_id=discussion_id, skip=skip, limit=limit, max_depth=max_depth))
+            else:
+                body = render(List[schemas.Comment], await async_crud.get_comments(db, discussion_id=discussion_id, skip=skip, limit=limit))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return body, [discussion_tag(discussion_id)]
+    return await cached_response_async(request, build)
+
+def install(app):
+    # Drops the sync routes these replace, keeping their original position so that path
+    # matching order (e.g. /discussions/search before /discussions/{discussion_id}) is unchanged.
+    replacements = {(route.path, method): route for route in router.routes for method in route.methods}
+    routes = []
+    for route in app.router.routes:
+        if isinstance(route, APIRoute):
+            replacement = next((replacements[(route.path, m)] for m in route.methods if (route.path, m) in replacements), None)
+            if replacement is not None:
+                routes.append(replacement)
+                continue
+        routes.append(route)
+    app.router.routes[:] = routes
@@ -2,9 +2,12 @@ from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import crud, models, schemas
-from .database import get_db
+from . import async_crud, crud, models, schemas
+from .cache import TTLCache
+from .database import ASYNC_MODE, get_async_db, get_db
 import os
 from dotenv import load_dotenv
 
@@ -16,6 +19,11 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Resolved principals keyed by token subject, so most authenticated requests never touch the database
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def create_access_token(data: dict):
@@ -31,26 +39,60 @@ def verify_token(token: str, credentials_exception):
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = schemas.TokenData(email=email)
+        token_data = schemas.TokenData(email=email, user_id=payload.get("user_id"))
     except JWTError:
         raise credentials_exception
     return token_data
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def invalidate_principal(email: str):
+    principal_cache.delete(email)
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_user(mapper, connection, target):
+    # Covers the old address too when the email itself changed
+    emails = {target.email, *inspect(target).attrs.email.history.deleted}
+    for email in emails:
+        invalidate_principal(email)
+
+def _cached_principal(token_data: schemas.TokenData, credentials_exception):
+    principal = principal_cache.get(token_data.email)
+    if principal is not None and token_data.user_id not in (None, principal.id):
+        raise credentials_exception
+    return principal
+
+def _store_principal(token_data: schemas.TokenData, row, credentials_exception):
+    if row is None:
+        raise credentials_exception
+    principal = schemas.CurrentUser(id=row.id, email=row.email)
+    principal_cache.set(token_data.email, principal)
+    return principal
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(email=email)
-    except JWTError:
-        raise credentials_exception
-    user = crud.get_user_by_email(db, email=token_data.email)
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    # A plain def so FastAPI runs the blocking lookup on the threadpool instead of the event loop
+    credentials_exception = _credentials_exception()
+    token_data = verify_token(token, credentials_exception)
+    principal = _cached_principal(token_data, credentials_exception)
+    if principal is None:
+        row = crud.get_principal(db, email=token_data.email, user_id=token_data.user_id)
+        principal = _store_principal(token_data, row, credentials_exception)
+    return principal
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    credentials_exception = _credentials_exception()
+    token_data = verify_token(token, credentials_exception)
+    principal = _cached_principal(token_data, credentials_exception)
+    if principal is None:
+        row = await async_crud.get_principal(db, email=token_data.email, user_id=token_data.user_id)
+        principal = _store_principal(token_data, row, credentials_exception)
+    return principal
+
+# The dependency the endpoints use, chosen by DATABASE_ASYNC
+current_user_dependency = get_current_user_async if ASYNC_MODE else get_current_user
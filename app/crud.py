@@ -1,68 +1,215 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
+import base64
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import and_, or_, bindparam, delete, func, insert, select, update, DateTime, String
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from . import events, follow_graph, jobs, models, ranking, response_cache, schemas, search, timeline, trending
 from fastapi import HTTPException
-from passlib.context import CryptContext
+from .passwords import hash_password, needs_rehash, pwd_context, verify_password
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hard cap on how many reply levels a comment listing walks for a page of comments
+COMMENT_TREE_MAX_DEPTH = 32
+# Comments.path holds one fixed-width base-36 segment per level, so sorting by path lists a
+# thread depth first with siblings in id order and a subtree is a single range of paths
+COMMENT_PATH_SEGMENT = 8
+COMMENT_PATH_MAX_DEPTH = 64
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Loader strategies. Every relationship serialized by schemas.Discussion/Comment/User is
+# loaded up front so a listing costs a fixed number of queries instead of one per row.
+def discussion_load_options():
+    return (
+        selectinload(models.Discussion.hashtags),
+        selectinload(models.Discussion.comments),
+    )
+
+def user_load_options():
+    return (
+        selectinload(models.User.discussions).selectinload(models.Discussion.hashtags),
+        selectinload(models.User.discussions).selectinload(models.Discussion.comments),
+    )
+
+def attach_comment_replies(comments):
+    # Discussion.comments holds every comment of the discussion, so each reply list can be
+    # built in memory from the already loaded rows without touching the database.
+    children = defaultdict(list)
+    for comment in sorted(comments, key=lambda c: c.id):
+        if comment.parent_id is not None:
+            children[comment.parent_id].append(comment)
+    for comment in comments:
+        set_committed_value(comment, "replies", children.get(comment.id, []))
+    return comments
+
+def attach_discussion_trees(discussions):
+    for discussion in discussions:
+        attach_comment_replies(discussion.comments)
+    return discussions
+
+# Keyset pagination. A cursor is the opaque, url-safe encoding of the sort key of the last
+# row on the previous page; the next page is whatever sorts strictly after it.
+def encode_cursor(values):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, columns):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            raise ValueError
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime)
+            else str(value) if isinstance(column.type, String) else int(value)
+            for column, value in zip(columns, payload)
+        ]
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def keyset_condition(columns, values, descending: bool):
+    # (a, b) > (x, y) spelled out as a OR of prefixes so MySQL can range-scan the composite index
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal, step))
+    return or_(*clauses)
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+def get_user_detail(db: Session, user_id: int):
+    user = db.query(models.User).options(*user_load_options()).filter(models.User.id == user_id).first()
+    if user:
+        attach_discussion_trees(user.discussions)
+    return user
+
+def _attach_user_trees(users):
+    for user in users:
+        attach_discussion_trees(user.discussions)
+    return users
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_principal(db: Session, email: str, user_id: int = None):
+    # Only the columns authentication needs; the primary key is used when the token carries it
+    query = db.query(models.User.id, models.User.email).filter(models.User.email == email)
+    if user_id is not None:
+        query = query.filter(models.User.id == user_id)
+    return query.first()
 
 def create_user(db: Session, user: schemas.UserCreate):
     if get_user_by_email(db, email=user.email):
         raise ValueError("Email already registered")
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = hash_password(user.password)
     db_user = models.User(name=user.name, email=user.email, mobile_no=user.mobile_no, hashed_password=hashed_password)
     db.add(db_user)
+    db.flush()
+    jobs.enqueue(db, "user.created", {"id": db_user.id})
     db.commit()
     db.refresh(db_user)
+    jobs.job_queue.notify(db)
     return db_user
 
 def authenticate_user(db: Session, email: str, password: str):
     user = get_user_by_email(db, email)
-    if not user:
+    # Users imported without their password hash cannot log in
+    if not user or not user.hashed_password:
         return False
-    if not pwd_context.verify(password, user.hashed_password):
+    if not verify_password(password, user.hashed_password):
         return False
+    if needs_rehash(user.hashed_password):
+        user.hashed_password = hash_password(password)
+        db.commit()
     return user
 
+def load_in_order(db: Session, model, ids, options=()):
+    # Fetches rows for ids coming from a ranking (search, trending...) and keeps that order
+    if not ids:
+        return []
+    rows = db.query(model).options(*options).filter(model.id.in_(ids)).all()
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
 def search_users(db: Session, name: str, skip: int = 0, limit: int = 100):
-    return db.query(models.User).filter(models.User.name.ilike(f"%{name}%")).offset(skip).limit(limit).all()
+    ids = search.search_index.search_users(db, name, skip=skip, limit=limit)
+    return _attach_user_trees(load_in_order(db, models.User, ids, user_load_options()))
+
+def normalize_hashtag(name: str):
+    return name.strip().lstrip("#").strip().lower()
+
+def normalize_hashtags(names):
+    # Normalized, de-duplicated and in their original order
+    return list(dict.fromkeys(tag for tag in map(normalize_hashtag, names) if tag))
+
+def insert_ignore(table):
+    # Duplicate keys are skipped by the database instead of being checked for beforehand
+    return insert(table).prefix_with("OR IGNORE", dialect="sqlite").prefix_with("IGNORE", dialect="mysql")
+
+def _hashtag_ids(db: Session, names):
+    return dict(db.query(models.Hashtag.name, models.Hashtag.id).filter(models.Hashtag.name.in_(names)).all())
+
+def upsert_hashtags(db: Session, names):
+    # One IN (...) lookup plus one multi-row INSERT IGNORE for the missing names. Concurrent
+    # creators of the same tag both succeed; the loser's rows are simply ignored.
+    if not names:
+        return {}
+    ids = _hashtag_ids(db, names)
+    missing = [name for name in names if name not in ids]
+    if missing:
+        db.execute(insert_ignore(models.Hashtag.__table__), [{"name": name} for name in missing])
+        ids.update(_hashtag_ids(db, missing))
+    return ids
+
+def _link_hashtags(db: Session, discussion_id: int, hashtag_ids):
+    if hashtag_ids:
+        db.execute(models.discussion_hashtag.insert(), [
+            {"discussion_id": discussion_id, "hashtag_id": hashtag_id} for hashtag_id in hashtag_ids
+        ])
 
 def create_discussion(db: Session, discussion: schemas.DiscussionCreate, user_id: int):
     db_discussion = models.Discussion(text=discussion.text, image=discussion.image, user_id=user_id)
     db.add(db_discussion)
+    db.flush()
+    hashtags = normalize_hashtags(discussion.hashtags)
+    hashtag_ids = upsert_hashtags(db, hashtags)
+    _link_hashtags(db, db_discussion.id, [hashtag_ids[name] for name in hashtags])
+    jobs.enqueue(db, "discussion.created", {"id": db_discussion.id})
     db.commit()
     db.refresh(db_discussion)
-
-    for hashtag_name in discussion.hashtags:
-        hashtag = get_or_create_hashtag(db, hashtag_name)
-        db_discussion.hashtags.append(hashtag)
-
-    db.commit()
-    db.refresh(db_discussion)
+    # Cheap and expected to show up on the next read, so not deferred to the job queue
+    ranking.discussion_ranking.add(db_discussion.id, ranking.created_timestamp(db_discussion.created_on))
+    response_cache.invalidate_hashtags(hashtags)
+    jobs.job_queue.notify(db)
     return db_discussion
 
-def get_or_create_hashtag(db: Session, hashtag_name: str):
-    hashtag = db.query(models.Hashtag).filter(models.Hashtag.name == hashtag_name).first()
-    if not hashtag:
-        hashtag = models.Hashtag(name=hashtag_name)
-        db.add(hashtag)
-        db.commit()
-        db.refresh(hashtag)
-    return hashtag
-
 def get_discussion(db: Session, discussion_id: int):
     return db.query(models.Discussion).filter(models.Discussion.id == discussion_id).first()
 
-def get_discussions(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Discussion).offset(skip).limit(limit).all()
+def get_discussion_detail(db: Session, discussion_id: int):
+    discussion = db.query(models.Discussion).options(*discussion_load_options()).filter(models.Discussion.id == discussion_id).first()
+    if discussion:
+        attach_comment_replies(discussion.comments)
+    return discussion
+
+def search_discussions(db: Session, q: str, skip: int = 0, limit: int = 100):
+    ids = search.search_index.search_discussions(db, q, skip=skip, limit=limit)
+    return attach_discussion_trees(load_in_order(db, models.Discussion, ids, discussion_load_options()))
+
+def get_feed(db: Session, user_id: int, cursor: str = None, limit: int = 20):
+    columns = [models.Discussion.created_on, models.Discussion.id]
+    before = decode_cursor(cursor, columns) if cursor else None
+    keys = timeline.read_timeline(db, user_id, before, limit + 1)
+    next_cursor = None
+    if len(keys) > limit:
+        keys = keys[:limit]
+        next_cursor = encode_cursor(keys[-1])
+    ids = [key[1] for key in keys]
+    discussions = load_in_order(db, models.Discussion, ids, discussion_load_options())
+    return attach_discussion_trees(discussions), next_cursor
 
 def update_discussion(db: Session, discussion_id: int, discussion_update: schemas.DiscussionCreate):
     db_discussion = get_discussion(db, discussion_id)
@@ -72,94 +219,408 @@ def update_discussion(db: Session, discussion_id: int, discussion_update: schema
             if key != "hashtags":
                 setattr(db_discussion, key, value)
         
-        db_discussion.hashtags.clear()
-        for hashtag_name in discussion_update.hashtags:
-            hashtag = get_or_create_hashtag(db, hashtag_name)
-            db_discussion.hashtags.append(hashtag)
+        # Only the difference between the old and new tag sets touches discussion_hashtag
+        old_hashtags = {hashtag.name: hashtag.id for hashtag in db_discussion.hashtags}
+        new_hashtags = normalize_hashtags(discussion_update.hashtags)
+        added = [name for name in new_hashtags if name not in old_hashtags]
+        removed = [old_hashtags[name] for name in old_hashtags if name not in new_hashtags]
+        if removed:
+            db.execute(models.discussion_hashtag.delete().where(
+                models.discussion_hashtag.c.discussion_id == discussion_id,
+                models.discussion_hashtag.c.hashtag_id.in_(removed),
+            ))
+        hashtag_ids = upsert_hashtags(db, added)
+        _link_hashtags(db, discussion_id, [hashtag_ids[name] for name in added])
+        jobs.enqueue(db, "discussion.updated", {"id": discussion_id, "added": added, "at": time.time()})
 
         db.commit()
         db.refresh(db_discussion)
+        response_cache.invalidate_discussions([discussion_id])
+        response_cache.invalidate_hashtags(added)
+        jobs.job_queue.notify(db)
     return db_discussion
 
 def delete_discussion(db: Session, discussion_id: int):
     db_discussion = get_discussion(db, discussion_id)
     if db_discussion:
         db.delete(db_discussion)
+        jobs.enqueue(db, "discussion.deleted", {"id": discussion_id})
         db.commit()
+        ranking.discussion_ranking.remove(discussion_id)
+        response_cache.invalidate_discussions([discussion_id])
+        jobs.job_queue.notify(db)
         return True
     return False
 
-def get_discussions_by_hashtag(db: Session, hashtag: str, skip: int = 0, limit: int = 100):
-    return db.query(models.Discussion).join(models.Discussion.hashtags).filter(models.Hashtag.name == hashtag).offset(skip).limit(limit).all()
+# Follow-up work of the writes above, run by the job queue after they commit. Each handler
+# gets every queued payload of its kind in one call and reloads current rows, so a job that
+# runs twice, or after its discussion was edited or deleted, leaves the same end state.
+@jobs.handler("user.created")
+def _index_users(db: Session, payloads):
+    for user in load_in_order(db, models.User, [payload["id"] for payload in payloads]):
+        search.search_index.index_user(user)
+
+@jobs.handler("discussion.created")
+def _publish_discussions(db: Session, payloads):
+    ids = [payload["id"] for payload in payloads]
+    for discussion in load_in_order(db, models.Discussion, ids, [selectinload(models.Discussion.hashtags)]):
+        timeline.fan_out_discussion(db, discussion)
+        search.search_index.index_discussion(discussion)
+        trending.trending_hashtags.record(
+            [hashtag.name for hashtag in discussion.hashtags], at=ranking.created_timestamp(discussion.created_on)
+        )
+        events.publish_discussion(discussion)
+
+@jobs.handler("discussion.updated")
+def _reindex_discussions(db: Session, payloads):
+    ids = [payload["id"] for payload in payloads]
+    by_id = {d.id: d for d in load_in_order(db, models.Discussion, ids, [selectinload(models.Discussion.hashtags)])}
+    for payload in payloads:
+        if payload["id"] in by_id:
+            trending.trending_hashtags.record(payload["added"], at=payload["at"])
+    for discussion in by_id.values():
+        search.search_index.index_discussion(discussion)
+
+@jobs.handler("discussion.deleted")
+def _unindex_discussions(db: Session, payloads):
+    for payload in payloads:
+        search.search_index.remove_discussion(payload["id"])
+
+def _bump(db: Session, model, row_id: int, column, delta: int):
+    # Counters are changed with a relative UPDATE in the caller's transaction so concurrent
+    # writers never overwrite each other's increments. Returns the number of rows changed.
+    if delta:
+        return db.query(model).filter(model.id == row_id).update({column: column + delta}, synchronize_session=False)
+    return 0
+
+def _bump_many(db: Session, model, column, deltas):
+    # One relative UPDATE per distinct delta, e.g. a whole batch of +1s in a single statement
+    by_delta = defaultdict(list)
+    for row_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(row_id)
+    for delta, row_ids in by_delta.items():
+        db.query(model).filter(model.id.in_(row_ids)).update({column: column + delta}, synchronize_session=False)
+
+def _recount(db: Session, model, column, link_column, row_ids):
+    table = model.__table__
+    count = select(func.count()).where(link_column == table.c.id).scalar_subquery()
+    db.execute(update(table).where(table.c.id.in_(row_ids)).values({column.key: count}))
+
+def _change_links(db: Session, table, owner_key: str, target_key: str, owner_id: int, target_ids, add: bool,
+                  target_counter, owner_counter=None):
+    # Adds or removes (owner, target) rows of an association table and keeps the counters of
+    # both sides in step. Returns the targets that actually changed. If a concurrent writer
+    # raced us (affected rows != expected rows) the counters are recounted instead of bumped.
+    owner, target = table.c[owner_key], table.c[target_key]
+    target_ids = list(dict.fromkeys(target_ids))
+    if not target_ids:
+        return []
+    existing = {row[0] for row in db.execute(select(target).where(owner == owner_id, target.in_(target_ids)))}
+    if add:
+        changed = [t for t in target_ids if t not in existing]
+        if not changed:
+            return []
+        result = db.execute(insert_ignore(table), [{owner_key: owner_id, target_key: t} for t in changed])
+    else:
+        changed = [t for t in target_ids if t in existing]
+        if not changed:
+            return []
+        result = db.execute(delete(table).where(owner == owner_id, target.in_(changed)))
+    delta = 1 if add else -1
+    exact = result.rowcount == len(changed)
+    model, column = target_counter
+    if exact:
+        _bump_many(db, model, column, {t: delta for t in changed})
+    else:
+        _recount(db, model, column, target, changed)
+    if owner_counter:
+        model, column = owner_counter
+        if exact:
+            _bump(db, model, owner_id, column, delta * len(changed))
+        else:
+            _recount(db, model, column, owner, [owner_id])
+    return changed
+
+def _like_discussions(db: Session, user_id: int, discussion_ids, add: bool):
+    return _change_links(db, models.Like.__table__, "user_id", "discussion_id", user_id, discussion_ids, add,
+                         (models.Discussion, models.Discussion.like_count))
+
+def _like_comments(db: Session, user_id: int, comment_ids, add: bool):
+    return _change_links(db, models.CommentLike.__table__, "user_id", "comment_id", user_id, comment_ids, add,
+                         (models.Comment, models.Comment.like_count))
+
+def _follow_users(db: Session, follower_id: int, followed_ids, add: bool):
+    return _change_links(db, models.followers, "follower_id", "followed_id", follower_id, followed_ids, add,
+                         (models.User, models.User.follower_count), (models.User, models.User.following_count))
+
+def _invalidate_comments(db: Session, comment_ids):
+    # Returns the discussion of each comment
+    if not comment_ids:
+        return {}
+    rows = db.query(models.Comment.id, models.Comment.discussion_id).filter(models.Comment.id.in_(comment_ids))
+    discussions = {row.id: row.discussion_id for row in rows}
+    response_cache.invalidate_discussions(set(discussions.values()))
+    return discussions
+
+def _existing_ids(db: Session, model, ids):
+    ids = set(ids)
+    if not ids:
+        return set()
+    return {row[0] for row in db.query(model.id).filter(model.id.in_(ids))}
+
+def _require_ids(db: Session, model, ids, label: str):
+    missing = sorted(set(ids) - _existing_ids(db, model, ids))
+    if missing:
+        raise ValueError(f"{label} not found: {', '.join(map(str, missing))}")
+
+def apply_like_batch(db: Session, user_id: int, operations):
+    # The last operation on a target wins; everything is applied in one transaction
+    final = {}
+    for operation in operations:
+        final[(operation.target, operation.id)] = operation.action
+    groups = defaultdict(list)
+    for (target, target_id), action in final.items():
+        groups[(target, action)].append(target_id)
+    _require_ids(db, models.Discussion, groups[("discussion", "like")] + groups[("discussion", "unlike")], "Discussions")
+    _require_ids(db, models.Comment, groups[("comment", "like")] + groups[("comment", "unlike")], "Comments")
+    liked = _like_discussions(db, user_id, groups[("discussion", "like")], add=True)
+    unliked = _like_discussions(db, user_id, groups[("discussion", "unlike")], add=False)
+    discussions = liked + unliked
+    liked_comments = _like_comments(db, user_id, groups[("comment", "like")], add=True)
+    comments = liked_comments + _like_comments(db, user_id, groups[("comment", "unlike")], add=False)
+    db.commit()
+    for discussion_id in liked:
+        ranking.discussion_ranking.record(discussion_id, likes=1)
+    for discussion_id in unliked:
+        ranking.discussion_ranking.record(discussion_id, likes=-1)
+    response_cache.invalidate_discussions(discussions)
+    comment_discussions = _invalidate_comments(db, comments)
+    for discussion_id in liked:
+        events.publish_discussion_like(discussion_id, user_id)
+    for comment_id in liked_comments:
+        events.publish_comment_like(comment_id, comment_discussions[comment_id], user_id)
+    applied = len(discussions) + len(comments)
+    return {"applied": applied, "skipped": len(operations) - applied}
+
+def apply_follow_batch(db: Session, follower_id: int, operations):
+    final = {}
+    for operation in operations:
+        final[operation.user_id] = operation.action
+    _require_ids(db, models.User, list(final), "Users")
+    followed = _follow_users(db, follower_id, [i for i, a in final.items() if a == "follow"], add=True)
+    unfollowed = _follow_users(db, follower_id, [i for i, a in final.items() if a == "unfollow"], add=False)
+    db.commit()
+    for followed_id in followed:
+        follow_graph.follow_graph.add(follower_id, followed_id)
+    for followed_id in unfollowed:
+        follow_graph.follow_graph.remove(follower_id, followed_id)
+    applied = len(followed) + len(unfollowed)
+    if applied:
+        timeline.timeline_store.drop(follower_id)
+    return {"applied": applied, "skipped": len(operations) - applied}
+
+def create_comment_batch(db: Session, user_id: int, comments):
+    _require_ids(db, models.Discussion, [c.discussion_id for c in comments], "Discussions")
+    parent_ids = {c.parent_id for c in comments if c.parent_id is not None}
+    parents = {}
+    if parent_ids:
+        rows = db.query(models.Comment.id, models.Comment.discussion_id, models.Comment.depth).filter(models.Comment.id.in_(parent_ids))
+        parents = {row.id: row for row in rows}
+    for comment in comments:
+        if comment.parent_id is None:
+            continue
+        parent = parents.get(comment.parent_id)
+        if parent is None or parent.discussion_id != comment.discussion_id:
+            raise ValueError(f"Comment {comment.parent_id} not found in discussion {comment.discussion_id}")
+        if parent.depth + 1 >= COMMENT_PATH_MAX_DEPTH:
+            raise ValueError(f"Reply thread below comment {comment.parent_id} is too deep")
+    per_discussion = defaultdict(int)
+    created = []
+    if comments:
+        table = models.Comment.__table__
+        rows = [
+            {"text": c.text, "user_id": user_id, "discussion_id": c.discussion_id, "parent_id": c.parent_id}
+            for c in comments
+        ]
+        columns = (table.c.id, table.c.text, table.c.user_id, table.c.discussion_id, table.c.parent_id, table.c.created_on)
+        if db.connection().dialect.insert_executemany_returning_sort_by_parameter_order:
+            created = db.execute(insert(table).returning(*columns, sort_by_parameter_order=True), rows).all()
+        else:
+            # MySQL has no INSERT ... RETURNING, and a multi-row insert's ids need not be
+            # consecutive, so each row is inserted on its own to learn its id
+            ids = [db.execute(insert(table), row).inserted_primary_key[0] for row in rows]
+            created = db.execute(select(*columns).where(table.c.id.in_(ids)).order_by(table.c.id)).all()
+        for comment in comments:
+            per_discussion[comment.discussion_id] += 1
+        _bump_many(db, models.Discussion, models.Discussion.comment_count, per_discussion)
+        # Parents were checked to exist already, so they have their paths
+        fill_comment_paths(db, table.c.id.in_([comment.id for comment in created]))
+    db.commit()
+    for discussion_id, count in per_discussion.items():
+        ranking.discussion_ranking.record(discussion_id, comments=count)
+    response_cache.invalidate_discussions(per_discussion)
+    for comment in created:
+        events.publish_comment(comment)
+    return {"applied": len(comments), "skipped": 0}
+
+def comment_path_segment(comment_id: int):
+    digits = ""
+    while comment_id:
+        comment_id, remainder = divmod(comment_id, 36)
+        digits = _BASE36[remainder] + digits
+    return digits.rjust(COMMENT_PATH_SEGMENT, "0")
+
+def comment_path_end(path: str):
+    # Upper bound (exclusive) of the paths inside the subtree rooted at path
+    return path + "~"
+
+def _set_comment_path(db_comment: models.Comment, parent=None):
+    # parent is the (path, thread_root_id, depth) of the parent comment, None for a root
+    segment = comment_path_segment(db_comment.id)
+    if parent is None:
+        db_comment.path, db_comment.thread_root_id, db_comment.depth = segment, db_comment.id, 0
+    elif parent.path is not None:
+        db_comment.path, db_comment.thread_root_id, db_comment.depth = parent.path + segment, parent.thread_root_id, parent.depth + 1
+
+def fill_comment_paths(db: Session, condition=None, batch_size: int = 1000, commit: bool = False):
+    # Computes path/thread_root_id/depth for comments that have none, parents before their
+    # replies. Used after batch inserts and by the app.migrate backfill.
+    comments = models.Comment.__table__
+    parents = comments.alias("parents")
+    statement = select(comments.c.id, parents.c.id, parents.c.path, parents.c.thread_root_id, parents.c.depth).select_from(
+        comments.outerjoin(parents, parents.c.id == comments.c.parent_id)
+    ).where(comments.c.path.is_(None), or_(parents.c.id.is_(None), parents.c.path.isnot(None)))
+    if condition is not None:
+        statement = statement.where(condition)
+    statement = statement.order_by(comments.c.id).limit(batch_size)
+    updates = update(comments).where(comments.c.id == bindparam("comment_id")).values(
+        path=bindparam("new_path"), thread_root_id=bindparam("root_id"), depth=bindparam("new_depth")
+    )
+    filled = 0
+    while True:
+        rows = db.execute(statement).all()
+        if not rows:
+            return filled
+        values = []
+        for comment_id, parent_id, path, root_id, depth in rows:
+            segment = comment_path_segment(comment_id)
+            # Orphans and replies nested deeper than the path can hold start a thread of their own
+            if parent_id is None or depth + 1 >= COMMENT_PATH_MAX_DEPTH:
+                values.append({"comment_id": comment_id, "new_path": segment, "root_id": comment_id, "new_depth": 0})
+            else:
+                values.append({"comment_id": comment_id, "new_path": path + segment, "root_id": root_id, "new_depth": depth + 1})
+        db.execute(updates, values)
+        if commit:
+            db.commit()
+        filled += len(values)
 
 def create_comment(db: Session, comment: schemas.CommentCreate, user_id: int, discussion_id: int):
     db_comment = models.Comment(**comment.dict(), user_id=user_id, discussion_id=discussion_id)
     db.add(db_comment)
+    db.flush()
+    _set_comment_path(db_comment)
+    _bump(db, models.Discussion, discussion_id, models.Discussion.comment_count, 1)
     db.commit()
     db.refresh(db_comment)
+    ranking.discussion_ranking.record(discussion_id, comments=1)
+    response_cache.invalidate_discussions([discussion_id])
+    events.publish_comment(db_comment)
     return db_comment
 
 def get_comment(db: Session, comment_id: int):
     return db.query(models.Comment).filter(models.Comment.id == comment_id).first()
 
-def get_comments(db: Session, discussion_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Comment).filter(models.Comment.discussion_id == discussion_id).offset(skip).limit(limit).all()
-
 def like_discussion(db: Session, user_id: int, discussion_id: int):
-    db_like = models.Like(user_id=user_id, discussion_id=discussion_id)
-    db.add(db_like)
+    liked = bool(_like_discussions(db, user_id, [discussion_id], add=True))
     db.commit()
-    return db_like
+    if liked:
+        ranking.discussion_ranking.record(discussion_id, likes=1)
+        response_cache.invalidate_discussions([discussion_id])
+        events.publish_discussion_like(discussion_id, user_id)
+    return liked
 
 def unlike_discussion(db: Session, user_id: int, discussion_id: int):
-    db.query(models.Like).filter(
-        models.Like.user_id == user_id,
-        models.Like.discussion_id == discussion_id
-    ).delete()
+    unliked = bool(_like_discussions(db, user_id, [discussion_id], add=False))
     db.commit()
+    if unliked:
+        ranking.discussion_ranking.record(discussion_id, likes=-1)
+        response_cache.invalidate_discussions([discussion_id])
+    return unliked
 
 def increment_view_count(db: Session, discussion_id: int):
-    db_discussion = db.query(models.Discussion).filter(models.Discussion.id == discussion_id).first()
-    if db_discussion:
-        db_discussion.view_count += 1
-        db.commit()
-    return db_discussion
+    _bump(db, models.Discussion, discussion_id, models.Discussion.view_count, 1)
+    db.commit()
+    ranking.discussion_ranking.record(discussion_id, views=1)
+    return get_discussion(db, discussion_id)
+
+def add_view_counts(db: Session, counts):
+    # Views of ids with no discussion (never created, or deleted since) update nothing and
+    # are dropped; returns the counts that were applied
+    applied = {}
+    for discussion_id, count in sorted(counts.items()):
+        if _bump(db, models.Discussion, discussion_id, models.Discussion.view_count, count):
+            applied[discussion_id] = count
+    db.commit()
+    return applied
+
+def view_counts_added(counts):
+    # Rankings, once add_view_counts has committed. Cached responses keep their view
+    # counts until RESPONSE_CACHE_TTL runs out rather than being rebuilt on every flush.
+    for discussion_id, count in counts.items():
+        ranking.discussion_ranking.record(discussion_id, views=count)
+
+def _set_following(db: Session, follower_id: int, followed_id: int, follow: bool):
+    # One existence query for both users; the unique (follower_id, followed_id) key makes
+    # repeated follows no-ops without a separate is_following check
+    if len(_existing_ids(db, models.User, [follower_id, followed_id])) == len({follower_id, followed_id}):
+        if _follow_users(db, follower_id, [followed_id], add=follow):
+            db.commit()
+            if follow:
+                follow_graph.follow_graph.add(follower_id, followed_id)
+            else:
+                follow_graph.follow_graph.remove(follower_id, followed_id)
+            timeline.timeline_store.drop(follower_id)
+    return get_user(db, user_id=follower_id)
 
 def follow_user(db: Session, follower_id: int, followed_id: int):
-    follower = get_user(db, user_id=follower_id)
-    followed = get_user(db, user_id=followed_id)
-    if follower and followed:
-        follower.follow(followed)
-        db.commit()
-    return follower
+    return _set_following(db, follower_id, followed_id, follow=True)
 
 def unfollow_user(db: Session, follower_id: int, followed_id: int):
-    follower = get_user(db, user_id=follower_id)
-    followed = get_user(db, user_id=followed_id)
-    if follower and followed:
-        follower.unfollow(followed)
-        db.commit()
-    return follower
+    return _set_following(db, follower_id, followed_id, follow=False)
 
 def create_comment_reply(db: Session, comment: schemas.CommentCreate, user_id: int, discussion_id: int, parent_id: int):
+    parent = db.query(models.Comment.path, models.Comment.thread_root_id, models.Comment.depth).filter(models.Comment.id == parent_id).first()
+    if parent is None:
+        raise ValueError("Comment not found")
+    if parent.depth + 1 >= COMMENT_PATH_MAX_DEPTH:
+        raise ValueError("Reply thread is too deep")
     db_comment = models.Comment(**comment.dict(), user_id=user_id, discussion_id=discussion_id, parent_id=parent_id)
     db.add(db_comment)
+    db.flush()
+    _set_comment_path(db_comment, parent)
+    _bump(db, models.Discussion, discussion_id, models.Discussion.comment_count, 1)
     db.commit()
     db.refresh(db_comment)
+    ranking.discussion_ranking.record(discussion_id, comments=1)
+    response_cache.invalidate_discussions([discussion_id])
+    events.publish_comment(db_comment)
     return db_comment
 
 def like_comment(db: Session, user_id: int, comment_id: int):
-    db_like = models.CommentLike(user_id=user_id, comment_id=comment_id)
-    db.add(db_like)
+    liked = bool(_like_comments(db, user_id, [comment_id], add=True))
     db.commit()
-    return db_like
+    if liked:
+        for discussion_id in _invalidate_comments(db, [comment_id]).values():
+            events.publish_comment_like(comment_id, discussion_id, user_id)
+    return liked
 
 def unlike_comment(db: Session, user_id: int, comment_id: int):
-    db.query(models.CommentLike).filter(
-        models.CommentLike.user_id == user_id,
-        models.CommentLike.comment_id == comment_id
-    ).delete()
+    unliked = bool(_like_comments(db, user_id, [comment_id], add=False))
     db.commit()
+    if unliked:
+        _invalidate_comments(db, [comment_id])
+    return unliked
 
 def update_comment(db: Session, comment_id: int, comment_update: schemas.CommentCreate):
     db_comment = get_comment(db, comment_id)
@@ -169,12 +630,43 @@ def update_comment(db: Session, comment_id: int, comment_update: schemas.Comment
             setattr(db_comment, key, value)
         db.commit()
         db.refresh(db_comment)
+        response_cache.invalidate_discussions([db_comment.discussion_id])
     return db_comment
 
+def _reroot_replies(db: Session, db_comment: models.Comment):
+    # The replies of a deleted comment lose their parent and become top-level comments, so
+    # each reply's subtree drops the deleted comment's path prefix and depth and becomes a
+    # thread rooted at that reply. One statement per direct reply.
+    if db_comment.path is None:
+        return
+    comments = models.Comment.__table__
+    replies = db.execute(
+        select(comments.c.id, comments.c.path).where(comments.c.parent_id == db_comment.id, comments.c.path.isnot(None))
+    ).all()
+    if not replies:
+        return
+    shift = db_comment.depth + 1
+    updates = update(comments).where(
+        comments.c.discussion_id == db_comment.discussion_id,
+        comments.c.path >= bindparam("reply_path"),
+        comments.c.path < bindparam("reply_path_end"),
+    ).values(
+        path=func.substr(comments.c.path, len(db_comment.path) + 1),
+        depth=comments.c.depth - shift,
+        thread_root_id=bindparam("root_id"),
+    )
+    db.execute(updates, [
+        {"reply_path": path, "reply_path_end": comment_path_end(path), "root_id": reply_id} for reply_id, path in replies
+    ])
+
 def delete_comment(db: Session, comment_id: int):
     db_comment = get_comment(db, comment_id)
     if db_comment:
+        _reroot_replies(db, db_comment)
         db.delete(db_comment)
+        _bump(db, models.Discussion, db_comment.discussion_id, models.Discussion.comment_count, -1)
         db.commit()
+        ranking.discussion_ranking.record(db_comment.discussion_id, comments=-1)
+        response_cache.invalidate_discussions([db_comment.discussion_id])
         return True
     return False
\ No newline at end of file
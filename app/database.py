@@ -1,14 +1,37 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
+from . import metrics
 
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Set DATABASE_ASYNC=1 to serve the read endpoints and authentication through an AsyncSession.
+ASYNC_MODE = os.getenv("DATABASE_ASYNC", "").lower() in ("1", "true", "yes")
+
+connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
+
+def pool_options(url: str, is_async: bool = False):
+    # SQLite has no server-side connection limits worth tuning, so only the pre-ping applies there
+    options = {"pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")}
+    # Queue pools that time their checkouts for app/metrics.py; in-memory SQLite keeps its
+    # single-connection pool
+    if not url.startswith("sqlite") or make_url(url).database not in (None, "", ":memory:"):
+        options["poolclass"] = metrics.TimedAsyncAdaptedQueuePool if is_async else metrics.TimedQueuePool
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        )
+    return options
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **pool_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -19,4 +42,33 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def async_database_url(url: str):
+    scheme, _, rest = url.partition("://")
+    driver = {"sqlite": "sqlite+aiosqlite", "mysql": "mysql+aiomysql", "mysql+mysqldb": "mysql+aiomysql"}.get(scheme, scheme)
+    return f"{driver}://{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(SQLALCHEMY_DATABASE_URL)
+
+_async_engine = None
+_async_sessionmaker = None
+
+def get_async_engine():
+    # Created on first use so the async driver is only required when async mode is used
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        _async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, is_async=True))
+    return _async_engine
+
+def get_async_sessionmaker():
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import AsyncSession
+        _async_sessionmaker = sessionmaker(get_async_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
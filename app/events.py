@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict, deque
+import orjson
+from starlette.websockets import WebSocketDisconnect
+
+# Live events for clients that would otherwise poll. Writes publish after they commit, to the
+# channel of the discussion they touch and to the channel of the user who made them; a client
+# follows one discussion, or its feed, which is the channels of the accounts it follows.
+# Every subscriber has a bounded queue: one that falls EVENTS_QUEUE_SIZE events behind is
+# dropped rather than letting its backlog grow, and reconnects to catch up.
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+# Idle connections get a keepalive this often, so proxies do not time them out
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+# A feed subscription listens to at most this many of the accounts the user follows
+EVENTS_FEED_MAX_CHANNELS = int(os.getenv("EVENTS_FEED_MAX_CHANNELS", "5000"))
+
+logger = logging.getLogger(__name__)
+
+
+def discussion_channel(discussion_id: int):
+    return f"discussion:{discussion_id}"
+
+
+def user_channel(user_id: int):
+    return f"user:{user_id}"
+
+
+class SubscriptionClosed(Exception):
+    pass
+
+
+class SlowConsumer(SubscriptionClosed):
+    pass
+
+
+class Subscription:
+    # Lives on the event loop that serves the connection; only that loop touches the queue
+
+    __slots__ = ("channels", "loop", "max_queue", "dropped", "closed", "_queue", "_ready")
+
+    def __init__(self, channels, loop, max_queue: int):
+        self.channels = tuple(channels)
+        self.loop = loop
+        self.max_queue = max_queue
+        self.dropped = False
+        self.closed = False
+        self._queue = deque()
+        self._ready = asyncio.Event()
+
+    def _push(self, message: bytes):
+        if self.closed:
+            return
+        if len(self._queue) >= self.max_queue:
+            self.dropped = self.closed = True
+            self._queue.clear()
+        else:
+            self._queue.append(message)
+        self._ready.set()
+
+    def _close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def get(self, timeout: float = None):
+        # The next message, or None after timeout seconds without one. Raises SlowConsumer once
+        # the subscriber was dropped and SubscriptionClosed once the hub closed it.
+        while not self._queue:
+            if self.dropped:
+                raise SlowConsumer()
+            if self.closed:
+                raise SubscriptionClosed()
+            self._ready.clear()
+            # A timer rather than wait_for(), which would add a task per idle connection
+            timer = None if timeout is None else self.loop.call_later(timeout, self._ready.set)
+            try:
+                await self._ready.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            if not self._queue and not self.closed:
+                return None
+        return self._queue.popleft()
+
+
+class EventHub:
+    # Subscribers of this process by channel. deliver() may be called from any thread: the
+    # messages for each event loop are handed over with one call_soon_threadsafe per loop.
+
+    def __init__(self, max_queue: int = EVENTS_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def __len__(self):
+        with self._lock:
+            return len({subscription for subscribers in self._channels.values() for subscription in subscribers})
+
+    def subscribe(self, channels):
+        # Must be called on the loop that will read the subscription
+        subscription = Subscription(channels, asyncio.get_running_loop(), self.max_queue)
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+        subscription.closed = True
+
+    def _push_all(self, subscriptions, message: bytes):
+        for subscription in subscriptions:
+            subscription._push(message)
+            if subscription.dropped:
+                self.dropped += 1
+                logger.info("Dropped a slow event subscriber of %s", ", ".join(subscription.channels[:3]))
+                self.unsubscribe(subscription)
+
+    def _by_loop(self, subscriptions):
+        by_loop = defaultdict(list)
+        for subscription in subscriptions:
+            by_loop[subscription.loop].append(subscription)
+        return by_loop
+
+    def _hand_over(self, loop, callback, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            callback(*args)
+            return
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The loop is closed; its connections are gone
+            pass
+
+    def deliver(self, channels, message: bytes):
+        with self._lock:
+            subscriptions = set()
+            for channel in channels:
+                subscriptions.update(self._channels.get(channel, ()))
+        for loop, targets in self._by_loop(subscriptions).items():
+            self._hand_over(loop, self._push_all, targets, message)
+
+    def close_all(self):
+        # Ends every open stream, e.g. on shutdown
+        with self._lock:
+            subscriptions = {subscription for subscribers in self._channels.values() for subscription in subscribers}
+            self._channels.clear()
+        for loop, targets in self._by_loop(subscriptions).items():
+            self._hand_over(loop, lambda targets=targets: [subscription._close() for subscription in targets])
+
+
+class EventBroker:
+    # Carries published messages to the hubs that have subscribers. A broker shared between
+    # processes (e.g. Redis pub/sub) would publish to every channel and have a listener in each
+    # process call hub.deliver(); publish() runs in the request that made the change.
+
+    def publish(self, channels, message: bytes):
+        raise NotImplementedError
+
+
+class InProcessBroker(EventBroker):
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+
+    def publish(self, channels, message: bytes):
+        self.hub.deliver(channels, message)
+
+
+hub = EventHub()
+broker = InProcessBroker(hub)
+
+
+def set_broker(new_broker: EventBroker):
+    global broker
+    broker = new_broker
+
+
+def publish(event_type: str, channels, data: dict):
+    # Serialized once, however many subscribers get it; never fails the write that published
+    try:
+        broker.publish(channels, orjson.dumps({"type": event_type, **data}))
+    except Exception:
+        logger.exception("Failed to publish %s event", event_type)
+
+
+def publish_comment(comment):
+    publish("comment.created", [discussion_channel(comment.discussion_id), user_channel(comment.user_id)], {
+        "discussion_id": comment.discussion_id,
+        "comment": {
+            "id": comment.id,
+            "text": comment.text,
+            "user_id": comment.user_id,
+            "parent_id": comment.parent_id,
+            "created_on": comment.created_on,
+        },
+    })
+
+
+def publish_discussion_like(discussion_id: int, user_id: int):
+    publish("discussion.liked", [discussion_channel(discussion_id), user_channel(user_id)], {
+        "discussion_id": discussion_id, "user_id": user_id,
+    })
+
+
+def publish_comment_like(comment_id: int, discussion_id: int, user_id: int):
+    publish("comment.liked", [discussion_channel(discussion_id), user_channel(user_id)], {
+        "discussion_id": discussion_id, "comment_id": comment_id, "user_id": user_id,
+    })
+
+
+def publish_discussion(discussion):
+    publish("discussion.created", [user_channel(discussion.user_id)], {
+        "discussion_id": discussion.id, "user_id": discussion.user_id, "created_on": discussion.created_on,
+    })
+
+
+def sse_message(message: bytes):
+    return b"data: " + message + b"\n\n"
+
+
+async def sse_stream(channels, heartbeat: float = EVENTS_HEARTBEAT_SECONDS):
+    # Server-sent events. A dropped subscriber gets a final "dropped" event, so it knows to
+    # reconnect and reload instead of assuming it saw everything.
+    subscription = hub.subscribe(channels)
+    try:
+        yield b": connected\n\n"
+        while True:
+            try:
+                message = await subscription.get(heartbeat)
+            except SlowConsumer:
+                yield b"event: dropped\ndata: {}\n\n"
+                return
+            except SubscriptionClosed:
+                return
+            yield b": keepalive\n\n" if message is None else sse_message(message)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def websocket_stream(websocket, channels, heartbeat: float = EVENTS_HEARTBEAT_SECONDS):
+    # One JSON text frame per event. Keepalives double as the check that the client is still
+    # there, so an idle connection costs no reader task. A dropped subscriber is closed with
+    # 1013 (try again later).
+    subscription = hub.subscribe(channels)
+    try:
+        await websocket.accept()
+        while True:
+            try:
+                message = await subscription.get(heartbeat)
+            except SlowConsumer:
+                await websocket.close(code=1013)
+                return
+            except SubscriptionClosed:
+                await websocket.close(code=1001)
+                return
+            await websocket.send_text('{"type":"keepalive"}' if message is None else message.decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,199 @@
+import bisect
+import logging
+import os
+import threading
+from array import array
+from collections import Counter
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from . import models
+
+# Suggestions look at the follows of at most this many of the accounts a user follows
+FOLLOW_SUGGESTION_MAX_FRIENDS = int(os.getenv("FOLLOW_SUGGESTION_MAX_FRIENDS", "500"))
+# How often the in-memory graph is rebuilt from the followers table (other processes' follows)
+FOLLOW_GRAPH_RECONCILE_INTERVAL = float(os.getenv("FOLLOW_GRAPH_RECONCILE_INTERVAL", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+def _contains(ids: array, item_id: int):
+    index = bisect.bisect_left(ids, item_id)
+    return index < len(ids) and ids[index] == item_id
+
+
+def _after(ids, after_id, limit: int):
+    # ids sorted ascending; the page after after_id and the id to continue from, if any
+    start = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+    page = list(ids[start:start + limit])
+    return page, (page[-1] if start + limit < len(ids) and page else None)
+
+
+class FollowGraph:
+    # Both directions of the followers table as one sorted array('i') of user ids per user:
+    # 4 bytes per id plus one small array per user with any edges, instead of a Python int and
+    # a set slot per edge. Membership is a binary search over the follower's own follows.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._following = {}
+        self._followers = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(ids) for ids in self._following.values())
+
+    @staticmethod
+    def _insert(adjacency, user_id: int, item_id: int):
+        ids = adjacency.get(user_id)
+        if ids is None:
+            adjacency[user_id] = array("i", [item_id])
+            return True
+        index = bisect.bisect_left(ids, item_id)
+        if index < len(ids) and ids[index] == item_id:
+            return False
+        ids.insert(index, item_id)
+        return True
+
+    @staticmethod
+    def _delete(adjacency, user_id: int, item_id: int):
+        ids = adjacency.get(user_id)
+        if ids is None:
+            return
+        index = bisect.bisect_left(ids, item_id)
+        if index < len(ids) and ids[index] == item_id:
+            del ids[index]
+            if not ids:
+                del adjacency[user_id]
+
+    def add(self, follower_id: int, followed_id: int):
+        with self._lock:
+            if self._insert(self._following, follower_id, followed_id):
+                self._insert(self._followers, followed_id, follower_id)
+
+    def remove(self, follower_id: int, followed_id: int):
+        with self._lock:
+            self._delete(self._following, follower_id, followed_id)
+            self._delete(self._followers, followed_id, follower_id)
+
+    def is_following(self, follower_id: int, followed_id: int):
+        # Lock-free: dict.get and the bisect over an array both run without releasing the GIL,
+        # and rebuild() replaces the dicts instead of changing them
+        ids = self._following.get(follower_id)
+        return ids is not None and _contains(ids, followed_id)
+
+    def following_count(self, user_id: int):
+        with self._lock:
+            return len(self._following.get(user_id, ()))
+
+    def follower_count(self, user_id: int):
+        with self._lock:
+            return len(self._followers.get(user_id, ()))
+
+    def following(self, user_id: int, after_id: int = None, limit: int = 100):
+        with self._lock:
+            return _after(self._following.get(user_id, ()), after_id, limit)
+
+    def followers(self, user_id: int, after_id: int = None, limit: int = 100):
+        with self._lock:
+            return _after(self._followers.get(user_id, ()), after_id, limit)
+
+    def _mutual_ids(self, user_id: int):
+        # Merge of the two sorted arrays
+        following = self._following.get(user_id, ())
+        followers = self._followers.get(user_id, ())
+        mutual = []
+        i = j = 0
+        while i < len(following) and j < len(followers):
+            if following[i] == followers[j]:
+                mutual.append(following[i])
+                i += 1
+                j += 1
+            elif following[i] < followers[j]:
+                i += 1
+            else:
+                j += 1
+        return mutual
+
+    def mutual_count(self, user_id: int):
+        with self._lock:
+            return len(self._mutual_ids(user_id))
+
+    def mutuals(self, user_id: int, after_id: int = None, limit: int = 100):
+        # Users that user_id follows and who follow user_id back
+        with self._lock:
+            return _after(self._mutual_ids(user_id), after_id, limit)
+
+    def suggestions(self, user_id: int, limit: int = 10, max_friends: int = FOLLOW_SUGGESTION_MAX_FRIENDS):
+        # Friends of friends: accounts followed by the most of the people user_id follows, then
+        # by follower count. Returns (user_id, followed by this many of them) pairs.
+        with self._lock:
+            following = self._following.get(user_id, array("i"))
+            candidates = Counter()
+            for friend_id in following[:max_friends]:
+                candidates.update(self._following.get(friend_id, ()))
+            ranked = [
+                (-shared, -len(self._followers.get(candidate, ())), candidate)
+                for candidate, shared in candidates.items()
+                if candidate != user_id and not _contains(following, candidate)
+            ]
+        ranked.sort()
+        return [(candidate, -shared) for shared, _, candidate in ranked[:limit]]
+
+    def clear(self):
+        with self._lock:
+            self._following = {}
+            self._followers = {}
+
+    def rebuild(self, db: Session, batch_size: int = 10000):
+        # Reads the followers table in (follower_id, followed_id) order, so every following
+        # array is appended to in order; the followers arrays are sorted once at the end.
+        table = models.followers
+        statement = select(table.c.follower_id, table.c.followed_id).order_by(
+            table.c.follower_id, table.c.followed_id
+        ).execution_options(yield_per=batch_size)
+        following = {}
+        followers = {}
+        for partition in db.execute(statement).partitions():
+            for follower_id, followed_id in partition:
+                ids = following.get(follower_id)
+                if ids is None:
+                    ids = following[follower_id] = array("i")
+                ids.append(followed_id)
+                ids = followers.get(followed_id)
+                if ids is None:
+                    ids = followers[followed_id] = array("i")
+                ids.append(follower_id)
+        for user_id, ids in followers.items():
+            followers[user_id] = array("i", sorted(ids))
+        with self._lock:
+            self._following, self._followers = following, followers
+        return sum(len(ids) for ids in following.values())
+
+    def _run(self, session_factory, interval: float):
+        while not self._wake.wait(interval):
+            db = session_factory()
+            try:
+                self.rebuild(db)
+            except Exception:
+                logger.exception("Failed to reconcile the follow graph")
+            finally:
+                db.close()
+
+    def start(self, session_factory=SessionLocal, interval: float = FOLLOW_GRAPH_RECONCILE_INTERVAL):
+        if self._thread is not None:
+            return
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, args=(session_factory, interval), name="follow-graph-reconcile", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+
+follow_graph = FollowGraph()
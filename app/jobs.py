@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from . import models
+
+# Outbox job queue. A write calls enqueue() before committing, so its follow-up work is stored
+# in the same transaction, and notify() after; worker threads then claim due jobs in batches,
+# hand each kind's payloads to its handler in one call and delete them when it succeeds.
+# Delivery is at least once, so handlers must tolerate running a job twice.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "100"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# First retry delay in seconds; it doubles with each further attempt
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# A claimed job whose worker died is picked up again after this long
+JOB_LOCK_SECONDS = float(os.getenv("JOB_LOCK_SECONDS", "60"))
+# Run jobs in the writing request right after it commits, as if there were no queue
+JOB_QUEUE_INLINE = os.getenv("JOB_QUEUE_INLINE", "false").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def handler(kind: str):
+    # Registers fn(db, payloads) for a job kind; payloads is a list, oldest first
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(db: Session, kind: str, payload: dict):
+    db.add(models.OutboxJob(kind=kind, payload=json.dumps(payload)))
+
+
+class JobQueue:
+    def __init__(self, session_factory=SessionLocal, workers: int = JOB_WORKERS, batch_size: int = JOB_BATCH_SIZE,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retry_seconds: float = JOB_RETRY_SECONDS,
+                 poll_interval: float = JOB_POLL_INTERVAL, lock_seconds: float = JOB_LOCK_SECONDS,
+                 inline: bool = JOB_QUEUE_INLINE, clock=datetime.utcnow):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.poll_interval = poll_interval
+        self.lock_seconds = lock_seconds
+        self.inline = inline
+        self.clock = clock
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._local = threading.local()
+
+    def notify(self, db: Session = None):
+        # Called after a commit that enqueued jobs. Inline, they run right away on the caller's
+        # session, so a request never holds a second pooled connection while it waits for them.
+        if not self.inline:
+            self._wake.set()
+        elif not getattr(self._local, "draining", False):
+            # Handlers that enqueue more work are drained by the outer loop, not recursively
+            self.drain(db)
+
+    def _claim(self, db: Session):
+        # Marks up to batch_size due jobs with a fresh token and returns the ones this call got;
+        # the UPDATE re-checks the due condition, so two workers never both claim a job.
+        jobs = models.OutboxJob
+        now = self.clock()
+        due = or_(
+            and_(jobs.status == "pending", jobs.run_at <= now),
+            and_(jobs.status == "running", jobs.locked_until <= now),
+        )
+        ids = [row[0] for row in db.execute(select(jobs.id).where(due).order_by(jobs.id).limit(self.batch_size))]
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        db.execute(update(jobs).where(jobs.id.in_(ids), due).values(
+            status="running", claimed_by=token, attempts=jobs.attempts + 1,
+            locked_until=now + timedelta(seconds=self.lock_seconds),
+        ))
+        db.commit()
+        return db.execute(select(jobs.id, jobs.kind, jobs.payload, jobs.attempts).where(jobs.claimed_by == token).order_by(jobs.id)).all()
+
+    def _run(self, db: Session, kind: str, payloads):
+        fn = _handlers.get(kind)
+        if fn is None:
+            raise LookupError(f"No handler for job kind {kind}")
+        fn(db, payloads)
+
+    def _fail(self, db: Session, job, error: Exception):
+        jobs = models.OutboxJob
+        if job.attempts >= self.max_attempts:
+            logger.error("Job %s (%s) failed %d times, giving up: %s", job.id, job.kind, job.attempts, error)
+            values = {"status": "failed", "claimed_by": None, "locked_until": None}
+        else:
+            delay = self.retry_seconds * 2 ** (job.attempts - 1)
+            logger.warning("Job %s (%s) failed, retrying in %.0f s: %s", job.id, job.kind, delay, error)
+            values = {"status": "pending", "claimed_by": None, "locked_until": None,
+                      "run_at": self.clock() + timedelta(seconds=delay)}
+        db.execute(update(jobs).where(jobs.id == job.id).values(last_error=repr(error)[:2000], **values))
+        db.commit()
+
+    def run_batch(self, db: Session = None):
+        # Returns the number of jobs claimed. A kind whose batch fails is retried job by job,
+        # so one bad payload does not hold back the others.
+        own_session = db is None
+        if own_session:
+            db = self.session_factory()
+        try:
+            claimed = self._claim(db)
+            by_kind = defaultdict(list)
+            for job in claimed:
+                by_kind[job.kind].append(job)
+            for kind, batch in by_kind.items():
+                try:
+                    self._run(db, kind, [json.loads(job.payload) for job in batch])
+                    db.execute(delete(models.OutboxJob).where(models.OutboxJob.id.in_([job.id for job in batch])))
+                    db.commit()
+                    continue
+                except Exception as e:
+                    db.rollback()
+                    if len(batch) == 1:
+                        self._fail(db, batch[0], e)
+                        continue
+                for job in batch:
+                    try:
+                        self._run(db, kind, [json.loads(job.payload)])
+                        db.execute(delete(models.OutboxJob).where(models.OutboxJob.id == job.id))
+                        db.commit()
+                    except Exception as e:
+                        db.rollback()
+                        self._fail(db, job, e)
+            return len(claimed)
+        finally:
+            if own_session:
+                db.close()
+
+    def drain(self, db: Session = None):
+        # Runs batches until nothing is due; jobs waiting for a retry are left alone
+        self._local.draining = True
+        try:
+            processed = 0
+            while True:
+                count = self.run_batch(db)
+                if not count:
+                    return processed
+                processed += count
+        finally:
+            self._local.draining = False
+
+    def pending(self, db: Session):
+        return db.query(models.OutboxJob).filter(models.OutboxJob.status != "failed").count()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                count = self.run_batch()
+            except Exception:
+                logger.exception("Job worker failed to run a batch")
+                count = 0
+            if not count:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start(self):
+        if self._threads or self.inline:
+            return
+        self._stopping.clear()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        # Jobs still queued stay in the table for the next start
+        self._stopping.set()
+        for thread in self._threads:
+            # Set again each time: a worker that woke up for a job may have cleared it
+            while thread.is_alive():
+                self._wake.set()
+                thread.join(0.05)
+        self._threads = []
+
+
+job_queue = JobQueue()
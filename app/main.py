@@ -1,15 +1,86 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, WebSocket, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from typing import List
-from . import crud, models, schemas, auth
-from .database import SessionLocal, engine
-from .auth import get_current_user, create_access_token
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Union
+from . import async_routes, crud, events, follow_graph, jobs, metrics, models, projections, ranking, rate_limit, schemas, search, transfer, trending, auth
+from .response_cache import cached_response, discussion_tag, hashtag_tag, render
+from .serializers import respond
+from .views import view_aggregator
+from .passwords import PasswordHasherBusy, password_hasher
+from .database import ASYNC_MODE, SessionLocal, engine, get_async_engine
+from .replicas import ReadYourWritesMiddleware, RoutingSessionLocal, get_read_db, replica_pool
+from .auth import create_access_token
+
+get_current_user = auth.current_user_dependency
 
 models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
 
+if metrics.METRICS_ENABLED:
+    metrics.instrument_engine(engine)
+    for number, replica in enumerate(replica_pool.engines if replica_pool is not None else ()):
+        metrics.instrument_engine(replica, f"replica{number}")
+    if ASYNC_MODE:
+        metrics.instrument_engine(get_async_engine().sync_engine, "async")
+
+# The last one added runs first: metrics wrap rate limiting, so rejected requests are counted
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(rate_limit.RateLimitMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.on_event("startup")
+def start_view_aggregator():
+    view_aggregator.start()
+
+@app.on_event("startup")
+def build_in_memory_indexes():
+    db = SessionLocal()
+    try:
+        search.search_index.rebuild(db)
+        trending.trending_hashtags.rebuild(db)
+        ranking.discussion_ranking.rebuild(db)
+        follow_graph.follow_graph.rebuild(db)
+    finally:
+        db.close()
+    ranking.discussion_ranking.start()
+    follow_graph.follow_graph.start()
+
+@app.on_event("startup")
+def start_job_workers():
+    # Also picks up jobs left queued by a previous process
+    jobs.job_queue.start()
+    jobs.job_queue.notify()
+
+@app.on_event("shutdown")
+def stop_view_aggregator():
+    view_aggregator.stop()
+
+@app.on_event("shutdown")
+def stop_ranking_reconcile():
+    ranking.discussion_ranking.stop()
+
+@app.on_event("shutdown")
+def stop_follow_graph_reconcile():
+    follow_graph.follow_graph.stop()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    jobs.job_queue.stop()
+
+@app.on_event("shutdown")
+def close_event_streams():
+    events.hub.close_all()
+
+@app.on_event("shutdown")
+def stop_password_hasher():
+    password_hasher.shutdown()
+
+def password_hasher_busy():
+    return HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -20,16 +91,25 @@ def get_db():
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/token", response_model=schemas.Token)
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.authenticate_user(db, form_data.username, form_data.password)
+    try:
+        user = crud.authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": user.email, "user_id": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/users/", response_model=schemas.User)
@@ -38,50 +118,144 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         return crud.create_user(db=db, user=user)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
 
-@app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+@app.get("/users/", response_model=Union[List[schemas.User], schemas.UserPage])
+def read_users(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
+    if cursor is not None:
+        try:
+            users, next_cursor = projections.get_users_page(db, cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return respond(schemas.UserPage, {"items": users, "next_cursor": next_cursor})
+    users = projections.get_users(db, skip=skip, limit=limit)
+    return respond(List[schemas.User], users)
 
 @app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
+    db_user = crud.get_user_detail(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    return respond(schemas.User, db_user)
+
+def follow_page(db: Session, user_id: int, list_ids, total, cursor: Optional[str], limit: int):
+    # One page of user ids from the follow graph, resolved to summaries together with the user
+    try:
+        after_id = crud.decode_cursor(cursor, [models.User.id])[0] if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ids, next_id = list_ids(user_id, after_id, limit)
+    rows = projections.get_user_summaries(db, [user_id] + ids)
+    if not rows or rows[0].id != user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+    next_cursor = crud.encode_cursor([next_id]) if next_id is not None else None
+    return respond(schemas.UserSummaryPage, {"items": rows[1:], "next_cursor": next_cursor, "total": total(user_id)})
 
-@app.get("/users/search/", response_model=List[schemas.User])
-def search_users(name: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/users/{user_id}/followers", response_model=schemas.UserSummaryPage)
+def read_followers(user_id: int, cursor: Optional[str] = None, limit: int = 100, db: Session = Depends(get_read_db)):
+    graph = follow_graph.follow_graph
+    return follow_page(db, user_id, graph.followers, graph.follower_count, cursor, limit)
+
+@app.get("/users/{user_id}/following", response_model=schemas.UserSummaryPage)
+def read_following(user_id: int, cursor: Optional[str] = None, limit: int = 100, db: Session = Depends(get_read_db)):
+    graph = follow_graph.follow_graph
+    return follow_page(db, user_id, graph.following, graph.following_count, cursor, limit)
+
+@app.get("/users/{user_id}/mutuals", response_model=schemas.UserSummaryPage)
+def read_mutuals(user_id: int, cursor: Optional[str] = None, limit: int = 100, db: Session = Depends(get_read_db)):
+    graph = follow_graph.follow_graph
+    return follow_page(db, user_id, graph.mutuals, graph.mutual_count, cursor, limit)
+
+@app.get("/users/{user_id}/following/{target_id}", response_model=schemas.FollowStatus)
+def read_follow_status(user_id: int, target_id: int):
+    graph = follow_graph.follow_graph
+    return {"following": graph.is_following(user_id, target_id), "followed_by": graph.is_following(target_id, user_id)}
+
+@app.get("/users/{user_id}/suggestions", response_model=List[schemas.UserSuggestion])
+def read_follow_suggestions(user_id: int, limit: int = 10, db: Session = Depends(get_read_db)):
+    suggested = follow_graph.follow_graph.suggestions(user_id, limit=limit)
+    rows = projections.get_user_summaries(db, [user_id] + [candidate for candidate, _ in suggested])
+    if not rows or rows[0].id != user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+    shared = dict(suggested)
+    return respond(List[schemas.UserSuggestion], [{**row._asdict(), "followed_by_friends": shared[row.id]} for row in rows[1:]])
+
+@app.get("/users/search/", response_model=Union[List[schemas.User], schemas.UserPage])
+def search_users(name: str, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
+    if cursor is not None:
+        try:
+            users, next_cursor = projections.search_users_page(db, name=name, cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return respond(schemas.UserPage, {"items": users, "next_cursor": next_cursor})
     users = crud.search_users(db, name=name, skip=skip, limit=limit)
-    return users
+    return respond(List[schemas.User], users)
 
 @app.post("/discussions/", response_model=schemas.Discussion)
 def create_discussion(
     discussion: schemas.DiscussionCreate, 
     db: Session = Depends(get_db), 
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     return crud.create_discussion(db=db, discussion=discussion, user_id=current_user.id)
 
-@app.get("/discussions/", response_model=List[schemas.Discussion])
-def read_discussions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    discussions = crud.get_discussions(db, skip=skip, limit=limit)
-    return discussions
+@app.get("/discussions/", response_model=Union[List[schemas.Discussion], schemas.DiscussionPage])
+def read_discussions(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
+    if cursor is not None:
+        try:
+            discussions, next_cursor = projections.get_discussions_page(db, cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return respond(schemas.DiscussionPage, {"items": discussions, "next_cursor": next_cursor})
+    discussions = projections.get_discussions(db, skip=skip, limit=limit)
+    return respond(List[schemas.Discussion], discussions)
+
+@app.get("/discussions/search", response_model=List[schemas.Discussion])
+def search_discussions(q: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
+    return respond(List[schemas.Discussion], crud.search_discussions(db, q=q, skip=skip, limit=limit))
+
+@app.get("/discussions/hot", response_model=List[schemas.Discussion])
+def read_hot_discussions(skip: int = 0, limit: int = 20, db: Session = Depends(get_read_db)):
+    ids = ranking.discussion_ranking.hot(limit=limit, skip=skip)
+    return respond(List[schemas.Discussion], projections.get_discussions_by_ids(db, ids))
+
+@app.get("/discussions/top", response_model=List[schemas.Discussion])
+def read_top_discussions(window: str = "24h", skip: int = 0, limit: int = 20, db: Session = Depends(get_read_db)):
+    try:
+        ids = ranking.discussion_ranking.top(window=window, limit=limit, skip=skip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return respond(List[schemas.Discussion], projections.get_discussions_by_ids(db, ids))
+
+@app.get("/feed", response_model=schemas.DiscussionPage)
+def read_feed(
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.CurrentUser = Depends(get_current_user)
+):
+    try:
+        discussions, next_cursor = crud.get_feed(db, user_id=current_user.id, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return respond(schemas.DiscussionPage, {"items": discussions, "next_cursor": next_cursor})
 
 @app.get("/discussions/{discussion_id}", response_model=schemas.Discussion)
-def read_discussion(discussion_id: int, db: Session = Depends(get_db)):
-    db_discussion = crud.get_discussion(db, discussion_id=discussion_id)
-    if db_discussion is None:
-        raise HTTPException(status_code=404, detail="Discussion not found")
-    return db_discussion
+def read_discussion(discussion_id: int, request: Request, db: Session = Depends(get_read_db)):
+    def build():
+        db_discussion = crud.get_discussion_detail(db, discussion_id=discussion_id)
+        if db_discussion is None:
+            raise HTTPException(status_code=404, detail="Discussion not found")
+        return render(schemas.Discussion, db_discussion), [discussion_tag(discussion_id)]
+    return cached_response(request, build)
 
 @app.put("/discussions/{discussion_id}", response_model=schemas.Discussion)
 def update_discussion(
     discussion_id: int, 
     discussion: schemas.DiscussionCreate, 
     db: Session = Depends(get_db), 
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     db_discussion = crud.get_discussion(db, discussion_id=discussion_id)
     if db_discussion is None:
@@ -94,7 +268,7 @@ def update_discussion(
 def delete_discussion(
     discussion_id: int, 
     db: Session = Depends(get_db), 
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     db_discussion = crud.get_discussion(db, discussion_id=discussion_id)
     if db_discussion is None:
@@ -103,34 +277,105 @@ def delete_discussion(
         raise HTTPException(status_code=403, detail="Not authorized to delete this discussion")
     return crud.delete_discussion(db=db, discussion_id=discussion_id)
 
-@app.get("/discussions/hashtag/{hashtag}", response_model=List[schemas.Discussion])
+@app.get("/discussions/hashtag/{hashtag}", response_model=Union[List[schemas.Discussion], schemas.DiscussionPage])
 def read_discussions_by_hashtag(
+    request: Request,
     hashtag: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db)
 ):
-    discussions = crud.get_discussions_by_hashtag(db, hashtag=hashtag, skip=skip, limit=limit)
-    return discussions
+    def build():
+        if cursor is not None:
+            try:
+                discussions, next_cursor = projections.get_discussions_by_hashtag_page(db, hashtag=hashtag, cursor=cursor, limit=limit)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            body = render(schemas.DiscussionPage, {"items": discussions, "next_cursor": next_cursor})
+        else:
+            discussions = projections.get_discussions_by_hashtag(db, hashtag=hashtag, skip=skip, limit=limit)
+            body = render(List[schemas.Discussion], discussions)
+        tags = [hashtag_tag(crud.normalize_hashtag(hashtag))] + [discussion_tag(d.id) for d in discussions]
+        return body, tags
+    return cached_response(request, build)
+
+@app.get("/hashtags/trending", response_model=List[schemas.TrendingHashtag])
+def read_trending_hashtags(window: str = "1h", limit: int = 10):
+    try:
+        top = trending.trending_hashtags.top(window=window, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [{"name": name, "count": count} for name, count in top]
 
 @app.post("/discussions/{discussion_id}/comments/", response_model=schemas.Comment)
 def create_comment(
     discussion_id: int,
     comment: schemas.CommentCreate,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     return crud.create_comment(db=db, comment=comment, user_id=current_user.id, discussion_id=discussion_id)
 
-@app.get("/discussions/{discussion_id}/comments/", response_model=List[schemas.Comment])
-def read_comments(discussion_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_comments(db, discussion_id=discussion_id, skip=skip, limit=limit)
+@app.get("/discussions/{discussion_id}/comments/", response_model=Union[List[schemas.Comment], schemas.CommentPage])
+def read_comments(
+    discussion_id: int,
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    tree: bool = False,
+    max_depth: int = crud.COMMENT_TREE_MAX_DEPTH,
+    db: Session = Depends(get_read_db)
+):
+    # tree=true pages through the top-level comments only, each with its replies nested below
+    def build():
+        try:
+            if cursor is not None:
+                if tree:
+                    comments, next_cursor = projections.get_comment_tree_page(db, discussion_id=discussion_id, cursor=cursor, limit=limit, max_depth=max_depth)
+                else:
+                    comments, next_cursor = projections.get_comments_page(db, discussion_id=discussion_id, cursor=cursor, limit=limit)
+                body = render(schemas.CommentPage, {"items": comments, "next_cursor": next_cursor})
+            elif tree:
+                body = render(List[schemas.Comment], projections.get_comment_tree(db, discussion_id=discussion_id, skip=skip, limit=limit, max_depth=max_depth))
+            else:
+                body = render(List[schemas.Comment], projections.get_comments(db, discussion_id=discussion_id, skip=skip, limit=limit))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return body, [discussion_tag(discussion_id)]
+    return cached_response(request, build)
+
+@app.get("/comments/{comment_id}/thread", response_model=Union[schemas.Comment, schemas.CommentPage])
+def read_comment_thread(
+    comment_id: int,
+    request: Request,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    max_depth: int = crud.COMMENT_TREE_MAX_DEPTH,
+    db: Session = Depends(get_read_db)
+):
+    # With a cursor, pages through the direct replies instead of returning the comment itself
+    def build():
+        root = projections.get_thread_root(db, comment_id)
+        if root is None:
+            raise HTTPException(status_code=404, detail="Comment not found")
+        try:
+            if cursor is not None:
+                replies, next_cursor = projections.get_comment_thread_page(db, root, cursor=cursor, limit=limit, max_depth=max_depth)
+                body = render(schemas.CommentPage, {"items": replies, "next_cursor": next_cursor})
+            else:
+                body = render(schemas.Comment, projections.get_comment_thread(db, root, max_depth=max_depth))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return body, [discussion_tag(root.discussion_id)]
+    return cached_response(request, build)
 
 @app.post("/discussions/{discussion_id}/like", response_model=dict)
 def like_discussion(
     discussion_id: int,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     crud.like_discussion(db=db, user_id=current_user.id, discussion_id=discussion_id)
     return {"message": "Discussion liked successfully"}
@@ -139,21 +384,55 @@ def like_discussion(
 def unlike_discussion(
     discussion_id: int,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     crud.unlike_discussion(db=db, user_id=current_user.id, discussion_id=discussion_id)
     return {"message": "Discussion unliked successfully"}
 
-@app.post("/discussions/{discussion_id}/view", response_model=schemas.Discussion)
-def view_discussion(discussion_id: int, db: Session = Depends(get_db)):
-    return crud.increment_view_count(db=db, discussion_id=discussion_id)
+@app.post("/discussions/{discussion_id}/view", response_model=dict, status_code=202)
+def view_discussion(discussion_id: int):
+    view_aggregator.record(discussion_id)
+    return {"message": "View recorded"}
+
+@app.post("/batch/likes", response_model=schemas.BatchResult)
+def batch_likes(
+    batch: schemas.LikeBatch,
+    db: Session = Depends(get_db),
+    current_user: schemas.CurrentUser = Depends(get_current_user)
+):
+    try:
+        return crud.apply_like_batch(db=db, user_id=current_user.id, operations=batch.operations)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/batch/follows", response_model=schemas.BatchResult)
+def batch_follows(
+    batch: schemas.FollowBatch,
+    db: Session = Depends(get_db),
+    current_user: schemas.CurrentUser = Depends(get_current_user)
+):
+    try:
+        return crud.apply_follow_batch(db=db, follower_id=current_user.id, operations=batch.operations)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/batch/comments", response_model=schemas.BatchResult)
+def batch_comments(
+    batch: schemas.CommentBatch,
+    db: Session = Depends(get_db),
+    current_user: schemas.CurrentUser = Depends(get_current_user)
+):
+    try:
+        return crud.create_comment_batch(db=db, user_id=current_user.id, comments=batch.comments)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 @app.post("/users/{user_id}/follow/{target_id}", response_model=schemas.User)
 def follow_user(
     user_id: int,
     target_id: int,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to perform this action")
@@ -164,7 +443,7 @@ def unfollow_user(
     user_id: int,
     target_id: int,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to perform this action")
@@ -175,18 +454,21 @@ def create_comment_reply(
     comment_id: int,
     comment: schemas.CommentCreate,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     parent_comment = crud.get_comment(db, comment_id)
     if not parent_comment:
         raise HTTPException(status_code=404, detail="Comment not found")
-    return crud.create_comment_reply(db=db, comment=comment, user_id=current_user.id, discussion_id=parent_comment.discussion_id, parent_id=comment_id)
+    try:
+        return crud.create_comment_reply(db=db, comment=comment, user_id=current_user.id, discussion_id=parent_comment.discussion_id, parent_id=comment_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/comments/{comment_id}/like", response_model=dict)
 def like_comment(
     comment_id: int,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     crud.like_comment(db=db, user_id=current_user.id, comment_id=comment_id)
     return {"message": "Comment liked successfully"}
@@ -195,7 +477,7 @@ def like_comment(
 def unlike_comment(
     comment_id: int,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     crud.unlike_comment(db=db, user_id=current_user.id, comment_id=comment_id)
     return {"message": "Comment unliked successfully"}
@@ -205,7 +487,7 @@ def update_comment(
     comment_id: int,
     comment: schemas.CommentCreate,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     db_comment = crud.get_comment(db, comment_id=comment_id)
     if db_comment is None:
@@ -218,11 +500,89 @@ def update_comment(
 def delete_comment(
     comment_id: int,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.CurrentUser = Depends(get_current_user)
 ):
     db_comment = crud.get_comment(db, comment_id=comment_id)
     if db_comment is None:
         raise HTTPException(status_code=404, detail="Comment not found")
     if db_comment.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this comment")
-    return crud.delete_comment(db=db, comment_id=comment_id)
\ No newline at end of file
+    return crud.delete_comment(db=db, comment_id=comment_id)
+
+@app.get("/export", response_class=StreamingResponse)
+def export_graph(
+    types: Optional[str] = None,
+    current_user: schemas.CurrentUser = Depends(get_current_user)
+):
+    # Password hashes are never exported over HTTP; see app/transfer.py for the CLI
+    if not transfer.can_export(current_user.email):
+        raise HTTPException(status_code=403, detail="Not authorized to export")
+    requested = [kind.strip() for kind in types.split(",") if kind.strip()] if types else transfer.TYPES
+    try:
+        lines = transfer.export_ndjson(RoutingSessionLocal, types=requested)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+# Event streams stay open for as long as the client listens, so they look things up with a
+# session of their own instead of holding a pooled connection through a dependency
+def discussion_exists(discussion_id: int):
+    db = RoutingSessionLocal()
+    try:
+        return crud.get_discussion(db, discussion_id) is not None
+    finally:
+        db.close()
+
+def stream_user(token: str = Depends(auth.oauth2_scheme)):
+    db = SessionLocal()
+    try:
+        return auth.get_current_user(token, db)
+    finally:
+        db.close()
+
+def feed_channels(user_id: int):
+    followed, _ = follow_graph.follow_graph.following(user_id, limit=events.EVENTS_FEED_MAX_CHANNELS)
+    return [events.user_channel(followed_id) for followed_id in followed]
+
+def event_stream(channels):
+    return StreamingResponse(
+        events.sse_stream(channels),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/discussions/{discussion_id}/events", response_class=StreamingResponse)
+def discussion_events(discussion_id: int):
+    if not discussion_exists(discussion_id):
+        raise HTTPException(status_code=404, detail="Discussion not found")
+    return event_stream([events.discussion_channel(discussion_id)])
+
+@app.get("/feed/events", response_class=StreamingResponse)
+def feed_events(current_user: schemas.CurrentUser = Depends(stream_user)):
+    return event_stream(feed_channels(current_user.id))
+
+@app.websocket("/discussions/{discussion_id}/events/ws")
+async def discussion_events_ws(websocket: WebSocket, discussion_id: int):
+    if not await run_in_threadpool(discussion_exists, discussion_id):
+        await websocket.close(code=1008)
+        return
+    await events.websocket_stream(websocket, [events.discussion_channel(discussion_id)])
+
+@app.websocket("/feed/events/ws")
+async def feed_events_ws(websocket: WebSocket, token: Optional[str] = None):
+    # Browsers cannot set headers on a WebSocket, so the token may come as ?token=
+    authorization = websocket.headers.get("authorization", "")
+    token = token or (authorization[7:] if authorization[:7].lower() == "bearer " else None)
+    current_user = None
+    if token:
+        try:
+            current_user = await run_in_threadpool(stream_user, token)
+        except HTTPException:
+            pass
+    if current_user is None:
+        await websocket.close(code=1008)
+        return
+    await events.websocket_stream(websocket, feed_channels(current_user.id))
+
+if ASYNC_MODE:
+    async_routes.install(app)
@@ -0,0 +1,371 @@
+import bisect
+import contextvars
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Per-route request metrics and SQL instrumentation, rendered at GET /metrics in the Prometheus
+# text exposition format. The middleware in main.py opens a RequestStats for each request and
+# the engine hooks below add every statement (and every pool checkout) to it.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Statements slower than this are logged with their fingerprint; 0 disables the log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Adds a Server-Timing header (total, db and pool time, query count) to every response
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (cumulated when rendered), then sum and count
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            return series[2] if series else 0
+
+    def sum(self, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            return series[1] if series else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((label_values, (list(counts), total, count)) for label_values, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    # Read at scrape time from callback(), which returns {label values: value}
+    def __init__(self, name: str, documentation: str, callback, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labels = tuple(labels)
+
+    def clear(self):
+        pass
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status", ["method", "route", "status"]))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to produce the response", ["method", "route"]))
+http_request_queries = registry.register(Histogram(
+    "http_request_queries", "SQL statements executed per request", ["method", "route"], QUERY_COUNT_BUCKETS))
+http_request_db_duration = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per request", ["method", "route"]))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Duration of single SQL statements", ["engine"], QUERY_LATENCY_BUCKETS))
+db_slow_queries = registry.register(Counter(
+    "db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", ["engine"]))
+db_pool_checkout_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["engine"], QUERY_LATENCY_BUCKETS))
+db_pool_overflow_checkouts = registry.register(Counter(
+    "db_pool_overflow_checkouts_total", "Checkouts served by an overflow connection beyond pool_size", ["engine"]))
+
+_engines = {}
+
+
+def _pool_stats(method_name: str):
+    def collect():
+        values = {}
+        for name, instrumented in list(_engines.items()):
+            method = getattr(instrumented.pool, method_name, None)
+            if method is not None:
+                values[(name,)] = method()
+        return values
+    return collect
+
+
+registry.register(Gauge("db_pool_size", "Configured pool size", _pool_stats("size"), ["engine"]))
+registry.register(Gauge("db_pool_checked_out", "Connections currently checked out", _pool_stats("checkedout"), ["engine"]))
+registry.register(Gauge("db_pool_overflow", "Overflow connections currently open (negative: unused pool slots)",
+                        _pool_stats("overflow"), ["engine"]))
+
+
+class RequestStats:
+    __slots__ = ("started", "queries", "db_seconds", "pool_wait_seconds", "route")
+
+    def __init__(self, path: str = None):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        # The request path until routing is done, then the route template
+        self.route = path
+
+
+# Handlers run in a worker thread with a copy of the request's context, so the hooks below
+# still find the request's RequestStats; statements outside a request only count globally.
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+def start_request(path: str = None):
+    stats = RequestStats(path)
+    return stats, _current.set(stats)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def current_stats():
+    return _current.get()
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|(?<![:\w]):\w+")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_LISTS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    # Literals and bound parameters become ?, and IN lists or multi-row VALUES of any length
+    # collapse to (...), so one query shape always has one fingerprint
+    normalized = _PARAMETER.sub("?", _NUMBER.sub("?", _STRING.sub("?", statement)))
+    normalized = _LISTS.sub("(...)", _LIST.sub("(...)", normalized))
+    return _SPACE.sub(" ", normalized).strip()
+
+
+def fingerprint(statement: str) -> str:
+    return hashlib.sha1(normalize_statement(statement).encode()).hexdigest()[:16]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(name):
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_query_started"].pop()
+        elapsed = time.perf_counter() - started
+        db_query_duration.observe(elapsed, name)
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            db_slow_queries.inc(name)
+            logger.warning(
+                "Slow query %.1f ms on %s [%s] %s: %s", elapsed * 1000, name, fingerprint(statement),
+                stats.route if stats is not None else "-", normalize_statement(statement),
+            )
+    return after
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    started = context.connection.info.get("metrics_query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _checkout_finished(pool, elapsed: float):
+    name = next((name for name, engine in list(_engines.items()) if engine.pool is pool), None)
+    if name is None:
+        return
+    db_pool_checkout_wait.observe(elapsed, name)
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait_seconds += elapsed
+    if pool.overflow() > 0:
+        db_pool_overflow_checkouts.inc(name)
+
+
+class _TimedCheckouts:
+    # The pool has no event before a checkout blocks, so the wait is timed around connect().
+    # database.pool_options() hands these classes to create_engine(), and engine.dispose()
+    # recreates the pool with the same class; only pools of instrumented engines are counted.
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            _checkout_finished(self, time.perf_counter() - started)
+
+
+class TimedQueuePool(_TimedCheckouts, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckouts, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_engine(engine, name: str = "primary"):
+    if name in _engines:
+        return
+    _engines[name] = engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute(name))
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def record_request(method: str, route: str, status: int, stats: RequestStats):
+    elapsed = time.perf_counter() - stats.started
+    http_requests.inc(method, route, str(status))
+    http_request_duration.observe(elapsed, method, route)
+    http_request_queries.observe(stats.queries, method, route)
+    http_request_db_duration.observe(stats.db_seconds, method, route)
+    return elapsed
+
+
+def server_timing(stats: RequestStats, elapsed: float) -> str:
+    return (
+        f'total;dur={elapsed * 1000:.2f}, db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries", '
+        f"pool;dur={stats.pool_wait_seconds * 1000:.2f}"
+    )
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than @app.middleware("http"), which would copy every chunk of a
+    # long-lived streaming response through extra tasks and queues. Unmatched paths share one
+    # label so scanners cannot blow up the series.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        stats, token = start_request(scope["path"])
+        recorded = False
+
+        def record(status_code: int):
+            nonlocal recorded
+            recorded = True
+            route = scope.get("route")
+            stats.route = route.path if route is not None else "unmatched"
+            return record_request(scope["method"], stats.route, status_code, stats)
+
+        async def send_recorded(message):
+            # Recorded when the response starts, so a stream counts once, not when it ends
+            if message["type"] == "http.response.start" and not recorded:
+                elapsed = record(message["status"])
+                if METRICS_TIMING_HEADER:
+                    headers = list(message.get("headers", ()))
+                    headers.append((b"server-timing", server_timing(stats, elapsed).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_recorded)
+        finally:
+            if not recorded:
+                record(500)
+            finish_request(token)
@@ -0,0 +1,90 @@
+import argparse
+from sqlalchemy import UniqueConstraint, inspect, text
+from sqlalchemy.schema import CreateColumn
+from .database import SessionLocal
+from . import crud, models, reconcile
+
+# Brings a database created by an older version up to app/models.py. New databases get
+# everything from create_all() at startup; existing ones run `python -m app.migrate`. It only
+# adds what is missing (tables, columns, indexes, unique keys, FULLTEXT indexes) and then fills
+# in derived values, so it is safe to run more than once.
+
+BATCH_SIZE = 1000
+
+
+def _index_names(inspector, table_name: str):
+    names = {index["name"] for index in inspector.get_indexes(table_name)}
+    return names | {constraint["name"] for constraint in inspector.get_unique_constraints(table_name)}
+
+
+def _unique_constraints(table):
+    return [constraint for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+
+
+def upgrade_schema(bind):
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    changes = {"tables": [], "columns": [], "indexes": []}
+    # New tables come with their indexes and FULLTEXT indexes
+    models.Base.metadata.create_all(bind=bind)
+    with bind.begin() as connection:
+        for table in models.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                changes["tables"].append(table.name)
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    ddl = CreateColumn(column).compile(dialect=bind.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                    changes["columns"].append(f"{table.name}.{column.name}")
+    for table in models.Base.metadata.sorted_tables:
+        if table.name in changes["tables"]:
+            continue
+        existing = _index_names(inspect(bind), table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
+                changes["indexes"].append(index.name)
+        # Unique keys become unique indexes, which SQLite can add to an existing table; rows
+        # that break one have to be removed first
+        for constraint in _unique_constraints(table):
+            if constraint.name not in existing:
+                columns = ", ".join(column.name for column in constraint.columns)
+                with bind.begin() as connection:
+                    connection.execute(text(f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({columns})"))
+                changes["indexes"].append(constraint.name)
+        if bind.dialect.name == "mysql":
+            for fulltext_table, name, ddl in models.FULLTEXT_INDEXES:
+                if fulltext_table is table and name not in existing:
+                    with bind.begin() as connection:
+                        connection.execute(ddl)
+                    changes["indexes"].append(name)
+    return changes
+
+
+def migrate(db, batch_size: int = BATCH_SIZE):
+    changes = upgrade_schema(db.get_bind())
+    changes["comment paths"] = crud.fill_comment_paths(db, batch_size=batch_size, commit=True)
+    # New counter columns start at 0 and new unique keys may follow a clean-up of duplicates
+    counters = {f"{table.name}.{column}" for table, column, _ in reconcile._counter_updates()}
+    unique_keys = {constraint.name for table in models.Base.metadata.sorted_tables for constraint in _unique_constraints(table)}
+    if counters & set(changes["columns"]) or unique_keys & set(changes["indexes"]):
+        changes["counters"] = reconcile.reconcile_counters(db, batch_size=batch_size)
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add missing tables, columns and indexes, then backfill derived values.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    db = SessionLocal()
+    try:
+        for kind, done in migrate(db, batch_size=args.batch_size).items():
+            print(f"{kind}: {done}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
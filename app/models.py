@@ -1,16 +1,19 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Index, UniqueConstraint, DDL, event, exists
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import relationship, backref, object_session
 from .database import Base
 import datetime
 
 followers = Table('followers', Base.metadata,
     Column('follower_id', Integer, ForeignKey('users.id')),
-    Column('followed_id', Integer, ForeignKey('users.id'))
+    Column('followed_id', Integer, ForeignKey('users.id')),
+    UniqueConstraint('follower_id', 'followed_id', name='uq_followers_follower_id_followed_id')
 )
 
 discussion_hashtag = Table('discussion_hashtag', Base.metadata,
     Column('discussion_id', Integer, ForeignKey('discussions.id')),
-    Column('hashtag_id', Integer, ForeignKey('hashtags.id'))
+    Column('hashtag_id', Integer, ForeignKey('hashtags.id')),
+    Index('ix_discussion_hashtag_hashtag_id_discussion_id', 'hashtag_id', 'discussion_id')
 )
 
 class User(Base):
@@ -21,6 +24,8 @@ class User(Base):
     email = Column(String(255), unique=True, index=True)
     mobile_no = Column(String(15), unique=True, index=True)
     hashed_password = Column(String(255))
+    follower_count = Column(Integer, default=0, server_default="0", nullable=False)
+    following_count = Column(Integer, default=0, server_default="0", nullable=False)
     discussions = relationship("Discussion", back_populates="user")
     comments = relationship("Comment", back_populates="user")
     likes = relationship("Like", back_populates="user")
@@ -40,23 +45,33 @@ class User(Base):
             self.following.remove(user)
 
     def is_following(self, user):
-        return self.following.filter(followers.c.followed_id == user.id).count() > 0
+        # Always the database: the in-memory graph can be empty or stale outside the app's
+        # workers, and follow()/unfollow() must agree with the unique followers key
+        return object_session(self).query(exists().where(
+            followers.c.follower_id == self.id, followers.c.followed_id == user.id
+        )).scalar()
 
 class Discussion(Base):
     __tablename__ = "discussions"
 
     id = Column(Integer, primary_key=True, index=True)
-    text = Column(String(1000), index=True)
+    text = Column(String(1000))
     image = Column(String(255), nullable=True)
     created_on = Column(DateTime, default=datetime.datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"))
     view_count = Column(Integer, default=0)
+    like_count = Column(Integer, default=0, server_default="0", nullable=False)
+    comment_count = Column(Integer, default=0, server_default="0", nullable=False)
 
     user = relationship("User", back_populates="discussions")
     hashtags = relationship("Hashtag", secondary=discussion_hashtag, back_populates="discussions")
     comments = relationship("Comment", back_populates="discussion")
     likes = relationship("Like", back_populates="discussion")
 
+    __table_args__ = (
+        Index('ix_discussions_created_on_id', 'created_on', 'id'),
+    )
+
 class Hashtag(Base):
     __tablename__ = "hashtags"
 
@@ -74,12 +89,25 @@ class Comment(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     discussion_id = Column(Integer, ForeignKey("discussions.id"))
     parent_id = Column(Integer, ForeignKey('comments.id'), nullable=True)
+    like_count = Column(Integer, default=0, server_default="0", nullable=False)
+    # Materialized path: base-36 ids of the ancestors and the comment itself, 8 characters each.
+    # Subtree ranges end at path + "~", so it needs byte ordering; MySQL's default collation
+    # sorts "~" before digits and letters.
+    path = Column(String(512).with_variant(mysql.VARCHAR(512, charset="ascii", collation="ascii_bin"), "mysql"), nullable=True)
+    thread_root_id = Column(Integer, nullable=True)
+    depth = Column(Integer, default=0, server_default="0", nullable=False)
 
     user = relationship("User", back_populates="comments")
     discussion = relationship("Discussion", back_populates="comments")
     replies = relationship('Comment', backref=backref('parent', remote_side=[id]))
     likes = relationship('CommentLike', back_populates='comment')
 
+    __table_args__ = (
+        Index('ix_comments_discussion_id_created_on_id', 'discussion_id', 'created_on', 'id'),
+        Index('ix_comments_discussion_id_path', 'discussion_id', 'path'),
+        Index('ix_comments_discussion_id_depth_path', 'discussion_id', 'depth', 'path'),
+    )
+
 class Like(Base):
     __tablename__ = "likes"
 
@@ -90,10 +118,51 @@ class Like(Base):
     user = relationship("User", back_populates="likes")
     discussion = relationship("Discussion", back_populates="likes")
 
+    __table_args__ = (
+        UniqueConstraint('user_id', 'discussion_id', name='uq_likes_user_id_discussion_id'),
+    )
+
 class CommentLike(Base):
     __tablename__ = 'comment_likes'
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     comment_id = Column(Integer, ForeignKey('comments.id'))
     user = relationship('User', back_populates='comment_likes')
-    comment = relationship('Comment', back_populates='likes')
\ No newline at end of file
+    comment = relationship('Comment', back_populates='likes')
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'comment_id', name='uq_comment_likes_user_id_comment_id'),
+    )
+
+class OutboxJob(Base):
+    # Side effects of a write, inserted in the write's transaction and run by app/jobs.py
+    __tablename__ = "outbox_jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(64), nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String(16), default="pending", server_default="pending", nullable=False)
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)
+    run_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    claimed_by = Column(String(32), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_on = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_outbox_jobs_status_run_at', 'status', 'run_at'),
+        Index('ix_outbox_jobs_claimed_by', 'claimed_by'),
+    )
+
+# FULLTEXT indexes back search on MySQL; other databases use the in-process index in search.py.
+# (table, index name, DDL), also used by app/migrate.py for existing tables.
+FULLTEXT_INDEXES = [
+    (table, name, DDL(f"CREATE FULLTEXT INDEX {name} ON {table.name} ({column})"))
+    for table, name, column in [
+        (User.__table__, "ix_users_name_fulltext", "name"),
+        (Discussion.__table__, "ix_discussions_text_fulltext", "text"),
+        (Hashtag.__table__, "ix_hashtags_name_fulltext", "name"),
+    ]
+]
+for fulltext_table, _, fulltext_ddl in FULLTEXT_INDEXES:
+    event.listen(fulltext_table, "after_create", fulltext_ddl.execute_if(dialect="mysql"))
@@ -0,0 +1,96 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from passlib.context import CryptContext
+
+# bcrypt is CPU-bound by design, so hashing runs in a small dedicated process pool instead of
+# on the request threads. At most PASSWORD_HASH_QUEUE operations may be queued or running;
+# anything beyond that is rejected straight away with PasswordHasherBusy.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", str(max(1, PASSWORD_HASH_WORKERS) * 8)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+
+# min_rounds equal to the default makes needs_update() flag hashes made with a lower cost,
+# so they are transparently upgraded on the next successful login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE,
+                 timeout: float = PASSWORD_HASH_TIMEOUT):
+        # workers=0 hashes on the calling thread, still bounded by queue_size
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Too many password operations in progress")
+        if self.workers == 0:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is freed when the work ends, not when the caller gives up waiting, so work
+        # left behind by a timeout still counts against the queue
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            raise PasswordHasherBusy("Password operation timed out")
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password)
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        return self._run(_verify, password, hashed_password)
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(password: str) -> str:
+    return password_hasher.hash(password)
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return password_hasher.verify(password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
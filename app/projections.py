@@ -0,0 +1,270 @@
+from collections import defaultdict, namedtuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from . import models, search
+from .crud import COMMENT_TREE_MAX_DEPTH, comment_path_end, decode_cursor, encode_cursor, keyset_condition, normalize_hashtag
+
+# Lean read layer behind the list endpoints. Each query is a Core select() of only the columns
+# the response schemas render (no hashed_password, no identity map, no instrumentation), and
+# results come back as named tuples that both pydantic and app/serializers.py can read.
+users = models.User.__table__
+discussions = models.Discussion.__table__
+comments = models.Comment.__table__
+hashtags = models.Hashtag.__table__
+discussion_hashtag = models.discussion_hashtag
+
+USER_COLUMNS = (users.c.id, users.c.name, users.c.email, users.c.mobile_no, users.c.follower_count, users.c.following_count)
+DISCUSSION_COLUMNS = (
+    discussions.c.id, discussions.c.text, discussions.c.image, discussions.c.created_on, discussions.c.user_id,
+    discussions.c.view_count, discussions.c.like_count, discussions.c.comment_count,
+)
+COMMENT_COLUMNS = (
+    comments.c.id, comments.c.text, comments.c.created_on, comments.c.user_id, comments.c.discussion_id,
+    comments.c.parent_id, comments.c.thread_root_id, comments.c.depth, comments.c.like_count,
+)
+
+HashtagRow = namedtuple("HashtagRow", ["id", "name"])
+UserRow = namedtuple("UserRow", [column.key for column in USER_COLUMNS] + ["discussions"])
+UserSummaryRow = namedtuple("UserSummaryRow", ["id", "name", "follower_count", "following_count"])
+DiscussionRow = namedtuple("DiscussionRow", [column.key for column in DISCUSSION_COLUMNS] + ["hashtags", "comments"])
+CommentRow = namedtuple("CommentRow", [column.key for column in COMMENT_COLUMNS] + ["replies"])
+
+
+def _page(db: Session, statement, columns, cursor: str = None, limit: int = 100, descending: bool = False):
+    # Keyset pagination over a Core statement, with the cursors of app/crud.py
+    if cursor:
+        statement = statement.where(keyset_condition(columns, decode_cursor(cursor, columns), descending))
+    statement = statement.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    rows = db.execute(statement.limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]._mapping[column] for column in columns])
+    return rows, next_cursor
+
+
+def _hashtags_by_discussion(db: Session, discussion_ids):
+    by_discussion = defaultdict(list)
+    if discussion_ids:
+        rows = db.execute(
+            select(discussion_hashtag.c.discussion_id, hashtags.c.id, hashtags.c.name)
+            .join(hashtags, hashtags.c.id == discussion_hashtag.c.hashtag_id)
+            .where(discussion_hashtag.c.discussion_id.in_(discussion_ids))
+            .order_by(hashtags.c.id)
+        )
+        for discussion_id, hashtag_id, name in rows:
+            by_discussion[discussion_id].append(HashtagRow(hashtag_id, name))
+    return by_discussion
+
+
+def _comments_by_discussion(db: Session, discussion_ids):
+    # Every comment of each discussion with its replies linked up in memory, like
+    # crud.attach_comment_replies does for Discussion.comments
+    by_discussion = defaultdict(list)
+    if discussion_ids:
+        rows = db.execute(select(*COMMENT_COLUMNS).where(comments.c.discussion_id.in_(discussion_ids)).order_by(comments.c.id))
+        by_id = {}
+        for row in rows:
+            comment = CommentRow(*row, [])
+            by_id[comment.id] = comment
+            by_discussion[comment.discussion_id].append(comment)
+        for comment in by_id.values():
+            parent = by_id.get(comment.parent_id)
+            if parent is not None:
+                parent.replies.append(comment)
+    return by_discussion
+
+
+def _discussion_rows(db: Session, rows):
+    ids = [row.id for row in rows]
+    hashtags_by_discussion = _hashtags_by_discussion(db, ids)
+    comments_by_discussion = _comments_by_discussion(db, ids)
+    return [DiscussionRow(*row, hashtags_by_discussion.get(row.id, []), comments_by_discussion.get(row.id, [])) for row in rows]
+
+
+def _user_rows(db: Session, rows):
+    by_user = defaultdict(list)
+    ids = [row.id for row in rows]
+    if ids:
+        discussion_rows = db.execute(select(*DISCUSSION_COLUMNS).where(discussions.c.user_id.in_(ids)).order_by(discussions.c.id)).all()
+        for discussion in _discussion_rows(db, discussion_rows):
+            by_user[discussion.user_id].append(discussion)
+    return [UserRow(*row, by_user.get(row.id, [])) for row in rows]
+
+
+def _comment_trees(db: Session, rows, max_depth: int = COMMENT_TREE_MAX_DEPTH):
+    # Loads the replies below an arbitrary page of comments one level at a time, so the cost
+    # is one query per tree level rather than one per comment
+    top = [CommentRow(*row, []) for row in rows]
+    level = top
+    depth = 0
+    while level and depth < max_depth:
+        by_id = {comment.id: comment for comment in level}
+        replies = db.execute(select(*COMMENT_COLUMNS).where(comments.c.parent_id.in_(list(by_id))).order_by(comments.c.id))
+        level = []
+        for row in replies:
+            reply = CommentRow(*row, [])
+            by_id[reply.parent_id].replies.append(reply)
+            level.append(reply)
+        depth += 1
+    return top
+
+
+def get_users(db: Session, skip: int = 0, limit: int = 100):
+    rows = db.execute(select(*USER_COLUMNS).order_by(users.c.id).offset(skip).limit(limit)).all()
+    return _user_rows(db, rows)
+
+
+def get_users_page(db: Session, cursor: str = None, limit: int = 100):
+    rows, next_cursor = _page(db, select(*USER_COLUMNS), [users.c.id], cursor, limit)
+    return _user_rows(db, rows), next_cursor
+
+
+def search_users_page(db: Session, name: str, cursor: str = None, limit: int = 100):
+    # Pages through the search backend's ranking, so the cursor is a position in it rather
+    # than a key
+    skip = decode_cursor(cursor, [users.c.id])[0] if cursor else 0
+    if skip < 0:
+        raise ValueError("Invalid cursor")
+    ids = search.search_index.search_users(db, name, skip=skip, limit=limit + 1)
+    next_cursor = encode_cursor([skip + limit]) if len(ids) > limit else None
+    ids = ids[:limit]
+    rows = db.execute(select(*USER_COLUMNS).where(users.c.id.in_(ids))).all() if ids else []
+    by_id = {row.id: row for row in rows}
+    return _user_rows(db, [by_id[i] for i in ids if i in by_id]), next_cursor
+
+
+def get_user_summaries(db: Session, ids):
+    # Keeps the order of ids, which come from the follow graph; unknown ids are left out
+    if not ids:
+        return []
+    rows = db.execute(
+        select(users.c.id, users.c.name, users.c.follower_count, users.c.following_count).where(users.c.id.in_(set(ids)))
+    ).all()
+    by_id = {row.id: UserSummaryRow(*row) for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def get_discussions(db: Session, skip: int = 0, limit: int = 100):
+    rows = db.execute(select(*DISCUSSION_COLUMNS).order_by(discussions.c.id).offset(skip).limit(limit)).all()
+    return _discussion_rows(db, rows)
+
+
+def get_discussions_page(db: Session, cursor: str = None, limit: int = 100):
+    columns = [discussions.c.created_on, discussions.c.id]
+    rows, next_cursor = _page(db, select(*DISCUSSION_COLUMNS), columns, cursor, limit, descending=True)
+    return _discussion_rows(db, rows), next_cursor
+
+
+def get_discussions_by_ids(db: Session, ids):
+    # Keeps the order of ids, which come from a ranking
+    if not ids:
+        return []
+    rows = db.execute(select(*DISCUSSION_COLUMNS).where(discussions.c.id.in_(ids))).all()
+    by_id = {row.id: row for row in rows}
+    return _discussion_rows(db, [by_id[i] for i in ids if i in by_id])
+
+
+def _by_hashtag(hashtag: str):
+    return select(*DISCUSSION_COLUMNS).join(
+        discussion_hashtag, discussion_hashtag.c.discussion_id == discussions.c.id
+    ).join(
+        hashtags, hashtags.c.id == discussion_hashtag.c.hashtag_id
+    ).where(hashtags.c.name == normalize_hashtag(hashtag))
+
+
+def get_discussions_by_hashtag(db: Session, hashtag: str, skip: int = 0, limit: int = 100):
+    rows = db.execute(_by_hashtag(hashtag).order_by(discussions.c.id).offset(skip).limit(limit)).all()
+    return _discussion_rows(db, rows)
+
+
+def get_discussions_by_hashtag_page(db: Session, hashtag: str, cursor: str = None, limit: int = 100):
+    columns = [discussions.c.created_on, discussions.c.id]
+    rows, next_cursor = _page(db, _by_hashtag(hashtag), columns, cursor, limit, descending=True)
+    return _discussion_rows(db, rows), next_cursor
+
+
+def get_comments(db: Session, discussion_id: int, skip: int = 0, limit: int = 100):
+    statement = select(*COMMENT_COLUMNS).where(comments.c.discussion_id == discussion_id)
+    rows = db.execute(statement.order_by(comments.c.id).offset(skip).limit(limit)).all()
+    return _comment_trees(db, rows)
+
+
+def get_comments_page(db: Session, discussion_id: int, cursor: str = None, limit: int = 100):
+    statement = select(*COMMENT_COLUMNS).where(comments.c.discussion_id == discussion_id)
+    rows, next_cursor = _page(db, statement, [comments.c.created_on, comments.c.id], cursor, limit)
+    return _comment_trees(db, rows), next_cursor
+
+
+def _subtrees(db: Session, siblings, condition, max_depth: int):
+    # One range scan over the paths from the first to the last sibling loads all of their
+    # descendants; rows arrive depth first, so every parent is seen before its replies.
+    if not siblings:
+        return []
+    base_depth = siblings[0].depth
+    rows = db.execute(
+        select(*COMMENT_COLUMNS).where(
+            condition,
+            comments.c.path >= siblings[0].path,
+            comments.c.path < comment_path_end(siblings[-1].path),
+            comments.c.depth <= base_depth + max_depth,
+        ).order_by(comments.c.path)
+    )
+    top = []
+    by_id = {}
+    for row in rows:
+        comment = CommentRow(*row, [])
+        by_id[comment.id] = comment
+        if comment.depth == base_depth:
+            top.append(comment)
+        elif comment.parent_id in by_id:
+            by_id[comment.parent_id].replies.append(comment)
+    return top
+
+
+def _tree_page(db: Session, condition, depth: int, within: str = None, skip: int = 0, cursor: str = None,
+               limit: int = 100, max_depth: int = COMMENT_TREE_MAX_DEPTH):
+    # Siblings at `depth` (optionally below the path `within`) in path order, i.e. oldest first
+    if max_depth < 0:
+        raise ValueError("max_depth must not be negative")
+    statement = select(comments.c.id, comments.c.path, comments.c.depth).where(condition, comments.c.depth == depth)
+    if within is not None:
+        statement = statement.where(comments.c.path > within, comments.c.path < comment_path_end(within))
+    if cursor is None:
+        siblings = db.execute(statement.order_by(comments.c.path).offset(skip).limit(limit)).all()
+        next_cursor = None
+    else:
+        siblings, next_cursor = _page(db, statement, [comments.c.path], cursor, limit)
+    return _subtrees(db, siblings, condition, max_depth), next_cursor
+
+
+def get_comment_tree(db: Session, discussion_id: int, skip: int = 0, limit: int = 100, max_depth: int = COMMENT_TREE_MAX_DEPTH):
+    condition = comments.c.discussion_id == discussion_id
+    return _tree_page(db, condition, 0, skip=skip, limit=limit, max_depth=max_depth)[0]
+
+
+def get_comment_tree_page(db: Session, discussion_id: int, cursor: str = None, limit: int = 100, max_depth: int = COMMENT_TREE_MAX_DEPTH):
+    condition = comments.c.discussion_id == discussion_id
+    return _tree_page(db, condition, 0, cursor=cursor or "", limit=limit, max_depth=max_depth)
+
+
+def get_thread_root(db: Session, comment_id: int):
+    # (discussion_id, path, depth) of a comment whose path has been set, else None
+    root = db.execute(
+        select(comments.c.discussion_id, comments.c.path, comments.c.depth).where(comments.c.id == comment_id)
+    ).first()
+    return root if root is not None and root.path is not None else None
+
+
+def get_comment_thread(db: Session, root, max_depth: int = COMMENT_TREE_MAX_DEPTH):
+    # The comment with its replies down to max_depth levels below it
+    if max_depth < 0:
+        raise ValueError("max_depth must not be negative")
+    return _subtrees(db, [root], comments.c.discussion_id == root.discussion_id, max_depth)[0]
+
+
+def get_comment_thread_page(db: Session, root, cursor: str = None, limit: int = 100, max_depth: int = COMMENT_TREE_MAX_DEPTH):
+    # A page of the direct replies to the comment, each with its own replies below it
+    condition = comments.c.discussion_id == root.discussion_id
+    return _tree_page(db, condition, root.depth + 1, within=root.path, cursor=cursor or "", limit=limit,
+                      max_depth=max_depth)
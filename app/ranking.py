@@ -0,0 +1,250 @@
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from . import models
+
+RANKING_LIKE_WEIGHT = float(os.getenv("RANKING_LIKE_WEIGHT", "1"))
+RANKING_COMMENT_WEIGHT = float(os.getenv("RANKING_COMMENT_WEIGHT", "2"))
+RANKING_VIEW_WEIGHT = float(os.getenv("RANKING_VIEW_WEIGHT", "0.05"))
+# A discussion needs ten times the engagement to rank level with one this many seconds newer
+RANKING_DECAY_SECONDS = float(os.getenv("RANKING_DECAY_SECONDS", "45000"))
+# How often the in-memory scores are rebuilt from the discussions table
+RANKING_RECONCILE_INTERVAL = float(os.getenv("RANKING_RECONCILE_INTERVAL", "600"))
+
+WINDOWS = {"24h": 24 * 60 * 60, "7d": 7 * 24 * 60 * 60, "30d": 30 * 24 * 60 * 60}
+
+logger = logging.getLogger(__name__)
+
+
+class RankedSet:
+    # Max-heap of (score, id) with lazy deletion: an update pushes a new entry and the old one
+    # is dropped when it reaches the top. The heap is compacted once stale entries dominate.
+
+    def __init__(self):
+        self._scores = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, item_id):
+        return item_id in self._scores
+
+    def set(self, item_id: int, score: float):
+        if self._scores.get(item_id) == score:
+            return
+        self._scores[item_id] = score
+        heapq.heappush(self._heap, (-score, -item_id))
+        self._compact()
+
+    def remove(self, item_id: int):
+        if self._scores.pop(item_id, None) is not None:
+            self._compact()
+
+    def _stale(self, entry):
+        return self._scores.get(-entry[1]) != -entry[0]
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._scores) + 64:
+            self._heap = [(-score, -item_id) for item_id, score in self._scores.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, limit: int, skip: int = 0):
+        # Pops the best live entries and pushes them back: O((skip + limit) log n)
+        taken = []
+        seen = set()
+        while self._heap and len(taken) < skip + limit:
+            entry = heapq.heappop(self._heap)
+            if not self._stale(entry) and entry[1] not in seen:
+                seen.add(entry[1])
+                taken.append(entry)
+        for entry in taken:
+            heapq.heappush(self._heap, entry)
+        return [(-item_id, -score) for score, item_id in taken[skip:]]
+
+
+class DiscussionRanking:
+    # Hot and top scores of the discussions created in the longest window, updated in place as
+    # likes, comments and views come in. The hot score is log10(engagement) + created/decay,
+    # which keeps its order as time passes, so nothing has to be rescored as discussions age.
+
+    def __init__(self, windows=WINDOWS, clock=time.time, like_weight: float = RANKING_LIKE_WEIGHT,
+                 comment_weight: float = RANKING_COMMENT_WEIGHT, view_weight: float = RANKING_VIEW_WEIGHT,
+                 decay_seconds: float = RANKING_DECAY_SECONDS):
+        self.windows = dict(windows)
+        self.clock = clock
+        self.weights = (like_weight, comment_weight, view_weight)
+        self.decay_seconds = decay_seconds
+        self._retention = max(self.windows.values())
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        # Changes made while rebuild() reads the database, replayed onto the rebuilt scores
+        self._pending = None
+        self._reset()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _reset(self):
+        self._stats = {}
+        self._hot = RankedSet()
+        self._top = {name: RankedSet() for name in self.windows}
+        self._by_age = {name: deque() for name in self.windows}
+
+    def engagement(self, likes: int, comments: int, views: int):
+        like_weight, comment_weight, view_weight = self.weights
+        return likes * like_weight + comments * comment_weight + views * view_weight
+
+    def hot_score(self, engagement: float, created: float):
+        return math.log10(max(engagement, 1)) + created / self.decay_seconds
+
+    def _expire(self, now: float):
+        for name, span in self.windows.items():
+            queue = self._by_age[name]
+            while queue and queue[0][0] <= now - span:
+                _, discussion_id = queue.popleft()
+                self._top[name].remove(discussion_id)
+                if span == self._retention:
+                    self._stats.pop(discussion_id, None)
+                    self._hot.remove(discussion_id)
+
+    def _score(self, discussion_id: int):
+        stats = self._stats[discussion_id]
+        engagement = self.engagement(*stats[:3])
+        self._hot.set(discussion_id, self.hot_score(engagement, stats[3]))
+        for ranked in self._top.values():
+            if discussion_id in ranked:
+                ranked.set(discussion_id, engagement)
+
+    def _add(self, discussion_id: int, created: float, likes: int, comments: int, views: int, now: float):
+        if discussion_id in self._stats or created <= now - self._retention:
+            return
+        self._stats[discussion_id] = [likes, comments, views, created]
+        engagement = self.engagement(likes, comments, views)
+        self._hot.set(discussion_id, self.hot_score(engagement, created))
+        for name, span in self.windows.items():
+            if created > now - span:
+                self._by_age[name].append((created, discussion_id))
+                self._top[name].set(discussion_id, engagement)
+
+    def _record(self, discussion_id: int, likes: int, comments: int, views: int):
+        stats = self._stats.get(discussion_id)
+        if stats is None:
+            return
+        stats[0] += likes
+        stats[1] += comments
+        stats[2] += views
+        self._score(discussion_id)
+
+    def _remove(self, discussion_id: int):
+        # Age queues keep the id until it expires; a missing stats entry makes that harmless
+        self._stats.pop(discussion_id, None)
+        self._hot.remove(discussion_id)
+        for ranked in self._top.values():
+            ranked.remove(discussion_id)
+
+    def add(self, discussion_id: int, created: float, likes: int = 0, comments: int = 0, views: int = 0):
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            self._add(discussion_id, created, likes, comments, views, now)
+            if self._pending is not None:
+                self._pending.append(("add", discussion_id, created, likes, comments, views))
+
+    def record(self, discussion_id: int, likes: int = 0, comments: int = 0, views: int = 0):
+        with self._lock:
+            self._record(discussion_id, likes, comments, views)
+            if self._pending is not None:
+                self._pending.append(("record", discussion_id, likes, comments, views))
+
+    def remove(self, discussion_id: int):
+        with self._lock:
+            self._remove(discussion_id)
+            if self._pending is not None:
+                self._pending.append(("remove", discussion_id))
+
+    def hot(self, limit: int = 20, skip: int = 0):
+        with self._lock:
+            self._expire(self.clock())
+            return [discussion_id for discussion_id, _ in self._hot.top(limit, skip)]
+
+    def top(self, window: str = "24h", limit: int = 20, skip: int = 0):
+        if window not in self.windows:
+            raise ValueError(f"Unknown window, expected one of: {', '.join(self.windows)}")
+        with self._lock:
+            self._expire(self.clock())
+            return [discussion_id for discussion_id, _ in self._top[window].top(limit, skip)]
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def rebuild(self, db: Session, batch_size: int = 1000):
+        # Reloads the counters of every discussion in the longest window; created_on is naive UTC.
+        # Changes logged from before the query starts are replayed onto the result, so none made
+        # during the rebuild are lost; one that committed just before the query may count twice
+        # until the next rebuild.
+        with self._rebuild_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                now = self.clock()
+                since = datetime.fromtimestamp(now - self._retention, timezone.utc).replace(tzinfo=None)
+                discussions = models.Discussion
+                rows = db.query(
+                    discussions.id, discussions.created_on, discussions.like_count, discussions.comment_count, discussions.view_count
+                ).filter(discussions.created_on > since).order_by(discussions.created_on, discussions.id).yield_per(batch_size)
+                fresh = DiscussionRanking(self.windows, self.clock, *self.weights, self.decay_seconds)
+                for discussion_id, created_on, likes, comments, views in rows:
+                    fresh._add(discussion_id, created_timestamp(created_on), likes, comments, views, now)
+                with self._lock:
+                    now = self.clock()
+                    for operation, *args in self._pending:
+                        if operation == "add":
+                            fresh._add(*args, now)
+                        elif operation == "record":
+                            fresh._record(*args)
+                        else:
+                            fresh._remove(*args)
+                    fresh._expire(now)
+                    self._stats, self._hot, self._top, self._by_age = fresh._stats, fresh._hot, fresh._top, fresh._by_age
+            finally:
+                with self._lock:
+                    self._pending = None
+        return len(fresh._stats)
+
+    def _run(self, session_factory, interval: float):
+        while not self._wake.wait(interval):
+            db = session_factory()
+            try:
+                self.rebuild(db)
+            except Exception:
+                logger.exception("Failed to reconcile discussion ranking")
+            finally:
+                db.close()
+
+    def start(self, session_factory=SessionLocal, interval: float = RANKING_RECONCILE_INTERVAL):
+        if self._thread is not None:
+            return
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, args=(session_factory, interval), name="ranking-reconcile", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+
+def created_timestamp(created_on: datetime):
+    return created_on.replace(tzinfo=timezone.utc).timestamp()
+
+
+discussion_ranking = DiscussionRanking()
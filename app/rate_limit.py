@@ -0,0 +1,232 @@
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from jose import JWTError, jwt
+from . import auth
+from .cache import TTLCache
+
+# Token buckets per route and per client, checked by a middleware before the request is routed.
+# "METHOD /path/template=N/S" lets a client make N requests in a burst, refilled at N per S
+# seconds. Clients are the user id of a valid bearer token, otherwise the client address.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMITS = os.getenv(
+    "RATE_LIMITS",
+    "POST /token=10/60,POST /users/=5/60,POST /discussions/=30/60,POST /discussions/{discussion_id}/view=120/60,GET /export=2/3600",
+)
+# Applied to every other route, shared across them; empty means no limit
+RATE_LIMIT_DEFAULT = os.getenv("RATE_LIMIT_DEFAULT", "")
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "64"))
+# Buckets kept in memory; full buckets are dropped first since they hold no state
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Take the client address from the last X-Forwarded-For entry, as added by a trusted proxy
+RATE_LIMIT_FORWARDED_FOR = os.getenv("RATE_LIMIT_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+
+Limit = namedtuple("Limit", ["capacity", "period"])
+
+
+def parse_limit(value: str):
+    try:
+        capacity, period = value.strip().split("/")
+        limit = Limit(int(capacity), float(period))
+    except ValueError:
+        raise ValueError(f"Invalid rate limit {value!r}, expected requests/seconds")
+    if limit.capacity <= 0 or limit.period <= 0:
+        raise ValueError(f"Invalid rate limit {value!r}, both numbers must be positive")
+    return limit
+
+
+def parse_limits(value: str):
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, limit = item.rpartition("=")
+        method, _, path = route.strip().partition(" ")
+        if not method or not path:
+            raise ValueError(f"Invalid rate limit {item!r}, expected METHOD /path=requests/seconds")
+        limits[(method.upper(), path.strip())] = parse_limit(limit)
+    return limits
+
+
+class RateLimitBackend:
+    # A store shared by several processes (e.g. Redis) would run the same refill arithmetic in
+    # one atomic script per key. acquire() is called on the event loop, so it must be fast.
+
+    def acquire(self, key, capacity: int, rate: float, cost: float = 1):
+        # Takes cost tokens; returns 0 if they were there, else the seconds until they will be
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class InMemoryTokenBuckets(RateLimitBackend):
+    # Buckets spread over independently locked shards, so threads checking different clients
+    # rarely wait on each other. A bucket is [tokens, updated_at, full_at].
+
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, max_keys: int = RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self.clock = clock
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self._count = shards
+        self._max_shard_keys = max(1, max_keys // shards)
+
+    def __len__(self):
+        return sum(len(buckets) for _, buckets in self._shards)
+
+    def _make_room(self, buckets, now: float):
+        for key in [key for key, bucket in buckets.items() if bucket[2] <= now]:
+            del buckets[key]
+        if len(buckets) >= self._max_shard_keys:
+            # Everything is in use; the oldest bucket goes
+            del buckets[next(iter(buckets))]
+
+    def acquire(self, key, capacity: int, rate: float, cost: float = 1):
+        now = self.clock()
+        lock, buckets = self._shards[hash(key) % self._count]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                if cost > capacity:
+                    return (cost - capacity) / rate
+                if len(buckets) >= self._max_shard_keys:
+                    self._make_room(buckets, now)
+                tokens = capacity - cost
+                buckets[key] = [tokens, now, now + cost / rate]
+                return 0.0
+            tokens = bucket[0] + (now - bucket[1]) * rate
+            if tokens > capacity:
+                tokens = capacity
+            bucket[1] = now
+            if tokens < cost:
+                bucket[0] = tokens
+                return (cost - tokens) / rate
+            bucket[0] = tokens = tokens - cost
+            bucket[2] = now + (capacity - tokens) / rate
+            return 0.0
+
+    def clear(self):
+        for lock, buckets in self._shards:
+            with lock:
+                buckets.clear()
+
+
+bucket_store = InMemoryTokenBuckets()
+
+
+def set_backend(backend: RateLimitBackend):
+    global bucket_store
+    bucket_store = backend
+
+
+# Verified token -> "user:<id>", or "" for a token that does not verify
+_token_identities = TTLCache(maxsize=auth.AUTH_CACHE_SIZE, ttl=auth.AUTH_CACHE_TTL)
+
+
+def _token_identity(token: str):
+    identity = _token_identities.get(token)
+    if identity is None:
+        try:
+            payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+            identity = f"user:{payload.get('user_id') or payload['sub']}"
+        except (JWTError, KeyError):
+            identity = ""
+        _token_identities.set(token, identity)
+    return identity
+
+
+def _header(scope, name: bytes):
+    # Straight from the ASGI scope; request.headers would build a Headers object per call
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def client_identity(scope):
+    authorization = _header(scope, b"authorization")
+    if authorization and authorization[:7].lower() == "bearer ":
+        identity = _token_identity(authorization[7:])
+        if identity:
+            return identity
+    if RATE_LIMIT_FORWARDED_FOR:
+        forwarded = _header(scope, b"x-forwarded-for")
+        if forwarded:
+            return "ip:" + forwarded.rsplit(",", 1)[-1].strip()
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class RateLimiter:
+    # Route limits are matched against the app's own routes on first use, so a template in
+    # RATE_LIMITS that names no route fails the first request instead of never matching.
+
+    def __init__(self, limits: str = RATE_LIMITS, default: str = RATE_LIMIT_DEFAULT):
+        self.limits = parse_limits(limits)
+        self.default = parse_limit(default) if default else None
+        self._rules = None
+        self._lock = threading.Lock()
+
+    def _compile(self, routes):
+        rules = {}
+        unmatched = set(self.limits)
+        for route in routes:
+            for method in getattr(route, "methods", None) or ():
+                limit = self.limits.get((method, route.path))
+                if limit is not None:
+                    unmatched.discard((method, route.path))
+                    rules.setdefault(method, []).append((route, f"{method} {route.path}", limit))
+        if unmatched:
+            raise ValueError(f"Rate limits for unknown routes: {', '.join(' '.join(key) for key in sorted(unmatched))}")
+        return rules
+
+    def _rule(self, request: Request):
+        if self._rules is None:
+            with self._lock:
+                if self._rules is None:
+                    self._rules = self._compile(request.app.routes)
+        path = request.scope["path"]
+        for route, name, limit in self._rules.get(request.method, ()):
+            if route.path_regex.match(path):
+                return route, name, limit
+        return None
+
+    def check(self, request: Request):
+        # Seconds the client has to wait, or None if the request may go ahead
+        rule = self._rule(request)
+        if rule is None:
+            if self.default is None:
+                return None
+            route, name, limit = None, "*", self.default
+        else:
+            route, name, limit = rule
+        wait = bucket_store.acquire((name, client_identity(request.scope)), limit.capacity, limit.capacity / limit.period)
+        if not wait:
+            return None
+        if route is not None:
+            # The request is never routed; this reports the 429 under its route, not as unmatched
+            request.scope["route"] = route
+        return wait
+
+
+rate_limiter = RateLimiter()
+
+
+def too_many_requests(retry_after: float):
+    return JSONResponse(
+        {"detail": "Too many requests"}, status_code=429, headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and RATE_LIMIT_ENABLED:
+            retry_after = rate_limiter.check(Request(scope))
+            if retry_after is not None:
+                await too_many_requests(retry_after)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
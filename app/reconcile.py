@@ -0,0 +1,58 @@
+import argparse
+from sqlalchemy import func, select, update
+from .database import SessionLocal
+from . import models
+
+BATCH_SIZE = 1000
+
+
+def _counter_updates():
+    # (table, counter column, correlated COUNT over the base table)
+    discussions = models.Discussion.__table__
+    comments = models.Comment.__table__
+    users = models.User.__table__
+    followers = models.followers
+    return [
+        (discussions, "like_count", select(func.count()).where(models.Like.__table__.c.discussion_id == discussions.c.id)),
+        (discussions, "comment_count", select(func.count()).where(comments.c.discussion_id == discussions.c.id)),
+        (comments, "like_count", select(func.count()).where(models.CommentLike.__table__.c.comment_id == comments.c.id)),
+        (users, "follower_count", select(func.count()).where(followers.c.followed_id == users.c.id)),
+        (users, "following_count", select(func.count()).where(followers.c.follower_id == users.c.id)),
+    ]
+
+
+def reconcile_counters(db, batch_size: int = BATCH_SIZE):
+    # Recomputes every counter from the base tables one id range at a time, committing after
+    # each batch so no long-running lock is held on the hot tables.
+    updated = {}
+    for table, column, count in _counter_updates():
+        max_id = db.execute(select(func.max(table.c.id))).scalar() or 0
+        total = 0
+        for start in range(1, max_id + 1, batch_size):
+            end = start + batch_size - 1
+            result = db.execute(
+                update(table)
+                .where(table.c.id.between(start, end))
+                .where(table.c[column] != count.scalar_subquery())
+                .values({column: count.scalar_subquery()})
+            )
+            db.commit()
+            total += result.rowcount
+        updated[f"{table.name}.{column}"] = total
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild denormalized like/comment/follower counters.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    db = SessionLocal()
+    try:
+        for counter, fixed in reconcile_counters(db, batch_size=args.batch_size).items():
+            print(f"{counter}: {fixed} rows corrected")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql import Delete, Insert, Update
+from .cache import TTLCache
+from .database import engine, pool_options
+
+# Comma separated URLs of read replicas. When unset every request uses the primary.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# round_robin or least_connections
+DATABASE_REPLICA_STRATEGY = os.getenv("DATABASE_REPLICA_STRATEGY", "round_robin")
+# After a write, the same client reads from the primary for this many seconds
+DATABASE_STICKY_SECONDS = float(os.getenv("DATABASE_STICKY_SECONDS", "5"))
+# A replica that failed is skipped for this long before it is health-checked again
+DATABASE_REPLICA_RETRY_SECONDS = float(os.getenv("DATABASE_REPLICA_RETRY_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaPool:
+    def __init__(self, engines, strategy: str = DATABASE_REPLICA_STRATEGY,
+                 retry_seconds: float = DATABASE_REPLICA_RETRY_SECONDS, clock=time.monotonic):
+        if strategy not in ("round_robin", "least_connections"):
+            raise ValueError(f"Unknown replica strategy: {strategy}")
+        self.engines = list(engines)
+        self.strategy = strategy
+        self.retry_seconds = retry_seconds
+        self.clock = clock
+        self._ejected_until = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        for replica in self.engines:
+            event.listen(replica, "handle_error", self._on_error)
+
+    @classmethod
+    def from_urls(cls, urls, **kwargs):
+        engines = []
+        for url in urls:
+            connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+            engines.append(create_engine(url, connect_args=connect_args, **pool_options(url)))
+        return cls(engines, **kwargs)
+
+    def _on_error(self, context):
+        # Any connection-level failure ejects the replica; statement errors (bad SQL,
+        # constraint violations) are not the replica's fault.
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            self.eject(context.engine)
+
+    def eject(self, replica):
+        with self._lock:
+            if replica in self.engines and replica not in self._ejected_until:
+                logger.warning("Ejecting read replica %s", replica.url)
+            self._ejected_until[replica] = self.clock() + self.retry_seconds
+
+    def is_healthy(self, replica):
+        with self._lock:
+            return replica not in self._ejected_until
+
+    def _health_check(self, replica):
+        try:
+            with replica.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception:
+            self.eject(replica)
+            return False
+        with self._lock:
+            self._ejected_until.pop(replica, None)
+        logger.info("Read replica %s is back", replica.url)
+        return True
+
+    def healthy(self):
+        now = self.clock()
+        with self._lock:
+            due = [r for r, until in self._ejected_until.items() if until <= now]
+        for replica in due:
+            self._health_check(replica)
+        with self._lock:
+            return [r for r in self.engines if r not in self._ejected_until]
+
+    def choose(self):
+        candidates = self.healthy()
+        if not candidates:
+            return None
+        if self.strategy == "least_connections":
+            return min(candidates, key=lambda r: getattr(r.pool, "checkedout", lambda: 0)())
+        return candidates[next(self._counter) % len(candidates)]
+
+
+replica_pool = ReplicaPool.from_urls(DATABASE_REPLICA_URLS) if DATABASE_REPLICA_URLS else None
+
+
+def set_replica_pool(pool):
+    global replica_pool
+    replica_pool = pool
+
+
+class RoutingSession(Session):
+    # Reads go to one replica per session (chosen on first use); flushes and DML always go to
+    # the primary, as does everything when info["primary"] is set.
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("flushing") or self.info.get("primary") or replica_pool is None:
+            return engine
+        if isinstance(clause, (Insert, Update, Delete)):
+            return engine
+        if "replica" not in self.info:
+            self.info["replica"] = replica_pool.choose() or engine
+        return self.info["replica"]
+
+
+# A flush asks for its connection by mapper alone, so it is marked in info while it runs.
+# A failed flush leaves the mark until the rollback, which only keeps reads on the primary.
+@event.listens_for(RoutingSession, "before_flush")
+def _flush_started(session, flush_context, instances):
+    session.info["flushing"] = True
+
+
+@event.listens_for(RoutingSession, "after_flush_postexec")
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _flush_ended(session, *args):
+    session.info.pop("flushing", None)
+
+
+RoutingSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+
+recent_writers = TTLCache(maxsize=100000, ttl=DATABASE_STICKY_SECONDS)
+
+
+def client_key(request: Request):
+    # Clients are told apart by their bearer token; anonymous clients never write
+    authorization = request.headers.get("authorization")
+    if not authorization:
+        return None
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+def mark_write(request: Request):
+    key = client_key(request)
+    if key is not None:
+        recent_writers.set(key, True)
+
+
+class ReadYourWritesMiddleware:
+    # Keeps a client on the primary for a short while after it changed something
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_marked(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                mark_write(Request(scope))
+            await send(message)
+
+        await self.app(scope, receive, send_marked)
+
+
+def wrote_recently(request: Request):
+    key = client_key(request)
+    return key is not None and recent_writers.get(key, False)
+
+
+def get_read_db(request: Request):
+    db = RoutingSessionLocal(info={"primary": wrote_recently(request)})
+    try:
+        yield db
+    finally:
+        db.close()
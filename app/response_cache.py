@@ -0,0 +1,233 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import lru_cache
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from . import serializers
+from .replicas import wrote_recently
+
+# Serialized responses of the hot read endpoints, keyed by path and query string and tagged
+# with the discussions and hashtags they were built from. Writes in crud.py invalidate by tag
+# right after committing; RESPONSE_CACHE_TTL bounds staleness from anything they cannot see
+# (other processes sharing an in-process backend, replica lag).
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# How many recently invalidated tags keep their own generation; builds that started before
+# an older invalidation are not stored at all
+RESPONSE_CACHE_TAG_GENERATIONS = int(os.getenv("RESPONSE_CACHE_TAG_GENERATIONS", "10000"))
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag"])
+
+
+class ResponseCacheBackend:
+    # A shared store (e.g. Redis) would keep entries with an expiry and one key set per tag.
+    # generation() lets set() drop a value built before an invalidation of one of its tags
+    # that ran meanwhile, e.g. with a counter per tag.
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value: CachedResponse, tags, generation=None):
+        raise NotImplementedError
+
+    def invalidate(self, tags):
+        raise NotImplementedError
+
+    def generation(self):
+        return None
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class InMemoryResponseCache(ResponseCacheBackend):
+    # LRU bounded both by entry count and by total body size
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 ttl: float = RESPONSE_CACHE_TTL, clock=time.monotonic,
+                 max_tag_generations: int = RESPONSE_CACHE_TAG_GENERATIONS):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._tags = defaultdict(set)
+        self._bytes = 0
+        self.max_tag_generations = max_tag_generations
+        # Generation of each tag's last invalidation, oldest first; anything older than
+        # _floor has been forgotten
+        self._tag_generations = OrderedDict()
+        self._generation = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def _remove(self, key):
+        value, tags, _ = self._entries.pop(key)
+        self._bytes -= len(value.body)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[2] <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, value: CachedResponse, tags, generation=None):
+        if len(value.body) > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and self._stale(tags, generation):
+                return
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, tags, self.clock() + self.ttl)
+            self._bytes += len(value.body)
+            for tag in tags:
+                self._tags[tag].add(key)
+            while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _stale(self, tags, generation):
+        if generation < self._floor:
+            return True
+        return any(self._tag_generations.get(tag, 0) > generation for tag in tags)
+
+    def invalidate(self, tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                self._tag_generations[tag] = self._generation
+                self._tag_generations.move_to_end(tag)
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+            while len(self._tag_generations) > self.max_tag_generations:
+                _, self._floor = self._tag_generations.popitem(last=False)
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._floor = self._generation
+            self._tag_generations.clear()
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+
+response_store: ResponseCacheBackend = InMemoryResponseCache()
+
+
+def set_backend(backend: ResponseCacheBackend):
+    global response_store
+    response_store = backend
+
+
+def discussion_tag(discussion_id: int):
+    return f"discussion:{discussion_id}"
+
+
+def hashtag_tag(name: str):
+    return f"hashtag:{name}"
+
+
+def invalidate_discussions(discussion_ids):
+    tags = [discussion_tag(discussion_id) for discussion_id in set(discussion_ids)]
+    if tags:
+        response_store.invalidate(tags)
+
+
+def invalidate_hashtags(names):
+    tags = [hashtag_tag(name) for name in set(names)]
+    if tags:
+        response_store.invalidate(tags)
+
+
+@lru_cache(maxsize=None)
+def _adapter(response_type):
+    return TypeAdapter(response_type)
+
+
+def render(response_type, value) -> bytes:
+    # Same JSON as FastAPI produces for response_model=response_type
+    if serializers.FAST_JSON:
+        return serializers.dumps(response_type, value)
+    adapter = _adapter(response_type)
+    return adapter.dump_json(adapter.validate_python(value, from_attributes=True))
+
+
+def _cache_key(request: Request):
+    return f"{request.url.path}?{request.url.query}"
+
+
+def _etag_matches(header: str, etag: str):
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _lookup(request: Request):
+    # A client that just wrote skips cached copies, which may have come from a lagging replica
+    if not RESPONSE_CACHE_ENABLED or wrote_recently(request):
+        return None
+    return response_store.get(_cache_key(request))
+
+
+def _store(request: Request, body: bytes, tags, generation):
+    entry = CachedResponse(body, '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest())
+    if RESPONSE_CACHE_ENABLED:
+        response_store.set(_cache_key(request), entry, tags, generation)
+    return entry
+
+
+def _respond(request: Request, entry: CachedResponse):
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def cached_response(request: Request, build):
+    # build() returns (body, tags) and may raise HTTPException, which is never cached
+    entry = _lookup(request)
+    if entry is None:
+        generation = response_store.generation()
+        body, tags = build()
+        entry = _store(request, body, tags, generation)
+    return _respond(request, entry)
+
+
+async def cached_response_async(request: Request, build):
+    entry = _lookup(request)
+    if entry is None:
+        generation = response_store.generation()
+        body, tags = await build()
+        entry = _store(request, body, tags, generation)
+    return _respond(request, entry)
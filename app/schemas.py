@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal, Optional
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -12,6 +12,8 @@ class UserCreate(UserBase):
 
 class User(UserBase):
     id: int
+    follower_count: int = 0
+    following_count: int = 0
     discussions: List['Discussion'] = []
 
     class Config:
@@ -23,6 +25,11 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    user_id: Optional[int] = None
+
+class CurrentUser(BaseModel):
+    id: int
+    email: str
 
 class HashtagBase(BaseModel):
     name: str
@@ -36,6 +43,10 @@ class Hashtag(HashtagBase):
     class Config:
         from_attributes = True
 
+class TrendingHashtag(BaseModel):
+    name: str
+    count: int
+
 class CommentBase(BaseModel):
     text: str
 
@@ -48,8 +59,10 @@ class Comment(CommentBase):
     user_id: int
     discussion_id: int
     parent_id: Optional[int] = None
+    thread_root_id: Optional[int] = None
+    depth: int = 0
+    like_count: int = 0
     replies: List['Comment'] = []
-    likes: List['CommentLike'] = []
 
     class Config:
         from_attributes = True
@@ -68,6 +81,8 @@ class Discussion(DiscussionBase):
     hashtags: List[Hashtag] = []
     comments: List[Comment] = []
     view_count: int
+    like_count: int = 0
+    comment_count: int = 0
 
     class Config:
         from_attributes = True
@@ -98,6 +113,69 @@ class CommentLike(CommentLikeBase):
     class Config:
         from_attributes = True
 
+BATCH_MAX_OPERATIONS = 500
+
+class LikeOperation(BaseModel):
+    target: Literal["discussion", "comment"]
+    id: int
+    action: Literal["like", "unlike"] = "like"
+
+class LikeBatch(BaseModel):
+    operations: List[LikeOperation] = Field(max_length=BATCH_MAX_OPERATIONS)
+
+class FollowOperation(BaseModel):
+    user_id: int
+    action: Literal["follow", "unfollow"] = "follow"
+
+class FollowBatch(BaseModel):
+    operations: List[FollowOperation] = Field(max_length=BATCH_MAX_OPERATIONS)
+
+class CommentBatchItem(CommentBase):
+    discussion_id: int
+    parent_id: Optional[int] = None
+
+class CommentBatch(BaseModel):
+    comments: List[CommentBatchItem] = Field(max_length=BATCH_MAX_OPERATIONS)
+
+class BatchResult(BaseModel):
+    applied: int
+    skipped: int
+
+class UserPage(BaseModel):
+    items: List[User]
+    next_cursor: Optional[str] = None
+
+class UserSummary(BaseModel):
+    id: int
+    name: str
+    follower_count: int = 0
+    following_count: int = 0
+
+    class Config:
+        from_attributes = True
+
+class UserSummaryPage(BaseModel):
+    items: List[UserSummary]
+    next_cursor: Optional[str] = None
+    total: int
+
+class UserSuggestion(UserSummary):
+    followed_by_friends: int
+
+class FollowStatus(BaseModel):
+    following: bool
+    followed_by: bool
+
+class DiscussionPage(BaseModel):
+    items: List[Discussion]
+    next_cursor: Optional[str] = None
+
+class CommentPage(BaseModel):
+    items: List[Comment]
+    next_cursor: Optional[str] = None
+
 User.model_rebuild()
 Discussion.model_rebuild()
-Comment.model_rebuild()
\ No newline at end of file
+Comment.model_rebuild()
+UserPage.model_rebuild()
+DiscussionPage.model_rebuild()
\ No newline at end of file
@@ -0,0 +1,195 @@
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from sqlalchemy import text
+from sqlalchemy.orm import Session, selectinload
+from .database import engine
+from . import models
+
+# SEARCH_BACKEND=memory|mysql. By default MySQL databases use their FULLTEXT indexes and
+# everything else (SQLite in development and tests) uses the in-process inverted index.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND") or ("mysql" if engine.dialect.name == "mysql" else "memory")
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(value: str):
+    return _TOKEN.findall(value.lower()) if value else []
+
+
+class InvertedIndex:
+    # Postings lists of term -> {doc_id: term frequency}, ranked with Okapi BM25
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, prefix: bool = False):
+        self.k1 = k1
+        self.b = b
+        # prefix=True lets a query term also match longer indexed terms ("ali" -> "alice")
+        self.prefix = prefix
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._terms = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def add(self, doc_id: int, value: str):
+        terms = Counter(tokenize(value))
+        with self._lock:
+            self._remove(doc_id)
+            for term, frequency in terms.items():
+                if term not in self._postings and self.prefix:
+                    bisect.insort(self._terms, term)
+                self._postings[term][doc_id] = frequency
+            self._doc_terms[doc_id] = terms
+            length = sum(terms.values())
+            self._doc_lengths[doc_id] = length
+            self._total_length += length
+
+    def remove(self, doc_id: int):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: int):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                if self.prefix:
+                    del self._terms[bisect.bisect_left(self._terms, term)]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_lengths.clear()
+            self._total_length = 0
+            self._terms.clear()
+
+    def _expand(self, term: str):
+        if not self.prefix:
+            return [term] if term in self._postings else []
+        start = bisect.bisect_left(self._terms, term)
+        end = bisect.bisect_left(self._terms, term + "\uffff")
+        return self._terms[start:end]
+
+    def search(self, query: str, skip: int = 0, limit: int = 100):
+        with self._lock:
+            documents = len(self._doc_lengths)
+            if not documents:
+                return []
+            average_length = self._total_length / documents or 1
+            scores = defaultdict(float)
+            for query_term in set(tokenize(query)):
+                for term in self._expand(query_term):
+                    postings = self._postings[term]
+                    idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                    # exact matches outrank prefix matches
+                    weight = idf if term == query_term else idf * 0.5
+                    for doc_id, frequency in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / average_length)
+                        scores[doc_id] += weight * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = heapq.nlargest(skip + limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [doc_id for doc_id, _ in ranked[skip:]]
+
+
+def discussion_document(discussion: models.Discussion):
+    return " ".join([discussion.text or ""] + [hashtag.name for hashtag in discussion.hashtags])
+
+
+class SearchBackend:
+    def index_discussion(self, discussion: models.Discussion):
+        pass
+
+    def remove_discussion(self, discussion_id: int):
+        pass
+
+    def index_user(self, user: models.User):
+        pass
+
+    def rebuild(self, db: Session):
+        pass
+
+    def search_discussions(self, db: Session, query: str, skip: int = 0, limit: int = 100):
+        raise NotImplementedError
+
+    def search_users(self, db: Session, query: str, skip: int = 0, limit: int = 100):
+        raise NotImplementedError
+
+
+class MemorySearchBackend(SearchBackend):
+    def __init__(self):
+        self.discussions = InvertedIndex()
+        self.users = InvertedIndex(prefix=True)
+
+    def index_discussion(self, discussion: models.Discussion):
+        self.discussions.add(discussion.id, discussion_document(discussion))
+
+    def remove_discussion(self, discussion_id: int):
+        self.discussions.remove(discussion_id)
+
+    def index_user(self, user: models.User):
+        self.users.add(user.id, user.name)
+
+    def rebuild(self, db: Session, batch_size: int = 1000):
+        self.discussions.clear()
+        self.users.clear()
+        for user_id, name in db.query(models.User.id, models.User.name).yield_per(batch_size):
+            self.users.add(user_id, name)
+        query = db.query(models.Discussion).options(selectinload(models.Discussion.hashtags))
+        for discussion in query.yield_per(batch_size):
+            self.index_discussion(discussion)
+
+    def search_discussions(self, db: Session, query: str, skip: int = 0, limit: int = 100):
+        return self.discussions.search(query, skip, limit)
+
+    def search_users(self, db: Session, query: str, skip: int = 0, limit: int = 100):
+        return self.users.search(query, skip, limit)
+
+
+class MySQLSearchBackend(SearchBackend):
+    # Relies on the FULLTEXT indexes created in models.py; MySQL keeps them current itself.
+
+    def search_discussions(self, db: Session, query: str, skip: int = 0, limit: int = 100):
+        # Like discussion_document(), a discussion matches on its text and on its hashtags'
+        # names, and its score is the sum of both
+        rows = db.execute(text(
+            "SELECT id FROM ("
+            "SELECT id, MATCH (text) AGAINST (:q IN NATURAL LANGUAGE MODE) AS score FROM discussions "
+            "WHERE MATCH (text) AGAINST (:q IN NATURAL LANGUAGE MODE) "
+            "UNION ALL "
+            "SELECT discussion_hashtag.discussion_id, MATCH (hashtags.name) AGAINST (:q IN NATURAL LANGUAGE MODE) "
+            "FROM hashtags JOIN discussion_hashtag ON discussion_hashtag.hashtag_id = hashtags.id "
+            "WHERE MATCH (hashtags.name) AGAINST (:q IN NATURAL LANGUAGE MODE)"
+            ") matches GROUP BY id ORDER BY SUM(score) DESC, id DESC LIMIT :limit OFFSET :skip"
+        ), {"q": query, "limit": limit, "skip": skip})
+        return [row[0] for row in rows]
+
+    def search_users(self, db: Session, query: str, skip: int = 0, limit: int = 100):
+        terms = " ".join(f"{term}*" for term in tokenize(query))
+        if not terms:
+            return []
+        rows = db.execute(text(
+            "SELECT id FROM users WHERE MATCH (name) AGAINST (:q IN BOOLEAN MODE) "
+            "ORDER BY MATCH (name) AGAINST (:q IN BOOLEAN MODE) DESC, id LIMIT :limit OFFSET :skip"
+        ), {"q": terms, "limit": limit, "skip": skip})
+        return [row[0] for row in rows]
+
+
+search_index: SearchBackend = MySQLSearchBackend() if SEARCH_BACKEND == "mysql" else MemorySearchBackend()
+
+
+def set_backend(backend: SearchBackend):
+    global search_index
+    search_index = backend
@@ -0,0 +1,149 @@
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from . import models
+
+TIMELINE_MAX_LENGTH = int(os.getenv("TIMELINE_MAX_LENGTH", "800"))
+TIMELINE_MAX_USERS = int(os.getenv("TIMELINE_MAX_USERS", "100000"))
+# Authors with more followers than this are not fanned out on write; their posts are
+# pulled in when a follower reads the feed.
+FANOUT_FOLLOWER_LIMIT = int(os.getenv("FANOUT_FOLLOWER_LIMIT", "10000"))
+
+
+class TimelineBackend:
+    # Entries are (created_on, discussion_id) keys. A backend only has to remember which
+    # users have a materialized timeline; missing timelines are rebuilt from the database.
+
+    def has_timeline(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def set_timeline(self, user_id: int, entries):
+        raise NotImplementedError
+
+    def push(self, user_ids, entry):
+        raise NotImplementedError
+
+    def range(self, user_id: int, before=None, limit: int = 20):
+        raise NotImplementedError
+
+    def drop(self, user_id: int):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class InMemoryTimelineBackend(TimelineBackend):
+    def __init__(self, max_length: int = TIMELINE_MAX_LENGTH, max_users: int = TIMELINE_MAX_USERS):
+        self.max_length = max_length
+        self.max_users = max_users
+        self._timelines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def has_timeline(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._timelines
+
+    def set_timeline(self, user_id: int, entries):
+        entries = sorted(entries)[-self.max_length:]
+        with self._lock:
+            self._timelines[user_id] = entries
+            self._timelines.move_to_end(user_id)
+            while len(self._timelines) > self.max_users:
+                self._timelines.popitem(last=False)
+
+    def push(self, user_ids, entry):
+        with self._lock:
+            for user_id in user_ids:
+                # Only timelines that are already materialized are updated; anything else
+                # would look complete while missing its history.
+                entries = self._timelines.get(user_id)
+                if entries is None:
+                    continue
+                # Fan-out jobs run at least once, so the same entry can arrive twice
+                index = bisect.bisect_left(entries, entry)
+                if index < len(entries) and entries[index] == entry:
+                    continue
+                entries.insert(index, entry)
+                if len(entries) > self.max_length:
+                    del entries[0]
+
+    def range(self, user_id: int, before=None, limit: int = 20):
+        with self._lock:
+            entries = self._timelines.get(user_id)
+            if entries is None:
+                return []
+            self._timelines.move_to_end(user_id)
+            end = bisect.bisect_left(entries, tuple(before)) if before else len(entries)
+            return entries[max(0, end - limit):end][::-1]
+
+    def drop(self, user_id: int):
+        with self._lock:
+            self._timelines.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._timelines.clear()
+
+
+timeline_store: TimelineBackend = InMemoryTimelineBackend()
+
+
+def set_backend(backend: TimelineBackend):
+    global timeline_store
+    timeline_store = backend
+
+
+def fan_out_discussion(db: Session, discussion: models.Discussion):
+    # Celebrities are told apart by users.follower_count, as on read; their followers
+    # come back empty
+    follower_ids = [row[0] for row in db.query(models.followers.c.follower_id).join(
+        models.User, models.User.id == models.followers.c.followed_id
+    ).filter(
+        models.followers.c.followed_id == discussion.user_id, models.User.follower_count <= FANOUT_FOLLOWER_LIMIT
+    ).all()]
+    if follower_ids:
+        timeline_store.push(follower_ids, (discussion.created_on, discussion.id))
+
+
+def _discussion_keys(db: Session, author_ids, before, limit: int):
+    query = db.query(models.Discussion.created_on, models.Discussion.id).filter(
+        models.Discussion.user_id.in_(author_ids)
+    )
+    if before:
+        created_on, discussion_id = before
+        query = query.filter(
+            (models.Discussion.created_on < created_on)
+            | ((models.Discussion.created_on == created_on) & (models.Discussion.id < discussion_id))
+        )
+    rows = query.order_by(models.Discussion.created_on.desc(), models.Discussion.id.desc()).limit(limit).all()
+    return [(row[0], row[1]) for row in rows]
+
+
+def read_timeline(db: Session, user_id: int, before=None, limit: int = 20):
+    # Celebrities come from the denormalized users.follower_count, in the same query as the
+    # followed accounts, so reads never count followers
+    rows = db.query(models.followers.c.followed_id, models.User.follower_count > FANOUT_FOLLOWER_LIMIT).join(
+        models.User, models.User.id == models.followers.c.followed_id
+    ).filter(models.followers.c.follower_id == user_id).all()
+    if not rows:
+        return []
+    followed_ids = [row[0] for row in rows]
+    celebrity_ids = {row[0] for row in rows if row[1]}
+    if not timeline_store.has_timeline(user_id):
+        regular_ids = [i for i in followed_ids if i not in celebrity_ids]
+        entries = _discussion_keys(db, regular_ids, None, TIMELINE_MAX_LENGTH) if regular_ids else []
+        timeline_store.set_timeline(user_id, entries)
+    materialized = timeline_store.range(user_id, before, limit)
+    keys = set(materialized)
+    if len(materialized) < limit:
+        # Past the oldest entry the timeline holds, older history comes from the database
+        regular_ids = [i for i in followed_ids if i not in celebrity_ids]
+        if regular_ids:
+            start = materialized[-1] if materialized else before
+            keys.update(_discussion_keys(db, regular_ids, start, limit - len(materialized)))
+    if celebrity_ids:
+        keys.update(_discussion_keys(db, list(celebrity_ids), before, limit))
+    return sorted(keys, reverse=True)[:limit]
@@ -0,0 +1,169 @@
+import argparse
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+import orjson
+from sqlalchemy import select
+from .database import SessionLocal, engine
+from . import crud, models
+
+# NDJSON export and import of the whole social graph: one JSON object per line, tagged with
+# its "type". Tables are written parents first (users before the discussions they wrote,
+# comments by id so parents precede replies), so an import can insert in a single pass.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Accounts allowed to use GET /export, which dumps every user's email and mobile number; with
+# none configured the export is only available from the command line
+EXPORT_ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("EXPORT_ADMIN_EMAILS", "").split(",") if email.strip()}
+
+USER_FIELDS = ("id", "name", "email", "mobile_no", "follower_count", "following_count")
+
+# type -> (table, exported columns, order)
+TABLES = {
+    "user": (models.User.__table__, USER_FIELDS, ("id",)),
+    "follow": (models.followers, ("follower_id", "followed_id"), ("follower_id", "followed_id")),
+    "hashtag": (models.Hashtag.__table__, ("id", "name"), ("id",)),
+    "discussion": (models.Discussion.__table__, (
+        "id", "text", "image", "created_on", "user_id", "view_count", "like_count", "comment_count",
+    ), ("id",)),
+    "discussion_hashtag": (models.discussion_hashtag, ("discussion_id", "hashtag_id"), ("discussion_id", "hashtag_id")),
+    "comment": (models.Comment.__table__, (
+        "id", "text", "created_on", "user_id", "discussion_id", "parent_id", "like_count",
+    ), ("id",)),
+    "like": (models.Like.__table__, ("id", "user_id", "discussion_id"), ("id",)),
+    "comment_like": (models.CommentLike.__table__, ("id", "user_id", "comment_id"), ("id",)),
+}
+TYPES = tuple(TABLES)
+DATETIME_FIELDS = {"created_on"}
+
+
+def can_export(email: str):
+    return email.lower() in EXPORT_ADMIN_EMAILS
+
+
+def _columns(kind: str, include_password_hashes: bool = False):
+    table, fields, _ = TABLES[kind]
+    if kind == "user" and include_password_hashes:
+        fields = fields + ("hashed_password",)
+    return [table.c[field] for field in fields]
+
+
+def export_rows(db, kind: str, batch_size: int = EXPORT_BATCH_SIZE, include_password_hashes: bool = False):
+    # Streams the rows of one table with a server-side cursor; memory stays at one batch
+    table, _, order = TABLES[kind]
+    columns = _columns(kind, include_password_hashes)
+    # Column keys are str subclasses, which orjson does not accept as dict keys
+    keys = [str(column.key) for column in columns]
+    statement = select(*columns).order_by(*[table.c[name] for name in order]).execution_options(yield_per=batch_size)
+    for row in db.execute(statement):
+        record = {"type": kind}
+        record.update(zip(keys, row))
+        yield orjson.dumps(record) + b"\n"
+
+
+def export_ndjson(session_factory=SessionLocal, types=TYPES, batch_size: int = EXPORT_BATCH_SIZE,
+                  include_password_hashes: bool = False):
+    # Checks the types up front, before anything has been streamed
+    for kind in types:
+        if kind not in TABLES:
+            raise ValueError(f"Unknown export type: {kind}")
+    return _export(session_factory, types, batch_size, include_password_hashes)
+
+
+def _export(session_factory, types, batch_size: int, include_password_hashes: bool):
+    # Owns its session so it can outlive the request that started a StreamingResponse
+    db = session_factory()
+    try:
+        for kind in TYPES:
+            if kind in types:
+                yield from export_rows(db, kind, batch_size, include_password_hashes)
+    finally:
+        db.close()
+
+
+def _parse(line_number: int, line: bytes):
+    try:
+        record = orjson.loads(line)
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f"Line {line_number}: invalid JSON ({e})")
+    if not isinstance(record, dict) or record.get("type") not in TABLES:
+        raise ValueError(f"Line {line_number}: unknown record type")
+    kind = record["type"]
+    allowed = {column.key for column in _columns(kind, include_password_hashes=True)}
+    row = {key: value for key, value in record.items() if key in allowed}
+    for field in DATETIME_FIELDS & row.keys():
+        if row[field] is not None:
+            row[field] = datetime.fromisoformat(row[field])
+    return kind, row
+
+
+def import_ndjson(lines, bind=engine, batch_size: int = IMPORT_BATCH_SIZE):
+    # Multi-row inserts of batch_size rows per statement, one transaction per batch, keeping the
+    # exported ids. Rows of one type are sent together, and a switch to another type flushes
+    # first, so foreign keys see their parents. Returns the number of rows per type.
+    counts = Counter()
+    pending_kind = None
+    pending = []
+
+    def flush():
+        if pending:
+            with bind.begin() as connection:
+                connection.execute(TABLES[pending_kind][0].insert(), pending)
+            counts[pending_kind] += len(pending)
+            pending.clear()
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        kind, row = _parse(line_number, line)
+        if kind != pending_kind or len(pending) >= batch_size:
+            flush()
+            pending_kind = kind
+        pending.append(row)
+    flush()
+    if counts["comment"]:
+        db = SessionLocal(bind=bind)
+        try:
+            crud.fill_comment_paths(db, commit=True)
+        finally:
+            db.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the social graph as NDJSON.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write NDJSON to a file or stdout")
+    export_parser.add_argument("--output", help="defaults to stdout")
+    export_parser.add_argument("--types", default=",".join(TYPES), help=f"comma separated subset of {','.join(TYPES)}")
+    export_parser.add_argument("--include-password-hashes", action="store_true", help="keep logins working after an import")
+    export_parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    import_parser = commands.add_parser("import", help="load NDJSON from a file or stdin into an empty database")
+    import_parser.add_argument("input", nargs="?", help="defaults to stdin")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        types = [kind.strip() for kind in args.types.split(",") if kind.strip()]
+        output = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for line in export_ndjson(types=types, batch_size=args.batch_size, include_password_hashes=args.include_password_hashes):
+                output.write(line)
+        finally:
+            if args.output:
+                output.close()
+    else:
+        models.Base.metadata.create_all(bind=engine)
+        source = open(args.input, "rb") if args.input else sys.stdin.buffer
+        try:
+            counts = import_ndjson(source, batch_size=args.batch_size)
+        finally:
+            if args.input:
+                source.close()
+        for kind in TYPES:
+            print(f"{kind}: {counts[kind]} rows")
+
+
+if __name__ == "__main__":
+    main()
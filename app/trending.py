@@ -0,0 +1,99 @@
+import heapq
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.orm import Session
+from . import models
+
+BUCKET_SECONDS = 60
+WINDOWS = {"1h": 60, "24h": 24 * 60}
+
+
+class TrendingCounter:
+    # A ring of per-minute hashtag counts with a running total per window. Recording and
+    # expiring are proportional to the tags involved, and top-K only looks at the tags
+    # seen inside the window, never at the discussions table.
+
+    def __init__(self, windows=WINDOWS, clock=time.time):
+        self.windows = dict(windows)
+        self.clock = clock
+        self._size = max(self.windows.values())
+        self._buckets = [Counter() for _ in range(self._size)]
+        self._bucket_minutes = [None] * self._size
+        self._totals = {name: Counter() for name in self.windows}
+        self._current = None
+        self._lock = threading.Lock()
+
+    def _minute(self, at: float = None):
+        return int((self.clock() if at is None else at) // BUCKET_SECONDS)
+
+    def _advance(self, minute: int):
+        # Expire every bucket that slid out of a window since the last call
+        if self._current is None:
+            self._current = minute
+            return
+        if minute <= self._current:
+            return
+        for name, span in self.windows.items():
+            # buckets only exist up to the current minute, so at most `span` of them can expire
+            for old in range(self._current - span + 1, min(minute - span, self._current) + 1):
+                slot = old % self._size
+                if self._bucket_minutes[slot] == old:
+                    self._totals[name].subtract(self._buckets[slot])
+            self._totals[name] = +self._totals[name]
+        for old in range(max(self._current + 1, minute - self._size + 1), minute + 1):
+            slot = old % self._size
+            if self._bucket_minutes[slot] is not None and self._bucket_minutes[slot] != old:
+                self._buckets[slot] = Counter()
+            self._bucket_minutes[slot] = old
+        self._current = minute
+
+    def record(self, hashtags, at: float = None):
+        hashtags = list(hashtags)
+        if not hashtags:
+            return
+        with self._lock:
+            now = self._minute()
+            self._advance(now)
+            minute = self._minute(at)
+            if minute > now or minute <= now - self._size:
+                return
+            slot = minute % self._size
+            if self._bucket_minutes[slot] != minute:
+                self._buckets[slot] = Counter()
+                self._bucket_minutes[slot] = minute
+            self._buckets[slot].update(hashtags)
+            for name, span in self.windows.items():
+                if minute > now - span:
+                    self._totals[name].update(hashtags)
+
+    def top(self, window: str = "1h", limit: int = 10):
+        if window not in self.windows:
+            raise ValueError(f"Unknown window, expected one of: {', '.join(self.windows)}")
+        with self._lock:
+            self._advance(self._minute())
+            totals = self._totals[window]
+            return heapq.nsmallest(limit, totals.items(), key=lambda item: (-item[1], item[0]))
+
+    def clear(self):
+        with self._lock:
+            self._buckets = [Counter() for _ in range(self._size)]
+            self._bucket_minutes = [None] * self._size
+            self._totals = {name: Counter() for name in self.windows}
+            self._current = None
+
+    def rebuild(self, db: Session):
+        # Replays the hashtags attached in the longest window; created_on is naive UTC
+        since = datetime.utcnow() - timedelta(minutes=self._size)
+        rows = db.query(models.Hashtag.name, models.Discussion.created_on).join(
+            models.discussion_hashtag, models.discussion_hashtag.c.hashtag_id == models.Hashtag.id
+        ).join(
+            models.Discussion, models.Discussion.id == models.discussion_hashtag.c.discussion_id
+        ).filter(models.Discussion.created_on >= since).yield_per(1000)
+        self.clear()
+        for name, created_on in rows:
+            self.record([name], at=created_on.replace(tzinfo=timezone.utc).timestamp())
+
+
+trending_hashtags = TrendingCounter()
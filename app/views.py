@@ -0,0 +1,95 @@
+import logging
+import os
+import threading
+from collections import Counter
+from .database import SessionLocal
+from . import crud
+
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "5"))
+VIEW_FLUSH_THRESHOLD = int(os.getenv("VIEW_FLUSH_THRESHOLD", "1000"))
+
+logger = logging.getLogger(__name__)
+
+
+class ViewAggregator:
+    # Collects view increments in memory and writes them out as one relative UPDATE per
+    # discussion, either every flush_interval seconds or once flush_threshold views are pending.
+
+    def __init__(self, session_factory=SessionLocal, flush_interval: float = VIEW_FLUSH_INTERVAL,
+                 flush_threshold: int = VIEW_FLUSH_THRESHOLD):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending = Counter()
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def record(self, discussion_id: int, count: int = 1):
+        with self._lock:
+            self._pending[discussion_id] += count
+            self._pending_total += count
+            full = self._pending_total >= self.flush_threshold
+        if full:
+            if self._thread is not None:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                counts, self._pending = self._pending, Counter()
+                self._pending_total = 0
+            if not counts:
+                return 0
+            db = self.session_factory()
+            try:
+                applied = crud.add_view_counts(db, counts)
+            except Exception:
+                db.rollback()
+                logger.exception("Failed to flush %d view counts, keeping them for the next flush", len(counts))
+                with self._lock:
+                    self._pending.update(counts)
+                    self._pending_total += sum(counts.values())
+                return 0
+            finally:
+                db.close()
+            # Committed, so never queued again, even if updating what derives from them fails
+            try:
+                crud.view_counts_added(applied)
+            except Exception:
+                logger.exception("Failed to update rankings for %d flushed view counts", len(applied))
+            return len(applied)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="view-aggregator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Drains everything still buffered so no counts are lost on shutdown.
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+view_aggregator = ViewAggregator()
@@ -0,0 +1,128 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+_db_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Jobs run inside the writing request, so tests see their effects right away
+os.environ.setdefault("JOB_QUEUE_INLINE", "true")
+# Every test client shares one address; tests/test_rate_limit.py turns limits back on
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import auth, follow_graph, models, ranking, replicas, response_cache, search, timeline, trending
+from app.database import engine, SessionLocal
+from app.main import app
+
+# The hot read endpoints, for tests marked @pytest.mark.read_endpoints(*extra_urls) that take
+# a "url" argument; seed() data makes every one of them return 200
+ENDPOINTS = [
+    "/discussions/",
+    "/discussions/1",
+    "/discussions/hashtag/python",
+    "/discussions/1/comments/",
+    "/users/",
+    "/users/1",
+    "/users/search/?name=user",
+    "/discussions/search?q=discussion",
+]
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "read_endpoints(*urls): run the test once per hot read endpoint and per extra url")
+
+
+def pytest_generate_tests(metafunc):
+    marker = metafunc.definition.get_closest_marker("read_endpoints")
+    if marker is not None:
+        metafunc.parametrize("url", ENDPOINTS + list(marker.args))
+
+
+@pytest.fixture(autouse=True)
+def setup_database():
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    timeline.timeline_store.clear()
+    auth.principal_cache.clear()
+    search.set_backend(search.MemorySearchBackend())
+    trending.trending_hashtags.clear()
+    ranking.discussion_ranking.clear()
+    follow_graph.follow_graph.clear()
+    replicas.set_replica_pool(None)
+    replicas.recent_writers.clear()
+    response_cache.set_backend(response_cache.InMemoryResponseCache())
+    yield
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def signup(client):
+    def _signup(name):
+        email = f"{name}@example.com"
+        response = client.post("/users/", json={"name": name, "email": email, "mobile_no": str(abs(hash(name)) % 10**10), "password": "secret"})
+        assert response.status_code == 200
+        token = client.post("/token", data={"username": email, "password": "secret"}).json()["access_token"]
+        return response.json()["id"], {"Authorization": f"Bearer {token}"}
+    return _signup
+
+
+@pytest.fixture
+def count_queries():
+    @contextmanager
+    def _count_queries():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return _count_queries
+
+
+@pytest.fixture
+def seed(db):
+    # Three users, discussions tagged "python" with a like each and a reply chain of the given depth
+    def _seed(discussions, depth=3):
+        users = [models.User(name=f"user {i}", email=f"user{i}@example.com", mobile_no=f"555000{i}", hashed_password="x") for i in range(3)]
+        db.add_all(users)
+        db.flush()
+        tag = models.Hashtag(name="python")
+        db.add(tag)
+        for i in range(discussions):
+            discussion = models.Discussion(text=f"discussion {i}", user_id=users[i % 3].id, view_count=0)
+            discussion.hashtags.append(tag)
+            db.add(discussion)
+            db.flush()
+            db.add(models.Like(user_id=users[0].id, discussion_id=discussion.id))
+            parent = None
+            for level in range(depth):
+                comment = models.Comment(text=f"comment {level}", user_id=users[level % 3].id, discussion_id=discussion.id, parent_id=parent)
+                db.add(comment)
+                db.flush()
+                db.add(models.CommentLike(user_id=users[1].id, comment_id=comment.id))
+                parent = comment.id
+        db.commit()
+        search.search_index.rebuild(db)
+    return _seed
@@ -0,0 +1,421 @@
+"""Latency, throughput and queries per request of every endpoint in app/main.py over a synthetic social graph.
+
+    python tests/performance/bench_api.py --users 500 --discussions 2000 --requests 400 --concurrency 16 --output run.json
+
+Seeds SQLite (a temporary file unless DATABASE_URL is set, e.g. to a local MySQL database) from
+a fixed random seed, then runs one phase per endpoint through the ASGI transport. Phases run in
+order, so the write endpoints that need their own rows (DELETE, unlike) reuse what earlier
+phases created. The JSON output is stable across runs with the same arguments, so two runs
+can be diffed directly.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+# Measures the request path of POST /token and POST /users/; bench_login.py covers the bcrypt cost
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Jobs run inside the write that queued them, so their queries count towards that request
+os.environ.setdefault("JOB_QUEUE_INLINE", "true")
+# All benchmark requests come from one client
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# The export scenario runs as user 1
+os.environ.setdefault("EXPORT_ADMIN_EMAILS", "user1@example.com")
+
+import httpx
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import crud, follow_graph, models, passwords, ranking, response_cache, search, trending
+from app.auth import create_access_token
+from app.database import ASYNC_MODE, SessionLocal, engine
+from app.main import app
+
+
+class QueryCounter:
+    # Counts statements on every engine (primary, replicas, the async engine's sync side)
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def seed(rng: random.Random, users: int, follows: int, discussions: int, hashtags: int,
+         comments: int, comment_depth: int, likes: int):
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    hashed = passwords.pwd_context.hash("secret")
+    now = datetime.utcnow()
+
+    follow_rows = []
+    follower_count = Counter()
+    following_count = Counter()
+    for follower in range(1, users + 1):
+        others = [user for user in rng.sample(range(1, users + 1), min(follows + 1, users)) if user != follower][:follows]
+        for followed in others:
+            follow_rows.append({"follower_id": follower, "followed_id": followed})
+            follower_count[followed] += 1
+            following_count[follower] += 1
+    user_rows = [
+        {"id": i, "name": f"user {i}", "email": f"user{i}@example.com", "mobile_no": f"{i:010d}", "hashed_password": hashed,
+         "follower_count": follower_count[i], "following_count": following_count[i]}
+        for i in range(1, users + 1)
+    ]
+
+    discussion_rows = []
+    tag_rows = []
+    like_rows = []
+    comment_rows = []
+    for i in range(1, discussions + 1):
+        # Spread over the longest ranking window, oldest first
+        created = now - timedelta(seconds=(discussions - i) * 30 * 24 * 60 * 60 / max(discussions, 1))
+        tags = rng.sample(range(1, hashtags + 1), min(rng.randint(0, 3), hashtags))
+        words = " ".join(rng.choice(WORDS) for _ in range(12))
+        discussion_rows.append({
+            "id": i, "text": f"{words} " + " ".join(f"#tag{tag}" for tag in tags), "created_on": created,
+            "user_id": rng.randint(1, users), "view_count": rng.randint(0, 500), "like_count": 0, "comment_count": 0,
+        })
+        tag_rows.extend({"discussion_id": i, "hashtag_id": tag} for tag in tags)
+        likers = rng.sample(range(1, users + 1), min(rng.randint(0, 2 * likes), users))
+        first = len(like_rows) + 1
+        like_rows.extend({"id": first + n, "user_id": user, "discussion_id": i} for n, user in enumerate(likers))
+        discussion_rows[-1]["like_count"] = len(likers)
+        # Each top-level comment carries a reply chain comment_depth levels deep
+        for _ in range(comments):
+            parent_id = None
+            for _ in range(comment_depth + 1):
+                comment_id = len(comment_rows) + 1
+                comment_rows.append({
+                    "id": comment_id, "text": " ".join(rng.choice(WORDS) for _ in range(8)), "user_id": rng.randint(1, users),
+                    "discussion_id": i, "parent_id": parent_id, "created_on": created, "depth": 0, "like_count": 0,
+                })
+                parent_id = comment_id
+        discussion_rows[-1]["comment_count"] = comments * (comment_depth + 1)
+
+    with engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), user_rows)
+        if follow_rows:
+            connection.execute(models.followers.insert(), follow_rows)
+        if hashtags:
+            connection.execute(models.Hashtag.__table__.insert(), [{"id": i, "name": f"tag{i}"} for i in range(1, hashtags + 1)])
+        if discussion_rows:
+            connection.execute(models.Discussion.__table__.insert(), discussion_rows)
+        if tag_rows:
+            connection.execute(models.discussion_hashtag.insert(), tag_rows)
+        if like_rows:
+            connection.execute(models.Like.__table__.insert(), like_rows)
+        if comment_rows:
+            connection.execute(models.Comment.__table__.insert(), comment_rows)
+
+    db = SessionLocal()
+    try:
+        crud.fill_comment_paths(db, commit=True)
+        follow_graph.follow_graph.rebuild(db)
+        search.search_index.rebuild(db)
+        trending.trending_hashtags.rebuild(db)
+        ranking.discussion_ranking.rebuild(db)
+    finally:
+        db.close()
+    return {
+        "users": len(user_rows), "follows": len(follow_rows), "discussions": len(discussion_rows), "hashtags": hashtags,
+        "discussion_hashtags": len(tag_rows), "likes": len(like_rows), "comments": len(comment_rows),
+    }
+
+
+WORDS = ["python", "fastapi", "database", "index", "cache", "latency", "query", "replica", "thread", "social",
+         "graph", "feed", "ranking", "search", "stream", "batch", "worker", "token", "json", "async"]
+
+
+class Graph:
+    # What the request builders pick from: seeded rows, their owners and rows created by earlier phases
+
+    def __init__(self, users: int, discussion_owners, comment_owners, hashtags: int):
+        self.users = users
+        self.discussion_owners = discussion_owners
+        self.comment_owners = comment_owners
+        self.hashtags = hashtags
+        self.created_discussions = []
+        self.created_comments = []
+        self.liked_discussions = []
+        self.liked_comments = []
+        self.new_users = 0
+        self._tokens = {}
+
+    def auth(self, user_id: int):
+        token = self._tokens.get(user_id)
+        if token is None:
+            token = create_access_token(data={"sub": f"user{user_id}@example.com", "user_id": user_id})
+            self._tokens[user_id] = token
+        return {"Authorization": f"Bearer {token}"}
+
+    def user(self, rng):
+        return rng.randint(1, self.users)
+
+    def discussion(self, rng):
+        return rng.randint(1, len(self.discussion_owners))
+
+    def comment(self, rng):
+        return rng.randint(1, len(self.comment_owners))
+
+    def hashtag(self, rng):
+        return f"tag{rng.randint(1, max(self.hashtags, 1))}"
+
+
+def _created(target):
+    def collect(response):
+        if response.status_code == 200:
+            body = response.json()
+            target.append((body["id"], body["user_id"]))
+    return collect
+
+
+def _take(items):
+    # Rows created by an earlier phase, one per request; an id that does not exist (404) once they run out
+    return items.pop(0) if items else (0, 1)
+
+
+def endpoints(graph: Graph):
+    # (route, label, build(rng, i) -> (method, url, request kwargs), collect(response) or None)
+    g = graph
+
+    def new_user(rng, i):
+        g.new_users += 1
+        n = g.users + g.new_users
+        return {"json": {"name": f"user {n}", "email": f"user{n}@example.com", "mobile_no": f"{n:010d}", "password": "secret"}}
+
+    def liked_discussion(rng, i):
+        user, discussion = g.user(rng), g.discussion(rng)
+        g.liked_discussions.append((discussion, user))
+        return discussion, user
+
+    def liked_comment(rng, i):
+        user, comment = g.user(rng), g.comment(rng)
+        g.liked_comments.append((comment, user))
+        return comment, user
+
+    def owned_discussion(rng):
+        discussion = g.discussion(rng)
+        return discussion, g.discussion_owners[discussion - 1]
+
+    def owned_comment(rng):
+        comment = g.comment(rng)
+        return comment, g.comment_owners[comment - 1]
+
+    def like_operations(rng):
+        return [{"target": rng.choice(["discussion", "comment"]), "id": g.discussion(rng), "action": rng.choice(["like", "unlike"])}
+                for _ in range(20)]
+
+    specs = [
+        ("POST /token", None, lambda rng, i: ("POST", "/token", {"data": {"username": f"user{g.user(rng)}@example.com", "password": "secret"}}), None),
+        ("POST /users/", None, lambda rng, i: ("POST", "/users/", new_user(rng, i)), None),
+        ("GET /users/", None, lambda rng, i: ("GET", "/users/", {"params": {"skip": rng.randint(0, g.users), "limit": 20}}), None),
+        ("GET /users/", "GET /users/ cursor", lambda rng, i: ("GET", "/users/", {"params": {"cursor": "", "limit": 20}}), None),
+        ("GET /users/{user_id}", None, lambda rng, i: ("GET", f"/users/{g.user(rng)}", {}), None),
+        ("GET /users/{user_id}/followers", None, lambda rng, i: ("GET", f"/users/{rng.randint(1, 10)}/followers", {"params": {"limit": 20}}), None),
+        ("GET /users/{user_id}/following", None, lambda rng, i: ("GET", f"/users/{g.user(rng)}/following", {"params": {"limit": 20}}), None),
+        ("GET /users/{user_id}/mutuals", None, lambda rng, i: ("GET", f"/users/{g.user(rng)}/mutuals", {"params": {"limit": 20}}), None),
+        ("GET /users/{user_id}/following/{target_id}", None, lambda rng, i: ("GET", f"/users/{g.user(rng)}/following/{g.user(rng)}", {}), None),
+        ("GET /users/{user_id}/suggestions", None, lambda rng, i: ("GET", f"/users/{g.user(rng)}/suggestions", {}), None),
+        ("GET /users/search/", None, lambda rng, i: ("GET", "/users/search/", {"params": {"name": f"user {g.user(rng)}", "limit": 20}}), None),
+        ("POST /discussions/", None, lambda rng, i: (
+            "POST", "/discussions/", {"json": {"text": f"bench {i} #{g.hashtag(rng)}", "hashtags": [g.hashtag(rng)]}, "headers": g.auth(g.user(rng))}
+        ), _created(g.created_discussions)),
+        ("GET /discussions/", None, lambda rng, i: ("GET", "/discussions/", {"params": {"skip": rng.randint(0, 200), "limit": 20}}), None),
+        ("GET /discussions/", "GET /discussions/ cursor", lambda rng, i: ("GET", "/discussions/", {"params": {"cursor": "", "limit": 20}}), None),
+        ("GET /discussions/search", None, lambda rng, i: ("GET", "/discussions/search", {"params": {"q": f"{rng.choice(WORDS)} {rng.choice(WORDS)}", "limit": 20}}), None),
+        ("GET /discussions/hot", None, lambda rng, i: ("GET", "/discussions/hot", {"params": {"limit": 20}}), None),
+        ("GET /discussions/top", None, lambda rng, i: ("GET", "/discussions/top", {"params": {"window": rng.choice(["24h", "7d", "30d"]), "limit": 20}}), None),
+        ("GET /feed", None, lambda rng, i: ("GET", "/feed", {"params": {"limit": 20}, "headers": g.auth(g.user(rng))}), None),
+        ("GET /discussions/{discussion_id}", None, lambda rng, i: ("GET", f"/discussions/{g.discussion(rng)}", {}), None),
+        ("PUT /discussions/{discussion_id}", None, lambda rng, i: (lambda d, u: (
+            "PUT", f"/discussions/{d}", {"json": {"text": f"edited {i}", "hashtags": [g.hashtag(rng)]}, "headers": g.auth(u)}
+        ))(*owned_discussion(rng)), None),
+        ("GET /discussions/hashtag/{hashtag}", None, lambda rng, i: ("GET", f"/discussions/hashtag/{g.hashtag(rng)}", {"params": {"limit": 20}}), None),
+        ("GET /hashtags/trending", None, lambda rng, i: ("GET", "/hashtags/trending", {"params": {"window": rng.choice(["1h", "24h"])}}), None),
+        ("POST /discussions/{discussion_id}/comments/", None, lambda rng, i: (
+            "POST", f"/discussions/{g.discussion(rng)}/comments/", {"json": {"text": f"comment {i}"}, "headers": g.auth(g.user(rng))}
+        ), _created(g.created_comments)),
+        ("GET /discussions/{discussion_id}/comments/", None, lambda rng, i: ("GET", f"/discussions/{g.discussion(rng)}/comments/", {"params": {"limit": 20}}), None),
+        ("GET /discussions/{discussion_id}/comments/", "GET /discussions/{discussion_id}/comments/ tree", lambda rng, i: (
+            "GET", f"/discussions/{g.discussion(rng)}/comments/", {"params": {"tree": "true", "limit": 20}}
+        ), None),
+        ("GET /comments/{comment_id}/thread", None, lambda rng, i: ("GET", f"/comments/{g.comment(rng)}/thread", {}), None),
+        ("POST /discussions/{discussion_id}/like", None, lambda rng, i: (lambda d, u: (
+            "POST", f"/discussions/{d}/like", {"headers": g.auth(u)}
+        ))(*liked_discussion(rng, i)), None),
+        ("DELETE /discussions/{discussion_id}/like", None, lambda rng, i: (lambda d, u: (
+            "DELETE", f"/discussions/{d}/like", {"headers": g.auth(u)}
+        ))(*_take(g.liked_discussions)), None),
+        ("POST /discussions/{discussion_id}/view", None, lambda rng, i: ("POST", f"/discussions/{g.discussion(rng)}/view", {}), None),
+        ("POST /batch/likes", None, lambda rng, i: ("POST", "/batch/likes", {"json": {"operations": like_operations(rng)}, "headers": g.auth(g.user(rng))}), None),
+        ("POST /batch/follows", None, lambda rng, i: ("POST", "/batch/follows", {"json": {"operations": [
+            {"user_id": g.user(rng), "action": rng.choice(["follow", "unfollow"])} for _ in range(20)
+        ]}, "headers": g.auth(g.user(rng))}), None),
+        ("POST /batch/comments", None, lambda rng, i: ("POST", "/batch/comments", {"json": {"comments": [
+            {"text": f"batch {i}", "discussion_id": g.discussion(rng)} for _ in range(20)
+        ]}, "headers": g.auth(g.user(rng))}), None),
+        ("POST /users/{user_id}/follow/{target_id}", None, lambda rng, i: (lambda u: (
+            "POST", f"/users/{u}/follow/{g.user(rng)}", {"headers": g.auth(u)}
+        ))(g.user(rng)), None),
+        ("POST /users/{user_id}/unfollow/{target_id}", None, lambda rng, i: (lambda u: (
+            "POST", f"/users/{u}/unfollow/{g.user(rng)}", {"headers": g.auth(u)}
+        ))(g.user(rng)), None),
+        ("POST /comments/{comment_id}/reply", None, lambda rng, i: (
+            "POST", f"/comments/{g.comment(rng)}/reply", {"json": {"text": f"reply {i}"}, "headers": g.auth(g.user(rng))}
+        ), None),
+        ("POST /comments/{comment_id}/like", None, lambda rng, i: (lambda c, u: (
+            "POST", f"/comments/{c}/like", {"headers": g.auth(u)}
+        ))(*liked_comment(rng, i)), None),
+        ("DELETE /comments/{comment_id}/like", None, lambda rng, i: (lambda c, u: (
+            "DELETE", f"/comments/{c}/like", {"headers": g.auth(u)}
+        ))(*_take(g.liked_comments)), None),
+        ("PUT /comments/{comment_id}", None, lambda rng, i: (lambda c, u: (
+            "PUT", f"/comments/{c}", {"json": {"text": f"edited {i}"}, "headers": g.auth(u)}
+        ))(*owned_comment(rng)), None),
+        ("DELETE /comments/{comment_id}", None, lambda rng, i: (lambda c, u: (
+            "DELETE", f"/comments/{c}", {"headers": g.auth(u)}
+        ))(*_take(g.created_comments)), None),
+        ("GET /export", None, lambda rng, i: ("GET", "/export", {"params": {"types": "user,follow"}, "headers": g.auth(1)}), None),
+        ("GET /metrics", None, lambda rng, i: ("GET", "/metrics", {}), None),
+        ("DELETE /discussions/{discussion_id}", None, lambda rng, i: (lambda d, u: (
+            "DELETE", f"/discussions/{d}", {"headers": g.auth(u)}
+        ))(*_take(g.created_discussions)), None),
+    ]
+    return [(route, label or route, build, collect) for route, label, build, collect in specs]
+
+
+def summarize(latencies, statuses, queries: int, elapsed: float):
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [latencies[0] if latencies else 0] * 99
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(quantiles[49], 2),
+        "p95_ms": round(quantiles[94], 2),
+        "p99_ms": round(quantiles[98], 2),
+        # Phases run one at a time, so every statement in a phase belongs to its requests
+        "queries_per_request": round(queries / len(latencies), 2) if latencies else 0,
+    }
+
+
+async def run_phase(client, counter: QueryCounter, rng: random.Random, build, collect, requests: int, concurrency: int):
+    latencies = []
+    statuses = Counter()
+    # Requests are built up front so the random choices do not depend on worker scheduling
+    planned = [build(rng, i) for i in range(requests)]
+    queue = iter(planned)
+
+    async def worker():
+        for method, url, kwargs in queue:
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] += 1
+            if collect is not None:
+                collect(response)
+
+    queries = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, statuses, counter.count - queries, elapsed)
+
+
+async def run(graph: Graph, requests: int, concurrency: int, warmup: int, seed_value: int, only):
+    counter = QueryCounter()
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for route, label, build, collect in endpoints(graph):
+            if only and not any(pattern in label for pattern in only):
+                continue
+            rng = random.Random(f"{seed_value}:{label}")
+            if warmup:
+                await run_phase(client, counter, rng, build, collect, warmup, concurrency)
+            results[label] = await run_phase(client, counter, rng, build, collect, requests, concurrency)
+    return results
+
+
+def benchmarked_routes(graph: Graph):
+    routes = {route for route, _, _, _ in endpoints(graph)}
+    missing = []
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            for method in sorted(route.methods - {"HEAD"}):
+                if f"{method} {route.path}" not in routes:
+                    missing.append(f"{method} {route.path}")
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--follows", type=int, default=20, help="follow edges per user")
+    parser.add_argument("--discussions", type=int, default=1000)
+    parser.add_argument("--hashtags", type=int, default=50)
+    parser.add_argument("--comments", type=int, default=3, help="top-level comments per discussion")
+    parser.add_argument("--comment-depth", type=int, default=3, help="replies below each top-level comment")
+    parser.add_argument("--likes", type=int, default=5, help="average likes per discussion")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-response-cache", action="store_true", help="disable app/response_cache.py")
+    parser.add_argument("--only", action="append", help="only endpoints whose label contains this (repeatable)")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    if args.no_response_cache:
+        response_cache.RESPONSE_CACHE_ENABLED = False
+    rng = random.Random(args.seed)
+    counts = seed(rng, args.users, args.follows, args.discussions, args.hashtags, args.comments, args.comment_depth, args.likes)
+    db = SessionLocal()
+    try:
+        discussion_owners = [user_id for user_id, in db.query(models.Discussion.user_id).order_by(models.Discussion.id)]
+        comment_owners = [user_id for user_id, in db.query(models.Comment.user_id).order_by(models.Comment.id)]
+    finally:
+        db.close()
+    graph = Graph(args.users, discussion_owners, comment_owners, args.hashtags)
+    try:
+        endpoint_results = asyncio.run(run(graph, args.requests, args.concurrency, args.warmup, args.seed, args.only))
+    finally:
+        passwords.password_hasher.shutdown()
+    results = {
+        "config": {
+            **{key: value for key, value in vars(args).items() if key != "output"},
+            "database": engine.dialect.name,
+            "async_mode": ASYNC_MODE,
+            "response_cache": response_cache.RESPONSE_CACHE_ENABLED,
+            "fast_json": os.getenv("FAST_JSON", "false"),
+        },
+        "seeded": counts,
+        "endpoints": endpoint_results,
+        "not_benchmarked": benchmarked_routes(graph),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Cost of idle event-stream connections and of fanning one event out to all of them.
+
+    python tests/performance/bench_events.py --connections 10000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+from app import events, models
+from app.database import SessionLocal, engine
+from app.main import app
+
+
+def seed_discussion():
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = models.User(name="bench", email="bench@example.com", mobile_no="1", hashed_password="x")
+        db.add(user)
+        db.flush()
+        discussion = models.Discussion(text="bench", user_id=user.id)
+        db.add(discussion)
+        db.commit()
+        return discussion.id
+    finally:
+        db.close()
+
+
+class Connection:
+    # One SSE request driven straight through the ASGI app, as a server would: the client sends
+    # nothing and stays connected until told to go
+    def __init__(self, path: str):
+        self.scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(b"host", b"bench")], "client": ("10.0.0.1", 1234), "server": ("bench", 80), "scheme": "http",
+        }
+        self.disconnect = asyncio.Event()
+        self.events = 0
+        self.received = asyncio.Event()
+
+    async def receive(self):
+        await self.disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] == "http.response.body" and message.get("body", b"").startswith(b"data: "):
+            self.events += 1
+            self.received.set()
+
+    async def run(self):
+        await app(self.scope, self.receive, self.send)
+
+
+async def bench(connections: int, discussion_id: int, events_count: int):
+    path = f"/discussions/{discussion_id}/events"
+    channel = [events.discussion_channel(discussion_id)]
+
+    gc.collect()
+    tracemalloc.start()
+    clients = [Connection(path) for _ in range(connections)]
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(client.run()) for client in clients]
+    while len(events.hub) < connections:
+        await asyncio.sleep(0.05)
+    connect_seconds = time.perf_counter() - started
+    # Idle for a moment so every stream is parked on its queue
+    await asyncio.sleep(0.5)
+    gc.collect()
+    idle_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    fan_out = []
+    for n in range(events_count):
+        for client in clients:
+            client.received.clear()
+        started = time.perf_counter()
+        # From another thread, like a write handled on the threadpool
+        await asyncio.to_thread(events.publish, "bench", channel, {"n": n})
+        for client in clients:
+            await client.received.wait()
+        fan_out.append(time.perf_counter() - started)
+
+    for client in clients:
+        client.disconnect.set()
+    events.hub.close_all()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        "connections": connections,
+        "connect_seconds": round(connect_seconds, 2),
+        "idle_bytes_per_connection": round(idle_bytes / connections),
+        "fan_out_ms": round(sorted(fan_out)[len(fan_out) // 2] * 1e3, 1),
+        "fan_out_us_per_subscriber": round(sorted(fan_out)[len(fan_out) // 2] / connections * 1e6, 2),
+        "delivered": sum(client.events for client in clients),
+        "dropped": events.hub.dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=5)
+    args = parser.parse_args()
+
+    discussion_id = seed_discussion()
+    print(json.dumps(asyncio.run(bench(args.connections, discussion_id, args.events)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Memory and lookup cost of the in-memory follow graph for a given number of follow edges.
+
+    python tests/performance/bench_follow_graph.py --users 100000 --edges 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+
+from app import models
+from app.database import SessionLocal, engine
+from app.follow_graph import FollowGraph
+
+
+def seed(users: int, edges: int, seed_value: int):
+    # Follows skewed towards low ids, so a few accounts have most of the followers
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed_value)
+    pairs = set()
+    while len(pairs) < edges:
+        follower = rng.randint(1, users)
+        followed = min(int(rng.paretovariate(1.2)), users)
+        if follower != followed:
+            pairs.add((follower, followed))
+    rows = [{"follower_id": a, "followed_id": b} for a, b in pairs]
+    with engine.begin() as connection:
+        for start in range(0, len(rows), 50000):
+            connection.execute(models.followers.insert(), rows[start:start + 50000])
+    return sorted(pairs)
+
+
+def per_call(fn, calls: int):
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - started) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    pairs = seed(args.users, args.edges, args.seed)
+    graph = FollowGraph()
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        graph.rebuild(db)
+        rebuild_seconds = time.perf_counter() - started
+        # Again under tracemalloc, which slows allocation down too much to time it
+        graph.clear()
+        gc.collect()
+        tracemalloc.start()
+        graph.rebuild(db)
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        db.close()
+
+    # The obvious alternative, for scale: one set of (follower, followed) tuples
+    gc.collect()
+    tracemalloc.start()
+    edge_set = {(follower, followed) for follower, followed in pairs}
+    set_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del edge_set
+
+    rng = random.Random(args.seed)
+    probes = [(rng.randint(1, args.users), rng.randint(1, 100)) for _ in range(args.lookups)]
+    celebrity = max(range(1, 101), key=graph.follower_count)
+    results = {
+        "edges": len(graph),
+        "rebuild_seconds": round(rebuild_seconds, 2),
+        "retained_bytes": retained,
+        "peak_rebuild_bytes": peak,
+        "bytes_per_edge": round(retained / max(len(graph), 1), 1),
+        "tuple_set_bytes_per_edge": round(set_bytes / max(len(pairs), 1), 1),
+        "is_following_ns": round(per_call(lambda i: graph.is_following(*probes[i]), len(probes)) * 1e9),
+        "followers_page_us": round(per_call(lambda i: graph.followers(celebrity, after_id=i, limit=100), 10000) * 1e6, 1),
+        "mutuals_us": round(per_call(lambda i: graph.mutuals(probes[i][0], limit=100), 10000) * 1e6, 1),
+        "suggestions_ms": round(per_call(lambda i: graph.suggestions(probes[i][0], limit=10), 1000) * 1e3, 2),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Login throughput next to concurrent read latency, bcrypt inline vs in the process pool.
+
+    python tests/performance/bench_login.py --seconds 10 --logins 16 --readers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+
+import httpx
+
+from app import models, passwords
+from app.database import SessionLocal, engine
+from app.main import app
+
+
+def seed(users: int):
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    hashed = passwords.pwd_context.hash("secret")
+    db = SessionLocal()
+    db.add_all([models.User(name=f"user {i}", email=f"user{i}@example.com", mobile_no=f"{i:010d}", hashed_password=hashed) for i in range(users)])
+    db.flush()
+    db.add_all([models.Discussion(text=f"discussion {i}", user_id=1, view_count=0) for i in range(20)])
+    db.commit()
+    db.close()
+
+
+async def run(seconds: float, logins: int, readers: int, users: int):
+    deadline = time.perf_counter() + seconds
+    login_count = 0
+    rejected = 0
+    read_latencies = []
+
+    async def login_worker(n):
+        nonlocal login_count, rejected
+        i = n
+        while time.perf_counter() < deadline:
+            response = await client.post("/token", data={"username": f"user{i % users}@example.com", "password": "secret"})
+            if response.status_code == 200:
+                login_count += 1
+            else:
+                rejected += 1
+            i += logins
+
+    async def read_worker():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await client.get("/discussions/", params={"limit": 20})
+            read_latencies.append((time.perf_counter() - started) * 1000)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*[login_worker(n) for n in range(logins)], *[read_worker() for _ in range(readers)])
+
+    quantiles = statistics.quantiles(read_latencies, n=100) if len(read_latencies) > 1 else [0] * 99
+    return {
+        "logins_per_second": round(login_count / seconds, 1),
+        "logins_rejected": rejected,
+        "reads_per_second": round(len(read_latencies) / seconds, 1),
+        "read_p50_ms": round(quantiles[49], 2),
+        "read_p95_ms": round(quantiles[94], 2),
+        "read_p99_ms": round(quantiles[98], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--logins", type=int, default=16, help="concurrent login clients")
+    parser.add_argument("--readers", type=int, default=4, help="concurrent GET /discussions/ clients")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=passwords.PASSWORD_HASH_WORKERS, help="hash pool size")
+    args = parser.parse_args()
+
+    seed(args.users)
+    results = {}
+    for mode, workers in (("inline", 0), ("pool", args.workers)):
+        passwords.password_hasher.shutdown()
+        # inline mode mimics the old behaviour: no pool and no practical queue limit
+        queue = 10 ** 6 if workers == 0 else passwords.PASSWORD_HASH_QUEUE
+        passwords.password_hasher = passwords.PasswordHasher(workers=workers, queue_size=queue)
+        results[mode] = asyncio.run(run(args.seconds, args.logins, args.readers, args.users))
+    passwords.password_hasher.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
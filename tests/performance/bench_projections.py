@@ -0,0 +1,98 @@
+"""Rows per second and peak memory of the list queries, ORM objects vs Core projections.
+
+    python tests/performance/bench_projections.py --discussions 2000 --limit 100 --repeat 50
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+
+from app import crud, models, projections
+from app.database import SessionLocal, engine
+
+
+def seed(users: int, discussions: int, comments: int):
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    text = "x" * 1000
+    with engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [
+            {"name": f"user {i}", "email": f"user{i}@example.com", "mobile_no": f"{i:010d}", "hashed_password": "$2b$12$" + "h" * 53}
+            for i in range(users)
+        ])
+        connection.execute(models.Hashtag.__table__.insert(), [{"name": "python"}])
+        connection.execute(models.Discussion.__table__.insert(), [
+            {"text": text, "user_id": i % users + 1, "view_count": 0} for i in range(discussions)
+        ])
+        connection.execute(models.discussion_hashtag.insert(), [
+            {"discussion_id": i + 1, "hashtag_id": 1} for i in range(discussions)
+        ])
+        connection.execute(models.Comment.__table__.insert(), [
+            {"text": text[:200], "user_id": i % users + 1, "discussion_id": i % discussions + 1}
+            for i in range(comments)
+        ])
+
+
+# The ORM listings the endpoints used before app/projections.py, kept here as the baseline
+def orm_discussions(db, skip: int = 0, limit: int = 100):
+    discussions = db.query(models.Discussion).options(*crud.discussion_load_options()).order_by(models.Discussion.id)
+    return crud.attach_discussion_trees(discussions.offset(skip).limit(limit).all())
+
+
+def orm_users(db, skip: int = 0, limit: int = 100):
+    users = db.query(models.User).options(*crud.user_load_options()).order_by(models.User.id).offset(skip).limit(limit).all()
+    for user in users:
+        crud.attach_discussion_trees(user.discussions)
+    return users
+
+
+def measure(fn, repeat: int, limit: int):
+    rows = 0
+    db = SessionLocal()
+    try:
+        gc.collect()
+        tracemalloc.start()
+        result = fn(db, skip=0, limit=limit)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.expunge_all()
+        del result
+        started = time.perf_counter()
+        for i in range(repeat):
+            rows += len(fn(db, skip=(i * limit) % 1000, limit=limit))
+            db.expunge_all()
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    return {"rows_per_second": round(rows / elapsed, 1), "peak_kib_per_request": round(peak / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--discussions", type=int, default=2000)
+    parser.add_argument("--comments", type=int, default=4000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    seed(args.users, args.discussions, args.comments)
+    results = {}
+    for name, orm in (("get_discussions", orm_discussions), ("get_users", orm_users)):
+        results[name] = {
+            "orm": measure(orm, args.repeat, args.limit),
+            "core": measure(getattr(projections, name), args.repeat, args.limit),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
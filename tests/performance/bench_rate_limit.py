@@ -0,0 +1,92 @@
+"""Per-check cost of the rate limiter, alone and from several threads at once.
+
+    python tests/performance/bench_rate_limit.py --clients 10000 --checks 200000 --threads 4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+
+from starlette.requests import Request
+
+from app import rate_limit
+from app.auth import create_access_token
+from app.main import app
+
+
+def make_request(method: str, path: str, headers=(), client=("10.0.0.1", 1234)):
+    scope = {
+        "type": "http", "method": method, "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+        "client": client, "server": ("testserver", 80), "scheme": "http", "root_path": "", "app": app,
+    }
+    return Request(scope)
+
+
+def per_call(fn, items):
+    started = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - started) / len(items)
+
+
+def threaded(fn, items, threads: int):
+    chunks = [items[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=lambda chunk=chunk: [fn(item) for item in chunk]) for chunk in chunks]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--checks", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # Generous limits, so every check takes the full path through an existing bucket
+    limiter = rate_limit.RateLimiter("POST /discussions/=1000000/1,POST /token=1000000/1", default="1000000/1")
+    rate_limit.set_backend(rate_limit.InMemoryTokenBuckets())
+    keys = [("POST /discussions/", f"user:{rng.randint(1, args.clients)}") for _ in range(args.checks)]
+    tokens = [create_access_token({"sub": f"user{i}@example.com", "user_id": i}) for i in range(1, min(args.clients, 2000) + 1)]
+    authenticated = [
+        make_request("POST", "/discussions/", [("Authorization", f"Bearer {rng.choice(tokens)}")])
+        for _ in range(args.checks // 10)
+    ]
+    anonymous = [
+        make_request("POST", "/token", client=(f"10.0.{i % 256}.{i // 256 % 256}", 1234))
+        for i in (rng.randint(0, args.clients) for _ in range(args.checks // 10))
+    ]
+    unlimited = [make_request("GET", f"/discussions/{i}") for i in range(args.checks // 10)]
+    # Warm the token cache and the compiled routes
+    for request in authenticated + anonymous[:1]:
+        limiter.check(request)
+
+    buckets = rate_limit.bucket_store
+    results = {
+        "acquire_us": round(per_call(lambda key: buckets.acquire(key, 1000000, 1000000), keys) * 1e6, 3),
+        f"acquire_{args.threads}_threads_us": round(threaded(lambda key: buckets.acquire(key, 1000000, 1000000), keys, args.threads) * 1e6, 3),
+        "check_authenticated_us": round(per_call(limiter.check, authenticated) * 1e6, 3),
+        "check_anonymous_us": round(per_call(limiter.check, anonymous) * 1e6, 3),
+        "check_default_limit_us": round(per_call(limiter.check, unlimited) * 1e6, 3),
+        "buckets": len(buckets),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app import async_crud, async_routes, auth, crud, models, response_cache
+from app.database import get_async_engine, get_async_sessionmaker
+from app.main import app
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def async_app():
+    async_app = FastAPI()
+    async_app.router.routes.extend(app.router.routes)
+    async_routes.install(async_app)
+    yield async_app
+    await get_async_engine().dispose()
+
+
+def test_install_replaces_sync_read_routes():
+    async_app = FastAPI()
+    async_app.router.routes.extend(app.router.routes)
+    before = [(route.path, sorted(route.methods)) for route in async_app.router.routes if hasattr(route, "methods")]
+    async_routes.install(async_app)
+    assert [(route.path, sorted(route.methods)) for route in async_app.router.routes if hasattr(route, "methods")] == before
+    read_users = next(r for r in async_app.router.routes if getattr(r, "path", None) == "/users/" and "GET" in r.methods)
+    assert read_users.endpoint is async_routes.read_users
+
+
+@pytest.mark.anyio
+@pytest.mark.read_endpoints("/discussions/?cursor=&limit=3", "/discussions/999")
+async def test_async_routes_match_sync_routes(async_app, client, db, url, seed):
+    seed(discussions=5)
+    expected = client.get(url)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=async_app), base_url="http://test") as async_client:
+        response = await async_client.get(url)
+    assert response.status_code == expected.status_code
+    assert response.json() == expected.json()
+
+
+@pytest.mark.anyio
+async def test_async_current_user(db, seed):
+    seed(discussions=1)
+    token = auth.create_access_token(data={"sub": "user1@example.com"})
+    try:
+        async with get_async_sessionmaker()() as session:
+            user = await auth.get_current_user_async(token=token, db=session)
+            assert user.id == 2
+            assert await async_crud.get_user_by_email(session, "nobody@example.com") is None
+    finally:
+        await get_async_engine().dispose()
+
+
+@pytest.mark.anyio
+async def test_async_comments_stop_at_the_tree_depth_limit(async_app, client, db, seed):
+    seed(discussions=1, depth=crud.COMMENT_TREE_MAX_DEPTH + 2)
+    url = "/discussions/1/comments/?limit=1"
+    # Async first, so the response cache holds its body rather than the sync one
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=async_app), base_url="http://test") as async_client:
+        response = await async_client.get(url)
+    assert response.status_code == 200
+    response_cache.response_store.clear()
+    assert response.json() == client.get(url).json()
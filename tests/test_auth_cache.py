@@ -0,0 +1,49 @@
+from jose import jwt
+
+from app import auth, models
+from app.cache import TTLCache
+
+
+def test_token_carries_user_id(client, signup):
+    user_id, headers = signup("alice")
+    token = headers["Authorization"].split()[1]
+    assert jwt.get_unverified_claims(token)["user_id"] == user_id
+
+
+def test_cached_principal_needs_no_query(client, signup, count_queries):
+    user_id, headers = signup("alice")
+    client.post("/discussions/", json={"text": "warm up"}, headers=headers)
+    with count_queries() as statements:
+        response = client.post("/discussions/", json={"text": "cached"}, headers=headers)
+    assert response.status_code == 200
+    assert not any("FROM users" in statement for statement in statements)
+
+
+def test_deleted_user_is_invalidated(client, signup, db):
+    user_id, headers = signup("alice")
+    assert client.post("/discussions/", json={"text": "first"}, headers=headers).status_code == 200
+    db.delete(db.get(models.User, user_id))
+    db.commit()
+    assert auth.principal_cache.get("alice@example.com") is None
+    assert client.post("/discussions/", json={"text": "second"}, headers=headers).status_code == 401
+
+
+def test_email_change_invalidates_old_subject(client, signup, db):
+    user_id, headers = signup("alice")
+    client.post("/discussions/", json={"text": "first"}, headers=headers)
+    db.get(models.User, user_id).email = "alice@new.example.com"
+    db.commit()
+    assert client.post("/discussions/", json={"text": "second"}, headers=headers).status_code == 401
+
+
+def test_ttl_cache_expires_and_evicts_lru():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("a") is None
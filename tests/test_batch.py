@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import models
+
+
+@pytest.fixture
+def world(client, signup):
+    reader_id, reader = signup("reader")
+    author_id, author = signup("author")
+    discussions = [client.post("/discussions/", json={"text": f"d{i}"}, headers=author).json()["id"] for i in range(3)]
+    comment = client.post(f"/discussions/{discussions[0]}/comments/", json={"text": "c"}, headers=author).json()["id"]
+    return reader_id, reader, author_id, discussions, comment
+
+
+def test_batch_likes_are_idempotent_and_counted(client, world, count_queries):
+    _, reader, _, discussions, comment = world
+    operations = [{"target": "discussion", "id": d} for d in discussions] + [{"target": "comment", "id": comment}]
+    with count_queries() as statements:
+        result = client.post("/batch/likes", json={"operations": operations}, headers=reader).json()
+    assert result == {"applied": 4, "skipped": 0}
+    assert len([s for s in statements if s.lstrip().upper().startswith("INSERT")]) == 2
+
+    again = operations + [{"target": "discussion", "id": discussions[2], "action": "unlike"}]
+    assert client.post("/batch/likes", json={"operations": again}, headers=reader).json() == {"applied": 1, "skipped": 4}
+    assert [client.get(f"/discussions/{d}").json()["like_count"] for d in discussions] == [1, 1, 0]
+    assert client.get(f"/discussions/{discussions[0]}").json()["comments"][0]["like_count"] == 1
+
+
+def test_batch_rejects_unknown_targets_atomically(client, world):
+    _, reader, _, discussions, _ = world
+    operations = [{"target": "discussion", "id": discussions[0]}, {"target": "discussion", "id": 999}]
+    response = client.post("/batch/likes", json={"operations": operations}, headers=reader)
+    assert response.status_code == 404
+    assert client.get(f"/discussions/{discussions[0]}").json()["like_count"] == 0
+
+
+def test_batch_follows_and_comments(client, signup, world):
+    reader_id, reader, author_id, discussions, comment = world
+    other_id, _ = signup("other")
+    operations = [{"user_id": author_id}, {"user_id": other_id}, {"user_id": author_id}]
+    assert client.post("/batch/follows", json={"operations": operations}, headers=reader).json() == {"applied": 2, "skipped": 1}
+    assert client.get(f"/users/{reader_id}").json()["following_count"] == 2
+    assert client.get(f"/users/{author_id}").json()["follower_count"] == 1
+
+    comments = [{"discussion_id": discussions[0], "text": "x", "parent_id": comment}, {"discussion_id": discussions[1], "text": "y"}]
+    assert client.post("/batch/comments", json={"comments": comments}, headers=reader).json() == {"applied": 2, "skipped": 0}
+    assert client.get(f"/discussions/{discussions[0]}").json()["comment_count"] == 2
+    wrong_parent = [{"discussion_id": discussions[1], "text": "z", "parent_id": comment}]
+    assert client.post("/batch/comments", json={"comments": wrong_parent}, headers=reader).status_code == 404
+
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_batch_comments_come_from_their_own_insert(client, db, monkeypatch, world, returning):
+    reader_id, reader, _, discussions, comment = world
+    dialect = db.get_bind().dialect
+    monkeypatch.setattr(dialect, "insert_executemany_returning_sort_by_parameter_order", returning)
+    # A pathless comment by the same user that the batch must leave alone
+    stray = models.Comment(text="stray", user_id=reader_id, discussion_id=discussions[0])
+    db.add(stray)
+    db.commit()
+
+    comments = [{"discussion_id": discussions[0], "text": "x", "parent_id": comment}, {"discussion_id": discussions[0], "text": "y"}]
+    assert client.post("/batch/comments", json={"comments": comments}, headers=reader).json() == {"applied": 2, "skipped": 0}
+    created = db.query(models.Comment).filter(models.Comment.text.in_(["x", "y"])).order_by(models.Comment.id).all()
+    assert [(c.text, c.parent_id, c.depth) for c in created] == [("x", comment, 1), ("y", None, 0)]
+    assert all(c.path is not None for c in created)
+    db.refresh(stray)
+    assert stray.path is None
+
+
+def test_single_like_is_idempotent(client, world):
+    _, reader, _, discussions, _ = world
+    client.post(f"/discussions/{discussions[0]}/like", headers=reader)
+    client.post(f"/discussions/{discussions[0]}/like", headers=reader)
+    assert client.get(f"/discussions/{discussions[0]}").json()["like_count"] == 1
+
+
+def test_database_enforces_unique_likes(db, world):
+    reader_id, _, _, discussions, _ = world
+    db.add_all([models.Like(user_id=reader_id, discussion_id=discussions[0]) for _ in range(2)])
+    with pytest.raises(IntegrityError):
+        db.commit()
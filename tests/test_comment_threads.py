@@ -0,0 +1,119 @@
+from sqlalchemy.dialects import mysql
+
+from app import crud, migrate, models
+
+
+def post_comment(client, headers, discussion_id, text, parent_id=None):
+    url = f"/comments/{parent_id}/reply" if parent_id else f"/discussions/{discussion_id}/comments/"
+    response = client.post(url, json={"text": text}, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def build_threads(client, signup):
+    _, headers = signup("alice")
+    discussion_id = client.post("/discussions/", json={"text": "topic", "hashtags": []}, headers=headers).json()["id"]
+    first = post_comment(client, headers, discussion_id, "first")
+    second = post_comment(client, headers, discussion_id, "second")
+    a = post_comment(client, headers, discussion_id, "a", first["id"])
+    b = post_comment(client, headers, discussion_id, "b", first["id"])
+    aa = post_comment(client, headers, discussion_id, "aa", a["id"])
+    post_comment(client, headers, discussion_id, "aaa", aa["id"])
+    return headers, discussion_id, first, second, a, b
+
+
+def texts(tree):
+    return [(c["text"], texts(c["replies"])) for c in tree]
+
+
+def test_replies_store_path_root_and_depth(client, signup, db):
+    _, _, first, _, a, _ = build_threads(client, signup)
+    reply = crud.get_comment(db, a["id"])
+    assert a["thread_root_id"] == first["id"] and a["depth"] == 1
+    assert reply.path == crud.comment_path_segment(first["id"]) + crud.comment_path_segment(a["id"])
+
+
+def test_tree_lists_top_level_comments_with_nested_replies(client, signup):
+    _, discussion_id, *_ = build_threads(client, signup)
+    tree = client.get(f"/discussions/{discussion_id}/comments/?tree=true").json()
+    assert texts(tree) == [("first", [("a", [("aa", [("aaa", [])])]), ("b", [])]), ("second", [])]
+
+    trimmed = client.get(f"/discussions/{discussion_id}/comments/?tree=true&max_depth=1").json()
+    assert texts(trimmed) == [("first", [("a", []), ("b", [])]), ("second", [])]
+    assert client.get(f"/discussions/{discussion_id}/comments/?tree=true&max_depth=-1").status_code == 400
+
+
+def test_tree_pages_through_top_level_comments(client, signup):
+    _, discussion_id, *_ = build_threads(client, signup)
+    page = client.get(f"/discussions/{discussion_id}/comments/?tree=true&cursor=&limit=1").json()
+    assert texts(page["items"]) == [("first", [("a", [("aa", [("aaa", [])])]), ("b", [])])]
+    page = client.get(f"/discussions/{discussion_id}/comments/?tree=true&limit=1&cursor={page['next_cursor']}").json()
+    assert texts(page["items"]) == [("second", [])]
+    assert page["next_cursor"] is None
+
+
+def test_thread_endpoint_returns_subtree_and_pages_replies(client, signup):
+    _, _, first, _, a, _ = build_threads(client, signup)
+    thread = client.get(f"/comments/{a['id']}/thread").json()
+    assert texts([thread]) == [("a", [("aa", [("aaa", [])])])]
+    assert texts([client.get(f"/comments/{a['id']}/thread?max_depth=1").json()]) == [("a", [("aa", [])])]
+
+    page = client.get(f"/comments/{first['id']}/thread?cursor=&limit=1&max_depth=0").json()
+    assert texts(page["items"]) == [("a", [])]
+    page = client.get(f"/comments/{first['id']}/thread?cursor={page['next_cursor']}&limit=1").json()
+    assert texts(page["items"]) == [("b", [])] and page["next_cursor"] is None
+    assert client.get("/comments/999/thread").status_code == 404
+
+
+def test_deleting_a_comment_promotes_its_replies_to_threads(client, signup, db):
+    headers, discussion_id, first, _, a, _ = build_threads(client, signup)
+    assert client.delete(f"/comments/{a['id']}", headers=headers).json() is True
+
+    tree = client.get(f"/discussions/{discussion_id}/comments/?tree=true").json()
+    assert texts(tree) == [("first", [("b", [])]), ("second", []), ("aa", [("aaa", [])])]
+    aa = tree[2]
+    assert (aa["parent_id"], aa["depth"], aa["thread_root_id"]) == (None, 0, aa["id"])
+    assert aa["replies"][0]["depth"] == 1 and aa["replies"][0]["thread_root_id"] == aa["id"]
+    assert texts([client.get(f"/comments/{aa['id']}/thread").json()]) == [("aa", [("aaa", [])])]
+    assert crud.get_comment(db, aa["replies"][0]["id"]).path == crud.comment_path_segment(aa["id"]) + crud.comment_path_segment(aa["replies"][0]["id"])
+
+
+def test_thread_is_loaded_with_constant_queries(client, signup, db, count_queries):
+    headers, discussion_id, first, *_ = build_threads(client, signup)
+    with count_queries() as small:
+        client.get(f"/discussions/{discussion_id}/comments/?tree=true")
+    parent = first["id"]
+    for i in range(10):
+        parent = post_comment(client, headers, discussion_id, f"deep {i}", parent)["id"]
+    with count_queries() as large:
+        client.get(f"/discussions/{discussion_id}/comments/?tree=true")
+    assert len(small) == len(large) == 2
+
+
+def test_batch_comments_get_paths(client, signup, db):
+    headers, discussion_id, first, *_ = build_threads(client, signup)
+    response = client.post("/batch/comments", json={"comments": [
+        {"discussion_id": discussion_id, "text": "batch root"},
+        {"discussion_id": discussion_id, "text": "batch reply", "parent_id": first["id"]},
+    ]}, headers=headers)
+    assert response.status_code == 200
+    assert db.query(models.Comment).filter(models.Comment.path.is_(None)).count() == 0
+    tree = client.get(f"/discussions/{discussion_id}/comments/?tree=true&max_depth=1").json()
+    assert [c["text"] for c in tree] == ["first", "second", "batch root"]
+    assert [c["text"] for c in tree[0]["replies"]] == ["a", "b", "batch reply"]
+
+
+def test_migration_backfills_existing_comments(db, seed):
+    seed(discussions=2, depth=4)
+    assert db.query(models.Comment).filter(models.Comment.path.is_(None)).count() == 8
+    assert migrate.migrate(db, batch_size=3)["comment paths"] == 8
+    deepest = db.query(models.Comment).order_by(models.Comment.id.desc()).first()
+    assert deepest.depth == 3
+    assert deepest.thread_root_id == deepest.discussion_id * 4 - 3
+    assert migrate.migrate(db)["comment paths"] == 0
+
+
+def test_paths_use_byte_ordering_on_mysql():
+    # The "~" that ends a subtree range must sort after every base-36 digit
+    path_type = models.Comment.__table__.c.path.type.compile(dialect=mysql.dialect())
+    assert path_type == "VARCHAR(512) CHARACTER SET ascii COLLATE ascii_bin"
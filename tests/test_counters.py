@@ -0,0 +1,51 @@
+from app import models
+from app.reconcile import reconcile_counters
+
+
+def test_counters_follow_writes(client, signup):
+    reader_id, reader = signup("reader")
+    author_id, author = signup("author")
+    discussion_id = client.post("/discussions/", json={"text": "hello"}, headers=author).json()["id"]
+
+    client.post(f"/discussions/{discussion_id}/like", headers=reader)
+    comment_id = client.post(f"/discussions/{discussion_id}/comments/", json={"text": "hi"}, headers=reader).json()["id"]
+    client.post(f"/comments/{comment_id}/reply", json={"text": "hi back"}, headers=author)
+    client.post(f"/comments/{comment_id}/like", headers=author)
+    client.post(f"/users/{reader_id}/follow/{author_id}", headers=reader)
+    client.post(f"/users/{reader_id}/follow/{author_id}", headers=reader)
+
+    discussion = client.get(f"/discussions/{discussion_id}").json()
+    assert discussion["like_count"] == 1
+    assert discussion["comment_count"] == 2
+    assert next(c for c in discussion["comments"] if c["id"] == comment_id)["like_count"] == 1
+    assert client.get(f"/users/{author_id}").json()["follower_count"] == 1
+    assert client.get(f"/users/{reader_id}").json()["following_count"] == 1
+
+    client.delete(f"/discussions/{discussion_id}/like", headers=reader)
+    client.delete(f"/discussions/{discussion_id}/like", headers=reader)
+    client.post(f"/users/{reader_id}/unfollow/{author_id}", headers=reader)
+    assert client.get(f"/discussions/{discussion_id}").json()["like_count"] == 0
+    assert client.get(f"/users/{author_id}").json()["follower_count"] == 0
+
+
+def test_reconcile_rebuilds_counters_from_base_tables(db):
+    users = [models.User(name=f"user {i}", email=f"user{i}@example.com", mobile_no=f"555000{i}", hashed_password="x") for i in range(3)]
+    db.add_all(users)
+    db.flush()
+    discussion = models.Discussion(text="drifted", user_id=users[0].id, view_count=0, like_count=42)
+    db.add(discussion)
+    db.flush()
+    db.add_all([models.Like(user_id=u.id, discussion_id=discussion.id) for u in users])
+    db.add(models.Comment(text="c", user_id=users[1].id, discussion_id=discussion.id))
+    db.execute(models.followers.insert(), [{"follower_id": users[1].id, "followed_id": users[0].id},
+                                            {"follower_id": users[2].id, "followed_id": users[0].id}])
+    db.commit()
+
+    fixed = reconcile_counters(db, batch_size=2)
+    assert fixed["discussions.like_count"] == 1
+
+    db.expire_all()
+    assert (discussion.like_count, discussion.comment_count) == (3, 1)
+    assert [u.follower_count for u in users] == [2, 0, 0]
+    assert [u.following_count for u in users] == [0, 1, 1]
+    assert reconcile_counters(db)["users.follower_count"] == 0
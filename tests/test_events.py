@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import time
+
+import orjson
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app import events
+from app.events import EventHub, InProcessBroker, SlowConsumer
+
+
+@pytest.fixture(autouse=True)
+def hub(monkeypatch):
+    hub = EventHub(max_queue=100)
+    monkeypatch.setattr(events, "hub", hub)
+    monkeypatch.setattr(events, "broker", InProcessBroker(hub))
+    return hub
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_discussion_websocket_streams_comments_and_likes(client, signup):
+    _, alice = signup("alice")
+    bob_id, bob = signup("bob")
+    discussion_id = client.post("/discussions/", json={"text": "live", "hashtags": []}, headers=alice).json()["id"]
+
+    with client.websocket_connect(f"/discussions/{discussion_id}/events/ws") as ws:
+        comment = client.post(f"/discussions/{discussion_id}/comments/", json={"text": "first"}, headers=bob).json()
+        event = ws.receive_json()
+        assert event["type"] == "comment.created"
+        assert event["comment"]["id"] == comment["id"] and event["comment"]["user_id"] == bob_id
+
+        client.post(f"/comments/{comment['id']}/reply", json={"text": "second"}, headers=alice)
+        assert ws.receive_json()["comment"]["parent_id"] == comment["id"]
+
+        client.post(f"/discussions/{discussion_id}/like", headers=bob)
+        # Liking twice changes nothing, so it publishes nothing
+        client.post(f"/discussions/{discussion_id}/like", headers=bob)
+        client.post(f"/comments/{comment['id']}/like", headers=alice)
+        assert ws.receive_json() == {"type": "discussion.liked", "discussion_id": discussion_id, "user_id": bob_id}
+        assert ws.receive_json()["type"] == "comment.liked"
+
+
+def test_batch_writes_are_published(client, signup):
+    _, alice = signup("alice")
+    bob_id, bob = signup("bob")
+    discussion_id = client.post("/discussions/", json={"text": "live", "hashtags": []}, headers=alice).json()["id"]
+    other_id = client.post("/discussions/", json={"text": "elsewhere", "hashtags": []}, headers=alice).json()["id"]
+    comment_id = client.post(f"/discussions/{discussion_id}/comments/", json={"text": "first"}, headers=alice).json()["id"]
+
+    with client.websocket_connect(f"/discussions/{discussion_id}/events/ws") as ws:
+        client.post("/batch/comments", json={"comments": [
+            {"discussion_id": discussion_id, "text": "one"},
+            {"discussion_id": other_id, "text": "not here"},
+            {"discussion_id": discussion_id, "text": "two", "parent_id": comment_id},
+        ]}, headers=bob)
+        one, two = ws.receive_json(), ws.receive_json()
+        assert [one["comment"]["text"], two["comment"]["text"]] == ["one", "two"]
+        assert two["comment"]["parent_id"] == comment_id and two["comment"]["user_id"] == bob_id
+
+        client.post("/batch/likes", json={"operations": [
+            {"target": "discussion", "id": discussion_id},
+            {"target": "discussion", "id": other_id},
+            {"target": "comment", "id": comment_id},
+        ]}, headers=bob)
+        assert ws.receive_json() == {"type": "discussion.liked", "discussion_id": discussion_id, "user_id": bob_id}
+        assert ws.receive_json() == {
+            "type": "comment.liked", "discussion_id": discussion_id, "comment_id": comment_id, "user_id": bob_id,
+        }
+        # Unlikes publish nothing, and neither do likes that were already there
+        client.post("/batch/likes", json={"operations": [
+            {"target": "comment", "id": comment_id, "action": "unlike"},
+            {"target": "discussion", "id": discussion_id},
+        ]}, headers=bob)
+        client.post(f"/discussions/{discussion_id}/comments/", json={"text": "last"}, headers=alice)
+        assert ws.receive_json()["comment"]["text"] == "last"
+
+
+def test_feed_websocket_follows_the_accounts_the_user_follows(client, signup):
+    alice_id, alice = signup("alice")
+    bob_id, bob = signup("bob")
+    _, carol = signup("carol")
+    client.post(f"/users/{bob_id}/follow/{alice_id}", headers=bob)
+    token = bob["Authorization"].split()[1]
+    discussion_id = client.post("/discussions/", json={"text": "by carol", "hashtags": []}, headers=carol).json()["id"]
+
+    with client.websocket_connect(f"/feed/events/ws?token={token}") as ws:
+        # carol is not followed, alice is
+        client.post(f"/discussions/{discussion_id}/comments/", json={"text": "from carol"}, headers=carol)
+        client.post(f"/discussions/{discussion_id}/comments/", json={"text": "from alice"}, headers=alice)
+        assert ws.receive_json()["comment"]["text"] == "from alice"
+        created = client.post("/discussions/", json={"text": "by alice", "hashtags": []}, headers=alice).json()
+        event = ws.receive_json()
+        assert (event["type"], event["discussion_id"]) == ("discussion.created", created["id"])
+
+
+def test_streams_reject_unknown_discussions_and_bad_tokens(client):
+    for path in ("/discussions/999/events/ws", "/feed/events/ws?token=bogus", "/feed/events/ws"):
+        with pytest.raises(WebSocketDisconnect) as info:
+            with client.websocket_connect(path):
+                pass
+        assert info.value.code == 1008
+    assert client.get("/discussions/999/events").status_code == 404
+    assert client.get("/feed/events").status_code == 401
+
+
+def test_server_sent_events(client, signup, hub):
+    _, alice = signup("alice")
+    discussion_id = client.post("/discussions/", json={"text": "sse", "hashtags": []}, headers=alice).json()["id"]
+    responses = []
+    reader = threading.Thread(target=lambda: responses.append(client.get(f"/discussions/{discussion_id}/events")))
+    reader.start()
+    wait_for(lambda: len(hub) == 1)
+    client.post(f"/discussions/{discussion_id}/like", headers=alice)
+    time.sleep(0.05)
+    hub.close_all()
+    reader.join(5)
+
+    response = responses[0]
+    assert response.headers["content-type"].startswith("text/event-stream")
+    frames = [frame for frame in response.text.split("\n\n") if frame.startswith("data: ")]
+    assert [orjson.loads(frame[6:])["type"] for frame in frames] == ["discussion.liked"]
+    assert len(hub) == 0
+
+
+def test_slow_consumers_are_dropped(hub):
+    hub.max_queue = 2
+
+    async def scenario():
+        slow = hub.subscribe(["discussion:1"])
+        fast = hub.subscribe(["discussion:1", "user:1"])
+        for n in range(3):
+            hub.deliver(["discussion:1"], b"%d" % n)
+            assert await fast.get(0) == b"%d" % n
+        with pytest.raises(SlowConsumer):
+            await slow.get(0)
+        # Keepalive timeout, and no duplicate when two of its channels get the same event
+        assert await fast.get(0.01) is None
+        hub.deliver(["discussion:1", "user:1"], b"x")
+        assert await fast.get(0) == b"x" and await fast.get(0.01) is None
+        return len(hub)
+
+    assert asyncio.run(scenario()) == 1
+    assert hub.dropped == 1
+
+
+def test_events_published_from_other_threads_reach_the_loop(hub):
+    async def scenario():
+        subscription = hub.subscribe([events.discussion_channel(7)])
+        thread = threading.Thread(target=events.publish_discussion_like, args=(7, 3))
+        thread.start()
+        message = await subscription.get(5)
+        thread.join()
+        hub.unsubscribe(subscription)
+        return orjson.loads(message)
+
+    assert asyncio.run(scenario()) == {"type": "discussion.liked", "discussion_id": 7, "user_id": 3}
+    assert len(hub) == 0
@@ -0,0 +1,67 @@
+from app import timeline
+
+
+def post(client, headers, text):
+    response = client.post("/discussions/", json={"text": text}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_feed_contains_followed_authors_newest_first(client, signup):
+    reader_id, reader = signup("reader")
+    author_id, author = signup("author")
+    _, stranger = signup("stranger")
+    client.post(f"/users/{reader_id}/follow/{author_id}", headers=reader)
+
+    first = post(client, author, "first")
+    post(client, stranger, "not followed")
+    second = post(client, author, "second")
+
+    page = client.get("/feed", headers=reader).json()
+    assert [d["id"] for d in page["items"]] == [second, first]
+    assert page["next_cursor"] is None
+
+
+def test_feed_is_fanned_out_into_materialized_timeline(client, signup):
+    reader_id, reader = signup("reader")
+    author_id, author = signup("author")
+    client.post(f"/users/{reader_id}/follow/{author_id}", headers=reader)
+    client.get("/feed", headers=reader)
+    assert timeline.timeline_store.has_timeline(reader_id)
+
+    discussion_id = post(client, author, "fresh")
+    assert timeline.timeline_store.range(reader_id)[0][1] == discussion_id
+
+
+def test_celebrity_posts_are_merged_on_read(client, signup, monkeypatch, count_queries):
+    monkeypatch.setattr(timeline, "FANOUT_FOLLOWER_LIMIT", 0)
+    reader_id, reader = signup("reader")
+    author_id, author = signup("author")
+    client.post(f"/users/{reader_id}/follow/{author_id}", headers=reader)
+    client.get("/feed", headers=reader)
+
+    discussion_id = post(client, author, "celebrity post")
+    assert timeline.timeline_store.range(reader_id) == []
+    with count_queries() as statements:
+        assert [d["id"] for d in client.get("/feed", headers=reader).json()["items"]] == [discussion_id]
+    # Celebrities come from users.follower_count, not from counting followers on every read
+    assert not [s for s in statements if "GROUP BY" in s.upper()]
+
+
+def test_feed_cursor_pages_and_timeline_is_bounded(client, signup, monkeypatch):
+    monkeypatch.setattr(timeline, "timeline_store", timeline.InMemoryTimelineBackend(max_length=3))
+    reader_id, reader = signup("reader")
+    author_id, author = signup("author")
+    client.post(f"/users/{reader_id}/follow/{author_id}", headers=reader)
+    ids = [post(client, author, f"post {i}") for i in range(5)]
+
+    pages, cursor = [], None
+    while True:
+        page = client.get("/feed", params={"limit": 2, "cursor": cursor}, headers=reader).json()
+        pages.append([d["id"] for d in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert len(timeline.timeline_store.range(reader_id, limit=10)) == 3
+    # Past the three materialized entries the feed carries on from the database
+    assert pages == [ids[:-3:-1], ids[2:0:-1], [ids[0]]]
@@ -0,0 +1,121 @@
+from app import follow_graph, models
+from app.follow_graph import FollowGraph
+
+
+def build(edges):
+    graph = FollowGraph()
+    for follower_id, followed_id in edges:
+        graph.add(follower_id, followed_id)
+    return graph
+
+
+def test_membership_counts_and_paging():
+    graph = build([(1, 5), (1, 3), (1, 9), (1, 3), (2, 3), (4, 3)])
+    assert graph.is_following(1, 3) and not graph.is_following(3, 1)
+    assert graph.following_count(1) == 3 and graph.follower_count(3) == 3
+    assert graph.following(1, limit=2) == ([3, 5], 5)
+    assert graph.following(1, after_id=5, limit=2) == ([9], None)
+    assert graph.followers(3) == ([1, 2, 4], None)
+    assert len(graph) == 5
+
+    graph.remove(1, 3)
+    graph.remove(1, 3)
+    assert not graph.is_following(1, 3)
+    assert graph.followers(3) == ([2, 4], None)
+    assert graph.following(7) == ([], None)
+
+
+def test_mutuals_and_suggestions():
+    # 1 follows 2 and 3; both of them follow 4, only 3 follows 5; 2 follows 1 back
+    graph = build([(1, 2), (1, 3), (2, 1), (2, 4), (3, 4), (3, 5), (3, 1), (6, 5), (7, 5)])
+    assert graph.mutuals(1) == ([2, 3], None)
+    assert graph.mutual_count(1) == 2
+    assert graph.suggestions(1) == [(4, 2), (5, 1)]
+    assert graph.suggestions(1, limit=1) == [(4, 2)]
+    graph.add(1, 4)
+    assert graph.suggestions(1) == [(5, 1)]
+
+
+def test_rebuild_matches_followers_table(client, signup, db):
+    ids = [signup(name) for name in ("alice", "bob", "carol")]
+    (alice, alice_headers), (bob, bob_headers), (carol, _) = ids
+    client.post(f"/users/{alice}/follow/{bob}", headers=alice_headers)
+    client.post(f"/users/{alice}/follow/{carol}", headers=alice_headers)
+    client.post(f"/users/{bob}/follow/{alice}", headers=bob_headers)
+
+    graph = FollowGraph()
+    assert graph.rebuild(db, batch_size=1) == 3
+    assert graph.following(alice) == follow_graph.follow_graph.following(alice) == ([bob, carol], None)
+    assert graph.followers(alice) == ([bob], None)
+
+
+def test_follow_endpoints_keep_graph_in_step(client, signup, count_queries):
+    (alice, alice_headers), (bob, bob_headers), (carol, carol_headers) = [signup(n) for n in ("alice", "bob", "carol")]
+    client.post(f"/users/{alice}/follow/{bob}", headers=alice_headers)
+    client.post("/batch/follows", json={"operations": [{"user_id": carol}, {"user_id": alice}]}, headers=bob_headers)
+    client.post(f"/users/{carol}/follow/{alice}", headers=carol_headers)
+
+    with count_queries() as statements:
+        status = client.get(f"/users/{alice}/following/{bob}").json()
+    assert statements == []
+    assert status == {"following": True, "followed_by": True}
+
+    client.post(f"/users/{alice}/unfollow/{bob}", headers=alice_headers)
+    assert client.get(f"/users/{alice}/following/{bob}").json() == {"following": False, "followed_by": True}
+    client.post("/batch/follows", json={"operations": [{"user_id": carol, "action": "unfollow"}]}, headers=bob_headers)
+    assert not follow_graph.follow_graph.is_following(bob, carol)
+
+
+def test_followers_following_and_mutuals_pages(client, signup):
+    users = [signup(f"user{i}") for i in range(5)]
+    target, target_headers = users[0]
+    for user_id, headers in users[1:]:
+        client.post(f"/users/{user_id}/follow/{target}", headers=headers)
+    client.post(f"/users/{target}/follow/{users[1][0]}", headers=target_headers)
+
+    first = client.get(f"/users/{target}/followers", params={"limit": 3}).json()
+    assert [u["id"] for u in first["items"]] == [u for u, _ in users[1:4]]
+    assert first["total"] == 4
+    assert set(first["items"][0]) == {"id", "name", "follower_count", "following_count"}
+    second = client.get(f"/users/{target}/followers", params={"limit": 3, "cursor": first["next_cursor"]}).json()
+    assert [u["id"] for u in second["items"]] == [users[4][0]]
+    assert second["next_cursor"] is None
+
+    following = client.get(f"/users/{target}/following").json()
+    assert [u["id"] for u in following["items"]] == [users[1][0]] and following["total"] == 1
+    mutuals = client.get(f"/users/{target}/mutuals").json()
+    assert [u["id"] for u in mutuals["items"]] == [users[1][0]]
+
+    assert client.get("/users/999999/followers").status_code == 404
+    assert client.get(f"/users/{target}/followers", params={"cursor": "bogus"}).status_code == 400
+
+
+def test_suggestions_endpoint(client, signup):
+    (alice, alice_headers), (bob, bob_headers), (carol, carol_headers), (dave, _) = [signup(n) for n in ("alice", "bob", "carol", "dave")]
+    client.post(f"/users/{alice}/follow/{bob}", headers=alice_headers)
+    client.post(f"/users/{alice}/follow/{carol}", headers=alice_headers)
+    client.post(f"/users/{bob}/follow/{dave}", headers=bob_headers)
+    client.post(f"/users/{carol}/follow/{dave}", headers=carol_headers)
+    client.post(f"/users/{carol}/follow/{bob}", headers=carol_headers)
+
+    suggestions = client.get(f"/users/{alice}/suggestions").json()
+    assert [(s["id"], s["followed_by_friends"]) for s in suggestions] == [(dave, 2)]
+    assert suggestions[0]["name"] == "dave"
+    assert client.get("/users/999999/suggestions").status_code == 404
+
+
+def test_user_follow_methods_use_the_database(db):
+    alice = models.User(name="alice", email="alice@example.com", mobile_no="1", hashed_password="x")
+    bob = models.User(name="bob", email="bob@example.com", mobile_no="2", hashed_password="x")
+    db.add_all([alice, bob])
+    db.commit()
+    db.execute(models.followers.insert().values(follower_id=alice.id, followed_id=bob.id))
+    db.commit()
+    # As in a script or a fresh worker, the graph knows nothing about the edge
+    follow_graph.follow_graph.clear()
+    assert alice.is_following(bob) and not bob.is_following(alice)
+    alice.follow(bob)
+    db.commit()
+    alice.unfollow(bob)
+    db.commit()
+    assert not alice.is_following(bob)
@@ -0,0 +1,36 @@
+from app import models
+
+
+def tags(response):
+    return sorted(tag["name"] for tag in response.json()["hashtags"])
+
+
+def test_hashtags_are_normalized_and_deduplicated(client, signup, db):
+    _, headers = signup("author")
+    response = client.post("/discussions/", json={"text": "a", "hashtags": ["#Python", "python", " FastAPI ", "#", ""]}, headers=headers)
+    assert tags(response) == ["fastapi", "python"]
+    client.post("/discussions/", json={"text": "b", "hashtags": ["PYTHON"]}, headers=headers)
+    assert db.query(models.Hashtag).count() == 2
+    assert len(client.get("/discussions/hashtag/%23Python").json()) == 2
+
+
+def test_update_only_touches_changed_tags(client, signup, db, count_queries):
+    _, headers = signup("author")
+    discussion_id = client.post("/discussions/", json={"text": "a", "hashtags": ["keep", "drop"]}, headers=headers).json()["id"]
+    with count_queries() as statements:
+        response = client.put(f"/discussions/{discussion_id}", json={"text": "a", "hashtags": ["keep", "add"]}, headers=headers)
+    assert tags(response) == ["add", "keep"]
+    link_writes = [s for s in statements if "discussion_hashtag" in s and s.lstrip().upper().startswith(("INSERT", "DELETE"))]
+    assert len(link_writes) == 2
+
+
+def test_create_cost_does_not_grow_with_tag_count(client, signup, count_queries):
+    _, headers = signup("author")
+    client.post("/discussions/", json={"text": "warm up"}, headers=headers)
+
+    def writes(hashtags):
+        with count_queries() as statements:
+            client.post("/discussions/", json={"text": "x", "hashtags": hashtags}, headers=headers)
+        return len(statements)
+
+    assert writes(["a1", "a2"]) == writes([f"b{i}" for i in range(20)])
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import jobs, models, search, timeline
+from app.database import SessionLocal
+
+
+class Clock:
+    def __init__(self):
+        # Just ahead of the run_at stamped on jobs enqueued during the test
+        self.now = datetime.utcnow() + timedelta(seconds=5)
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    # A queue that only runs when drained, standing in for the background workers
+    queue = jobs.JobQueue(inline=False, clock=Clock(), retry_seconds=10, max_attempts=3)
+    monkeypatch.setattr(jobs, "job_queue", queue)
+    return queue
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setitem(jobs._handlers, "test.record", lambda db, payloads: calls.append(payloads))
+    return calls
+
+
+def enqueue(*payloads, kind="test.record"):
+    db = SessionLocal()
+    try:
+        for payload in payloads:
+            jobs.enqueue(db, kind, payload)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_side_effects_wait_for_the_queue(client, signup, queue, db):
+    alice, alice_headers = signup("alice")
+    bob, bob_headers = signup("bob")
+    client.post(f"/users/{bob}/follow/{alice}", headers=bob_headers)
+    client.get("/feed", headers=bob_headers)
+    discussion = client.post("/discussions/", json={"text": "queued #python", "hashtags": ["python"]}, headers=alice_headers).json()
+
+    # The write and its job committed together; nothing ran yet
+    assert [job.kind for job in db.query(models.OutboxJob).all()] == ["user.created", "user.created", "discussion.created"]
+    assert search.search_index.search_discussions(db, "queued") == []
+
+    assert queue.drain() == 3
+    assert search.search_index.search_discussions(db, "queued") == [discussion["id"]]
+    assert [key[1] for key in timeline.timeline_store.range(bob, limit=10)] == [discussion["id"]]
+    assert queue.pending(db) == 0
+
+    # A second delivery of the same job changes nothing
+    enqueue({"id": discussion["id"]}, kind="discussion.created")
+    queue.drain()
+    assert [key[1] for key in timeline.timeline_store.range(bob, limit=10)] == [discussion["id"]]
+
+    client.delete(f"/discussions/{discussion['id']}", headers=alice_headers)
+    assert search.search_index.search_discussions(db, "queued") == [discussion["id"]]
+    queue.drain()
+    assert search.search_index.search_discussions(db, "queued") == []
+
+
+def test_jobs_of_a_kind_run_as_one_batch(queue, calls):
+    queue.batch_size = 3
+    enqueue({"n": 1}, {"n": 2}, {"n": 3}, {"n": 4})
+    assert queue.drain() == 4
+    assert calls == [[{"n": 1}, {"n": 2}, {"n": 3}], [{"n": 4}]]
+
+
+def test_failed_batch_is_retried_job_by_job_with_backoff(queue, monkeypatch, db):
+    seen = []
+
+    def flaky(db, payloads):
+        seen.append([payload["n"] for payload in payloads])
+        if any(payload["n"] == 2 for payload in payloads):
+            raise RuntimeError("boom")
+
+    monkeypatch.setitem(jobs._handlers, "test.record", flaky)
+    enqueue({"n": 1}, {"n": 2})
+    queue.drain()
+    assert seen == [[1, 2], [1], [2]]
+
+    job = db.query(models.OutboxJob).one()
+    assert (job.status, job.attempts, job.run_at) == ("pending", 1, queue.clock.now + timedelta(seconds=10))
+    assert "boom" in job.last_error
+
+    # Not due yet, then due after 10 s and again after a further 20 s
+    assert queue.drain() == 0
+    queue.clock.now += timedelta(seconds=10)
+    assert queue.drain() == 1
+    queue.clock.now += timedelta(seconds=19)
+    assert queue.drain() == 0
+    queue.clock.now += timedelta(seconds=1)
+    assert queue.drain() == 1
+
+    db.expire_all()
+    job = db.query(models.OutboxJob).one()
+    assert (job.status, job.attempts) == ("failed", 3)
+    assert queue.pending(db) == 0
+
+
+def test_jobs_of_a_dead_worker_are_claimed_again(queue, calls, db):
+    enqueue({"n": 1})
+    assert len(queue._claim(db)) == 1
+    assert queue.drain() == 0
+
+    queue.clock.now += timedelta(seconds=queue.lock_seconds)
+    assert queue.drain() == 1
+    assert calls == [[{"n": 1}]]
+    assert db.query(models.OutboxJob).count() == 0
+
+
+def test_workers_process_jobs_in_the_background(calls):
+    queue = jobs.JobQueue(inline=False, workers=2, poll_interval=5)
+    queue.start()
+    try:
+        enqueue({"n": 1})
+        queue.notify()
+        for _ in range(200):
+            if calls:
+                break
+            queue._stopping.wait(0.01)
+    finally:
+        queue.stop()
+    assert calls == [[{"n": 1}]]
@@ -0,0 +1,86 @@
+import logging
+
+from app import metrics
+from app.database import engine
+
+
+def test_request_metrics_count_queries_per_route_template(client, signup, count_queries):
+    _, headers = signup("alice")
+    discussion_id = client.post("/discussions/", json={"text": "hello", "hashtags": ["python"]}, headers=headers).json()["id"]
+    before = metrics.http_request_queries.count("GET", "/discussions/{discussion_id}")
+    queries_before = metrics.http_request_queries.sum("GET", "/discussions/{discussion_id}")
+
+    with count_queries() as statements:
+        assert client.get(f"/discussions/{discussion_id}").status_code == 200
+    assert client.get("/discussions/999999").status_code == 404
+
+    assert metrics.http_request_queries.count("GET", "/discussions/{discussion_id}") == before + 2
+    assert metrics.http_request_queries.sum("GET", "/discussions/{discussion_id}") - queries_before >= len(statements) > 0
+    assert metrics.http_requests.value("GET", "/discussions/{discussion_id}", "404") >= 1
+
+
+def test_metrics_endpoint_renders_text_exposition(client):
+    client.get("/discussions/")
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/discussions/",le="+Inf"}' in body
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in body
+    assert "/no/such/path" not in body
+    assert 'db_pool_checkout_wait_seconds_count{engine="primary"}' in body
+    assert 'db_pool_checked_out{engine="primary"}' in body
+
+
+def test_checkouts_are_timed_after_the_pool_is_recreated():
+    before = metrics.db_pool_checkout_wait.count("primary")
+    engine.dispose()
+    assert isinstance(engine.pool, metrics.TimedQueuePool)
+    with engine.connect():
+        pass
+    assert metrics.db_pool_checkout_wait.count("primary") == before + 1
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "test", ["route"], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value, "/x")
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{route="/x",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/x",le="1"} 3' in lines
+    assert 'test_seconds_bucket{route="/x",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{route="/x"} 4' in lines
+
+
+def test_fingerprint_ignores_literals_and_list_lengths():
+    first = "SELECT * FROM users WHERE id IN (?, ?, ?) AND name = 'bob' LIMIT 10"
+    second = "SELECT *  FROM users\nWHERE id IN (%s) AND name = 'alice' LIMIT 20"
+    assert metrics.normalize_statement(first) == "SELECT * FROM users WHERE id IN (...) AND name = ? LIMIT ?"
+    assert metrics.fingerprint(first) == metrics.fingerprint(second)
+    assert metrics.fingerprint("INSERT INTO likes VALUES (?, ?), (?, ?)") == metrics.fingerprint("INSERT INTO likes VALUES (?, ?)")
+    assert metrics.fingerprint(first) != metrics.fingerprint("SELECT * FROM discussions WHERE id IN (?)")
+
+
+def test_slow_queries_are_logged_with_fingerprint(client, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0.000001)
+    slow_before = metrics.db_slow_queries.value("primary")
+
+    with caplog.at_level(logging.WARNING, logger="app.metrics"):
+        client.get("/users/")
+
+    assert metrics.db_slow_queries.value("primary") > slow_before
+    messages = [record.getMessage() for record in caplog.records if record.name == "app.metrics"]
+    assert any("/users/" in message and "FROM users" in message for message in messages)
+
+
+def test_timing_header_is_opt_in(client, monkeypatch):
+    assert "server-timing" not in client.get("/discussions/").headers
+
+    monkeypatch.setattr(metrics, "METRICS_TIMING_HEADER", True)
+    timing = client.get("/discussions/").headers["server-timing"]
+    assert timing.startswith("total;dur=")
+    assert 'db;dur=' in timing and 'queries"' in timing and "pool;dur=" in timing
@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from app import migrate, models
+
+
+def legacy_engine():
+    # The schema before counters, comment paths, unique like keys and the outbox
+    legacy = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'legacy.db')}")
+    statements = [
+        "CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(255), email VARCHAR(255), mobile_no VARCHAR(15), hashed_password VARCHAR(255))",
+        "CREATE TABLE followers (follower_id INTEGER, followed_id INTEGER)",
+        "CREATE TABLE discussions (id INTEGER PRIMARY KEY, text VARCHAR(1000), image VARCHAR(255), created_on DATETIME, user_id INTEGER, view_count INTEGER)",
+        "CREATE TABLE hashtags (id INTEGER PRIMARY KEY, name VARCHAR(50))",
+        "CREATE TABLE discussion_hashtag (discussion_id INTEGER, hashtag_id INTEGER)",
+        "CREATE TABLE comments (id INTEGER PRIMARY KEY, text VARCHAR(500), created_on DATETIME, user_id INTEGER, discussion_id INTEGER, parent_id INTEGER)",
+        "CREATE TABLE likes (id INTEGER PRIMARY KEY, user_id INTEGER, discussion_id INTEGER)",
+        "CREATE TABLE comment_likes (id INTEGER PRIMARY KEY, user_id INTEGER, comment_id INTEGER)",
+        "INSERT INTO users (id, name, email, mobile_no) VALUES (1, 'a', 'a@example.com', '1'), (2, 'b', 'b@example.com', '2')",
+        "INSERT INTO followers VALUES (1, 2)",
+        "INSERT INTO discussions (id, text, user_id, view_count) VALUES (1, 'd', 2, 0)",
+        "INSERT INTO comments (id, text, user_id, discussion_id, parent_id) VALUES (1, 'c', 1, 1, NULL), (2, 'r', 2, 1, 1)",
+        "INSERT INTO likes (id, user_id, discussion_id) VALUES (1, 1, 1)",
+    ]
+    with legacy.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+    return legacy
+
+
+def test_migrate_brings_a_legacy_database_up_to_the_models():
+    legacy = legacy_engine()
+    with Session(bind=legacy) as db:
+        changes = migrate.migrate(db, batch_size=1)
+        assert changes["tables"] == ["outbox_jobs"]
+        assert {"users.follower_count", "discussions.like_count", "comments.path", "comments.depth"} <= set(changes["columns"])
+        assert {"uq_likes_user_id_discussion_id", "ix_comments_discussion_id_path"} <= set(changes["indexes"])
+        assert changes["comment paths"] == 2
+
+        assert db.execute(text("SELECT like_count, comment_count FROM discussions")).one() == (1, 2)
+        assert db.execute(text("SELECT follower_count FROM users WHERE id = 2")).scalar() == 1
+        assert db.execute(text("SELECT depth, thread_root_id FROM comments WHERE id = 2")).one() == (1, 1)
+
+        again = migrate.migrate(db)
+    assert again == {"tables": [], "columns": [], "indexes": [], "comment paths": 0}
+    assert {c.name for c in models.Comment.__table__.columns} <= {c["name"] for c in inspect(legacy).get_columns("comments")}
@@ -0,0 +1,49 @@
+from app import models
+
+
+def seed_discussions(db, count):
+    user = models.User(name="author", email="author@example.com", mobile_no="5550000", hashed_password="x")
+    db.add(user)
+    db.flush()
+    for i in range(count):
+        db.add(models.Discussion(text=f"discussion {i}", user_id=user.id, view_count=0))
+    db.commit()
+
+
+def walk(client, url, limit):
+    ids = []
+    cursor = ""
+    while cursor is not None:
+        response = client.get(url, params={"cursor": cursor, "limit": limit})
+        assert response.status_code == 200
+        page = response.json()
+        ids.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+    return ids
+
+
+def test_cursor_walk_returns_every_discussion_once(client, db):
+    seed_discussions(db, 23)
+    ids = walk(client, "/discussions/", limit=5)
+    assert sorted(ids) == list(range(1, 24))
+    assert len(ids) == len(set(ids))
+
+
+def test_cursor_walk_users(client, db):
+    seed_discussions(db, 1)
+    for i in range(6):
+        db.add(models.User(name=f"user {i}", email=f"user{i}@example.com", mobile_no=f"555100{i}", hashed_password="x"))
+    db.commit()
+    assert walk(client, "/users/", limit=4) == list(range(1, 8))
+
+
+def test_skip_limit_still_returns_plain_list(client, db):
+    seed_discussions(db, 3)
+    response = client.get("/discussions/", params={"skip": 1, "limit": 1})
+    assert isinstance(response.json(), list)
+    assert len(response.json()) == 1
+
+
+def test_invalid_cursor_is_rejected(client, db):
+    response = client.get("/discussions/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
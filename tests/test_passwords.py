@@ -0,0 +1,58 @@
+import time
+
+import pytest
+from passlib.context import CryptContext
+
+from app import models, passwords
+
+
+def test_login_rejected_with_503_when_hasher_is_saturated(client, signup, monkeypatch):
+    signup("alice")
+    monkeypatch.setattr(passwords, "password_hasher", passwords.PasswordHasher(workers=0, queue_size=1))
+    passwords.password_hasher._slots.acquire()
+    response = client.post("/token", data={"username": "alice@example.com", "password": "secret"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_weak_hash_is_upgraded_on_login(client, db, monkeypatch):
+    weak = passwords.pwd_context.hash("secret")
+    stronger = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=5, bcrypt__min_rounds=5)
+    monkeypatch.setattr(passwords, "pwd_context", stronger)
+    monkeypatch.setattr(passwords, "password_hasher", passwords.PasswordHasher(workers=0))
+    user = models.User(name="alice", email="alice@example.com", mobile_no="5550000", hashed_password=weak)
+    db.add(user)
+    db.commit()
+
+    response = client.post("/token", data={"username": "alice@example.com", "password": "secret"})
+    assert response.status_code == 200
+    db.refresh(user)
+    assert user.hashed_password.startswith("$2b$05$")
+    assert not stronger.needs_update(user.hashed_password)
+
+
+def test_pool_hashes_and_verifies():
+    hasher = passwords.PasswordHasher(workers=1, queue_size=2)
+    try:
+        hashed = hasher.hash("secret")
+        assert hasher.verify("secret", hashed)
+        assert not hasher.verify("wrong", hashed)
+    finally:
+        hasher.shutdown()
+
+
+def test_timed_out_work_keeps_its_slot_until_it_finishes():
+    hasher = passwords.PasswordHasher(workers=1, queue_size=1, timeout=0.05)
+    try:
+        with pytest.raises(passwords.PasswordHasherBusy, match="timed out"):
+            hasher._run(time.sleep, 0.5)
+        # The sleep is still running in the pool, so the queue is still full
+        with pytest.raises(passwords.PasswordHasherBusy, match="in progress"):
+            hasher._run(time.sleep, 0)
+        deadline = time.monotonic() + 5
+        while not hasher._slots.acquire(blocking=False):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        hasher._slots.release()
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,70 @@
+from typing import List
+
+import pytest
+
+from app import crud, models, projections, schemas
+from app.response_cache import render
+
+
+CASES = [
+    ("get_users", List[schemas.User], {}),
+    ("get_discussions", List[schemas.Discussion], {}),
+    ("get_discussions_by_hashtag", List[schemas.Discussion], {"hashtag": "#Python"}),
+    ("get_comments", List[schemas.Comment], {"discussion_id": 2}),
+]
+
+PAGE_CASES = [
+    ("get_users_page", schemas.UserPage, {}),
+    ("search_users_page", schemas.UserPage, {"name": "user"}),
+    ("get_discussions_page", schemas.DiscussionPage, {}),
+    ("get_discussions_by_hashtag_page", schemas.DiscussionPage, {"hashtag": "python"}),
+    ("get_comments_page", schemas.CommentPage, {"discussion_id": 2}),
+]
+
+
+def orm_rows(db, rows):
+    # The same rows as fully loaded ORM objects, from the detail reads in app/crud.py
+    rows = list(rows)
+    if rows and isinstance(rows[0], projections.UserRow):
+        return [crud.get_user_detail(db, row.id) for row in rows]
+    if rows and isinstance(rows[0], projections.DiscussionRow):
+        return [crud.get_discussion_detail(db, row.id) for row in rows]
+    comments = {}
+    for row in rows:
+        if row.discussion_id not in comments:
+            comments.update((c.id, c) for c in crud.get_discussion_detail(db, row.discussion_id).comments)
+    return [comments[row.id] for row in rows]
+
+
+@pytest.mark.parametrize("name,response_type,kwargs", CASES)
+def test_projection_lists_render_like_orm(db, name, response_type, kwargs, seed):
+    seed(discussions=4, depth=3)
+    lean = getattr(projections, name)(db, skip=1, limit=2, **kwargs)
+    assert len(lean) == 2
+    assert render(response_type, lean) == render(response_type, orm_rows(db, lean))
+
+
+@pytest.mark.parametrize("name,response_type,kwargs", PAGE_CASES)
+def test_projection_pages_render_like_orm(db, name, response_type, kwargs, seed):
+    seed(discussions=4, depth=3)
+    cursor = ""
+    seen = []
+    while cursor is not None:
+        lean, cursor = getattr(projections, name)(db, cursor=cursor, limit=2, **kwargs)
+        assert render(response_type, {"items": lean, "next_cursor": cursor}) == \
+            render(response_type, {"items": orm_rows(db, lean), "next_cursor": cursor})
+        seen += [row.id for row in lean]
+    assert len(seen) == len(set(seen)) > 2
+
+
+def test_user_listing_does_not_select_password_hashes(db, count_queries, seed):
+    seed(discussions=2)
+    with count_queries() as statements:
+        projections.get_users(db)
+    assert statements
+    assert not any("hashed_password" in statement for statement in statements)
+
+
+def test_invalid_cursor_is_rejected(db):
+    with pytest.raises(ValueError):
+        projections.get_discussions_page(db, cursor="not-a-cursor")
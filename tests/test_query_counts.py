@@ -0,0 +1,34 @@
+import pytest
+
+from app import models, response_cache
+from app.database import engine
+
+
+def queries_for(client, count_queries, url):
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.read_endpoints()
+def test_query_count_is_independent_of_row_count(client, count_queries, seed, url):
+    seed(discussions=2)
+    small = queries_for(client, count_queries, url)
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    # seeding bypasses crud, so nothing invalidated the cached response
+    response_cache.response_store.clear()
+    seed(discussions=20)
+    large = queries_for(client, count_queries, url)
+
+    assert small == large
+    assert large <= 10
+
+
+def test_discussion_listing_serializes_nested_replies(client, seed):
+    seed(discussions=1, depth=3)
+    discussion = client.get("/discussions/").json()[0]
+    root = next(c for c in discussion["comments"] if c["parent_id"] is None)
+    assert root["replies"][0]["replies"][0]["text"] == "comment 2"
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+
+from app import models, ranking
+from app.ranking import DiscussionRanking, RankedSet
+from app.views import view_aggregator
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ranked_set_updates_and_removes():
+    ranked = RankedSet()
+    for item_id, score in [(1, 5), (2, 3), (3, 9), (1, 1), (2, 7)]:
+        ranked.set(item_id, score)
+    assert ranked.top(10) == [(3, 9), (2, 7), (1, 1)]
+    ranked.remove(3)
+    assert ranked.top(1) == [(2, 7)]
+    assert ranked.top(5, skip=1) == [(1, 1)]
+    ranked.set(1, 7)
+    # ties go to the newer (higher) id
+    assert ranked.top(2) == [(2, 7), (1, 7)]
+
+
+def test_ranked_set_compacts_stale_entries():
+    ranked = RankedSet()
+    for score in range(1000):
+        ranked.set(1, score)
+    assert len(ranked._heap) < 200
+    assert ranked.top(5) == [(1, 999)]
+
+
+def test_hot_trades_engagement_against_age():
+    clock = Clock()
+    board = DiscussionRanking(clock=clock, like_weight=1, comment_weight=0, view_weight=0, decay_seconds=3600)
+    board.add(1, created=clock.now - 3600)
+    board.add(2, created=clock.now)
+    assert board.hot() == [2, 1]
+    board.record(1, likes=9)
+    assert board.hot() == [2, 1]
+    board.record(1, likes=11)
+    assert board.hot() == [1, 2]
+
+
+def test_top_windows_expire():
+    clock = Clock()
+    board = DiscussionRanking(windows={"1h": 3600, "1d": 86400}, clock=clock)
+    board.add(1, created=clock.now - 7200, likes=5)
+    board.add(2, created=clock.now, likes=1)
+    assert board.top("1h") == [2]
+    assert board.top("1d") == [1, 2]
+    clock.now += 86000
+    assert board.top("1d") == [2]
+    assert board.hot() == [2]
+    clock.now += 3600
+    assert board.hot() == []
+
+
+def test_rebuild_reads_counters_from_database(db):
+    user = models.User(name="u", email="u@example.com", mobile_no="1", hashed_password="x")
+    db.add(user)
+    db.flush()
+    now = datetime.utcnow()
+    db.add_all([
+        models.Discussion(text="old", user_id=user.id, view_count=0, like_count=50, created_on=now - timedelta(days=40)),
+        models.Discussion(text="quiet", user_id=user.id, view_count=0, created_on=now - timedelta(hours=1)),
+        models.Discussion(text="busy", user_id=user.id, view_count=100, like_count=3, comment_count=2, created_on=now - timedelta(hours=2)),
+    ])
+    db.commit()
+    board = DiscussionRanking()
+    assert board.rebuild(db) == 2
+    assert board.top("30d") == [3, 2]
+
+
+def test_rebuild_keeps_changes_made_while_it_reads(db, monkeypatch):
+    user = models.User(name="u", email="u@example.com", mobile_no="1", hashed_password="x")
+    db.add(user)
+    db.flush()
+    now = datetime.utcnow()
+    db.add_all([
+        models.Discussion(text="a", user_id=user.id, view_count=0, like_count=1, created_on=now - timedelta(hours=2)),
+        models.Discussion(text="b", user_id=user.id, view_count=0, like_count=2, created_on=now - timedelta(hours=1)),
+    ])
+    db.commit()
+    board = DiscussionRanking()
+    board.rebuild(db)
+
+    def created_during_a_like(created_on):
+        # A like committed and recorded while the rebuild is still reading rows
+        monkeypatch.setattr(ranking, "created_timestamp", original)
+        board.record(1, likes=5)
+        return original(created_on)
+
+    original = ranking.created_timestamp
+    monkeypatch.setattr(ranking, "created_timestamp", created_during_a_like)
+    board.rebuild(db)
+    assert board.top("24h") == [1, 2]
+
+
+def create(client, headers, text):
+    return client.post("/discussions/", json={"text": text, "hashtags": []}, headers=headers).json()["id"]
+
+
+def test_endpoints_follow_likes_comments_and_views(client, signup):
+    _, alice = signup("alice")
+    _, bob = signup("bob")
+    first = create(client, alice, "first")
+    second = create(client, alice, "second")
+    assert [d["id"] for d in client.get("/discussions/hot").json()] == [second, first]
+
+    client.post(f"/discussions/{first}/like", headers=alice)
+    client.post(f"/discussions/{first}/like", headers=bob)
+    client.post(f"/discussions/{first}/comments/", json={"text": "hi"}, headers=bob)
+    assert [d["id"] for d in client.get("/discussions/hot").json()] == [first, second]
+    assert [d["id"] for d in client.get("/discussions/top?window=7d&limit=1").json()] == [first]
+
+    for _ in range(200):
+        client.post(f"/discussions/{second}/view")
+    view_aggregator.flush()
+    assert [d["id"] for d in client.get("/discussions/top").json()] == [second, first]
+    assert client.get("/discussions/top?window=1y").status_code == 400
+
+    client.delete(f"/discussions/{second}", headers=alice)
+    assert [d["id"] for d in client.get("/discussions/hot").json()] == [first]
+
+
+def test_hot_does_not_scan_discussions(client, signup, count_queries):
+    _, headers = signup("alice")
+    for i in range(5):
+        create(client, headers, f"d{i}")
+    with count_queries() as statements:
+        assert len(client.get("/discussions/hot?limit=2").json()) == 2
+    discussion_selects = [s for s in statements if "FROM discussions" in s]
+    assert discussion_selects and all("discussions.id IN" in s for s in discussion_selects)
+    assert ranking.discussion_ranking.hot(limit=10)
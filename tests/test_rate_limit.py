@@ -0,0 +1,126 @@
+import pytest
+
+from app import metrics, rate_limit
+from app.rate_limit import InMemoryTokenBuckets, RateLimiter
+from app.views import view_aggregator
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "bucket_store", InMemoryTokenBuckets(shards=4, clock=clock))
+    return clock
+
+
+def limit(monkeypatch, limits, default=""):
+    monkeypatch.setattr(rate_limit, "rate_limiter", RateLimiter(limits, default))
+
+
+def test_bucket_refills_at_the_configured_rate():
+    clock = Clock()
+    buckets = InMemoryTokenBuckets(shards=2, clock=clock)
+    assert [buckets.acquire("a", 3, 1.0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.acquire("a", 3, 1.0) == pytest.approx(1.0)
+    assert buckets.acquire("b", 3, 1.0) == 0
+
+    clock.now += 0.5
+    assert buckets.acquire("a", 3, 1.0) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert buckets.acquire("a", 3, 1.0) == 0
+    # Never more than the burst, however long the client was idle
+    clock.now += 100
+    assert [buckets.acquire("a", 3, 1.0) for _ in range(4)][-1] > 0
+
+
+def test_full_buckets_are_evicted_first():
+    clock = Clock()
+    buckets = InMemoryTokenBuckets(shards=1, max_keys=2, clock=clock)
+    keys = buckets._shards[0][1]
+    buckets.acquire("a", 10, 1.0)
+    clock.now += 20
+    buckets.acquire("b", 10, 1.0)
+    buckets.acquire("c", 10, 1.0)
+    # "a" had refilled and held no state; "b" still owes a token
+    assert list(keys) == ["b", "c"]
+    buckets.acquire("d", 10, 1.0)
+    assert list(keys) == ["c", "d"]
+
+
+def test_parse_limits():
+    assert rate_limit.parse_limits("post /token=10/60, GET /x=1/0.5") == {
+        ("POST", "/token"): rate_limit.Limit(10, 60.0),
+        ("GET", "/x"): rate_limit.Limit(1, 0.5),
+    }
+    for value in ("POST /token=10", "POST /token=0/60", "/token=1/1", "POST /token=a/b"):
+        with pytest.raises(ValueError):
+            rate_limit.parse_limits(value)
+
+
+def test_route_limit_returns_429_with_retry_after(client, clock, monkeypatch):
+    limit(monkeypatch, "POST /token=2/60")
+    form = {"username": "nobody@example.com", "password": "wrong"}
+    assert [client.post("/token", data=form).status_code for _ in range(3)] == [401, 401, 429]
+    response = client.post("/token", data=form)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    assert response.json() == {"detail": "Too many requests"}
+    # Other routes are not limited
+    assert client.get("/discussions/").status_code == 200
+
+    clock.now += 30
+    assert client.post("/token", data=form).status_code == 401
+
+
+def test_limits_are_per_user_and_per_route(client, signup, clock, monkeypatch):
+    _, alice = signup("alice")
+    _, bob = signup("bob")
+    discussion = client.post("/discussions/", json={"text": "hi", "hashtags": []}, headers=alice).json()
+    limit(monkeypatch, "POST /discussions/=1/60,POST /discussions/{discussion_id}/view=2/60")
+
+    assert client.post("/discussions/", json={"text": "a", "hashtags": []}, headers=alice).status_code == 200
+    assert client.post("/discussions/", json={"text": "b", "hashtags": []}, headers=alice).status_code == 429
+    assert client.post("/discussions/", json={"text": "c", "hashtags": []}, headers=bob).status_code == 200
+
+    view = f"/discussions/{discussion['id']}/view"
+    assert [client.post(view, headers=alice).status_code for _ in range(3)] == [202, 202, 429]
+    # Anonymous clients share their address's bucket, which is separate from alice's
+    assert client.post(view).status_code == 202
+    view_aggregator.flush()
+
+
+def test_default_limit_and_forwarded_addresses(client, clock, monkeypatch):
+    limit(monkeypatch, "", default="2/60")
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_FORWARDED_FOR", True)
+    first = {"X-Forwarded-For": "10.0.0.9, 10.0.0.1"}
+    assert [client.get("/discussions/", headers=first).status_code for _ in range(3)] == [200, 200, 429]
+    assert client.get("/hashtags/trending", headers=first).status_code == 429
+    assert client.get("/discussions/", headers={"X-Forwarded-For": "10.0.0.2"}).status_code == 200
+
+
+def test_invalid_tokens_are_limited_by_address(client, clock, monkeypatch):
+    limit(monkeypatch, "GET /discussions/=1/60")
+    assert client.get("/discussions/", headers={"Authorization": "Bearer forged"}).status_code == 200
+    assert client.get("/discussions/", headers={"Authorization": "Bearer other"}).status_code == 429
+
+
+def test_unknown_route_in_config_fails_loudly(client, clock, monkeypatch):
+    limit(monkeypatch, "POST /nowhere=1/60")
+    with pytest.raises(ValueError, match="POST /nowhere"):
+        client.get("/discussions/")
+
+
+def test_rejections_are_counted_under_their_route(client, clock, monkeypatch):
+    limit(monkeypatch, "POST /token=1/60")
+    before = metrics.http_requests.value("POST", "/token", "429")
+    client.post("/token", data={"username": "x@example.com", "password": "x"})
+    client.post("/token", data={"username": "x@example.com", "password": "x"})
+    assert metrics.http_requests.value("POST", "/token", "429") == before + 1
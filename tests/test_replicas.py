@@ -0,0 +1,118 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+
+from app import models, replicas
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_replica(path):
+    replica = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=replica)
+    return replica
+
+
+@pytest.fixture
+def replica_dir():
+    return tempfile.mkdtemp()
+
+
+def add_user(bind, name):
+    with bind.begin() as connection:
+        connection.execute(models.User.__table__.insert().values(
+            name=name, email=f"{name}@example.com", mobile_no=name, hashed_password="x",
+        ))
+
+
+def user_names(client, headers=None):
+    return [user["name"] for user in client.get("/users/", headers=headers).json()]
+
+
+def test_reads_go_to_replicas_in_turn(client, replica_dir):
+    first = make_replica(os.path.join(replica_dir, "a.db"))
+    second = make_replica(os.path.join(replica_dir, "b.db"))
+    add_user(first, "first")
+    add_user(second, "second")
+    replicas.set_replica_pool(replicas.ReplicaPool([first, second], strategy="round_robin"))
+
+    assert [user_names(client) for _ in range(4)] == [["first"], ["second"], ["first"], ["second"]]
+
+
+def test_client_reads_its_own_writes_from_primary(client, signup, replica_dir):
+    replica = make_replica(os.path.join(replica_dir, "a.db"))
+    _, headers = signup("alice")
+    replicas.set_replica_pool(replicas.ReplicaPool([replica]))
+
+    response = client.post("/discussions/", json={"text": "hello", "hashtags": []}, headers=headers)
+    assert response.status_code == 200
+    discussion_id = response.json()["id"]
+
+    # anonymous readers are not sticky and hit the (lagging) replica
+    assert client.get(f"/discussions/{discussion_id}").status_code == 404
+    assert client.get(f"/discussions/{discussion_id}", headers=headers).status_code == 200
+
+
+def test_failing_replica_is_ejected_and_readmitted(client, replica_dir):
+    clock = FakeClock()
+    healthy = make_replica(os.path.join(replica_dir, "a.db"))
+    broken_path = os.path.join(replica_dir, "missing", "b.db")
+    broken = create_engine(f"sqlite:///{broken_path}", connect_args={"check_same_thread": False})
+    pool = replicas.ReplicaPool([broken, healthy], retry_seconds=30, clock=clock)
+    replicas.set_replica_pool(pool)
+
+    with pytest.raises(Exception):
+        with broken.connect():
+            pass
+    assert not pool.is_healthy(broken)
+    assert pool.healthy() == [healthy]
+
+    os.makedirs(os.path.dirname(broken_path))
+    assert pool.healthy() == [healthy]
+    clock.now = 31
+    assert pool.healthy() == [broken, healthy]
+
+
+def test_least_connections_prefers_idle_replica(replica_dir):
+    busy = make_replica(os.path.join(replica_dir, "a.db"))
+    idle = make_replica(os.path.join(replica_dir, "b.db"))
+    pool = replicas.ReplicaPool([busy, idle], strategy="least_connections")
+    with busy.connect():
+        assert pool.choose() is idle
+
+
+def test_writes_use_primary_even_with_replicas(client, signup, replica_dir):
+    replica = make_replica(os.path.join(replica_dir, "a.db"))
+    replicas.set_replica_pool(replicas.ReplicaPool([replica]))
+    signup("bob")
+    replicas.recent_writers.clear()
+
+    assert user_names(client) == []
+    replicas.set_replica_pool(None)
+    assert user_names(client) == ["bob"]
+
+
+def test_routing_session_flushes_to_primary_and_reads_from_replica(replica_dir):
+    replica = make_replica(os.path.join(replica_dir, "a.db"))
+    replicas.set_replica_pool(replicas.ReplicaPool([replica]))
+    add_user(replica, "on-replica")
+    session = replicas.RoutingSessionLocal()
+    try:
+        session.add(models.User(name="flushed", email="flushed@example.com", mobile_no="1", hashed_password="x"))
+        session.flush()
+        assert session.get_bind() is replica
+        assert [user.name for user in session.query(models.User)] == ["on-replica"]
+        session.commit()
+    finally:
+        session.close()
+    replicas.set_replica_pool(None)
+    with replicas.RoutingSessionLocal() as session:
+        assert [user.name for user in session.query(models.User)] == ["flushed"]
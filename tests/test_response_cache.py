@@ -0,0 +1,126 @@
+from app import response_cache
+from app.response_cache import CachedResponse, InMemoryResponseCache
+
+
+def create_discussion(client, headers, text="hello", hashtags=("python",)):
+    response = client.post("/discussions/", json={"text": text, "hashtags": list(hashtags)}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_cached_read_skips_database_and_matches_fresh_body(client, signup, count_queries):
+    _, headers = signup("alice")
+    discussion_id = create_discussion(client, headers)
+
+    first = client.get(f"/discussions/{discussion_id}")
+    with count_queries() as statements:
+        second = client.get(f"/discussions/{discussion_id}")
+    assert statements == []
+    assert second.content == first.content
+    assert second.json()["text"] == "hello"
+    assert second.headers["etag"] == first.headers["etag"]
+
+
+def test_if_none_match_returns_304(client, signup):
+    _, headers = signup("alice")
+    discussion_id = create_discussion(client, headers)
+    etag = client.get(f"/discussions/{discussion_id}").headers["etag"]
+
+    response = client.get(f"/discussions/{discussion_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert client.get(f"/discussions/{discussion_id}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_comment_and_like_invalidate_discussion_and_comments(client, signup):
+    _, headers = signup("alice")
+    discussion_id = create_discussion(client, headers)
+    etag = client.get(f"/discussions/{discussion_id}").headers["etag"]
+    assert client.get(f"/discussions/{discussion_id}/comments/").json() == []
+
+    comment = client.post(f"/discussions/{discussion_id}/comments/", json={"text": "hi"}, headers=headers).json()
+    discussion = client.get(f"/discussions/{discussion_id}")
+    assert discussion.headers["etag"] != etag
+    assert discussion.json()["comment_count"] == 1
+    assert [c["text"] for c in client.get(f"/discussions/{discussion_id}/comments/").json()] == ["hi"]
+
+    client.post(f"/comments/{comment['id']}/like", headers=headers)
+    assert client.get(f"/discussions/{discussion_id}/comments/").json()[0]["like_count"] == 1
+    client.post(f"/discussions/{discussion_id}/like", headers=headers)
+    assert client.get(f"/discussions/{discussion_id}").json()["like_count"] == 1
+
+
+def test_hashtag_listing_is_invalidated_by_new_and_changed_discussions(client, signup):
+    _, headers = signup("alice")
+    first = create_discussion(client, headers, text="first")
+    assert [d["text"] for d in client.get("/discussions/hashtag/python").json()] == ["first"]
+
+    create_discussion(client, headers, text="second")
+    assert sorted(d["text"] for d in client.get("/discussions/hashtag/python").json()) == ["first", "second"]
+
+    client.put(f"/discussions/{first}", json={"text": "edited", "hashtags": ["python"]}, headers=headers)
+    assert sorted(d["text"] for d in client.get("/discussions/hashtag/python").json()) == ["edited", "second"]
+
+    client.delete(f"/discussions/{first}", headers=headers)
+    assert [d["text"] for d in client.get("/discussions/hashtag/python").json()] == ["second"]
+    assert client.get(f"/discussions/{first}").status_code == 404
+
+
+def test_lru_respects_entry_and_byte_limits():
+    cache = InMemoryResponseCache(maxsize=2, max_bytes=10)
+    cache.set("a", CachedResponse(b"aaaa", '"a"'), ["t:a"])
+    cache.set("b", CachedResponse(b"bbbb", '"b"'), ["t:b"])
+    cache.get("a")
+    cache.set("c", CachedResponse(b"cccc", '"c"'), ["t:c"])
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and len(cache) == 2
+
+    cache.set("d", CachedResponse(b"dddddddd", '"d"'), ["t:d"])
+    assert cache.size_bytes <= 10
+    assert cache.get("d") is not None
+
+
+def test_entries_expire_and_invalidate_by_tag():
+    now = [0.0]
+    cache = InMemoryResponseCache(ttl=5, clock=lambda: now[0])
+    cache.set("x", CachedResponse(b"x", '"x"'), ["discussion:1", "hashtag:a"])
+    cache.set("y", CachedResponse(b"y", '"y"'), ["discussion:2"])
+    cache.invalidate(["hashtag:a"])
+    assert cache.get("x") is None
+    assert cache.get("y") is not None
+    now[0] = 6
+    assert cache.get("y") is None
+
+
+def test_value_built_across_an_invalidation_is_not_stored():
+    cache = InMemoryResponseCache()
+    generation = cache.generation()
+    cache.invalidate(["discussion:1"])
+    cache.set("x", CachedResponse(b"x", '"x"'), ["discussion:1"], generation)
+    assert cache.get("x") is None
+
+
+def test_invalidating_other_tags_does_not_drop_a_build():
+    cache = InMemoryResponseCache(max_tag_generations=2)
+    generation = cache.generation()
+    cache.invalidate(["discussion:2"])
+    cache.set("x", CachedResponse(b"x", '"x"'), ["discussion:1"], generation)
+    assert cache.get("x") is not None
+    # Once the tag generations overflow, builds older than the forgotten ones are dropped
+    cache.invalidate(["discussion:3"])
+    cache.invalidate(["discussion:4"])
+    cache.set("y", CachedResponse(b"y", '"y"'), ["discussion:1"], generation)
+    assert cache.get("y") is None
+
+
+def test_render_matches_fastapi_serialization(client, signup):
+    response_cache.RESPONSE_CACHE_ENABLED = False
+    try:
+        _, headers = signup("alice")
+        discussion_id = create_discussion(client, headers, text="héllo")
+        body = client.get(f"/discussions/{discussion_id}").content
+    finally:
+        response_cache.RESPONSE_CACHE_ENABLED = True
+    created = client.put(f"/discussions/{discussion_id}", json={"text": "héllo", "hashtags": ["python"]}, headers=headers)
+    assert created.content == body
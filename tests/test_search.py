@@ -0,0 +1,56 @@
+from app.search import InvertedIndex
+
+
+def post(client, headers, text, hashtags=()):
+    response = client.post("/discussions/", json={"text": text, "hashtags": list(hashtags)}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_discussion_search_is_ranked_and_incremental(client, signup):
+    _, headers = signup("author")
+    python = post(client, headers, "python python tips for python developers")
+    mixed = post(client, headers, "a long post about gardening that mentions python once among many other words")
+    post(client, headers, "nothing relevant here")
+    tagged = post(client, headers, "weekend plans", hashtags=["python"])
+
+    ids = [d["id"] for d in client.get("/discussions/search", params={"q": "python"}).json()]
+    assert ids[0] == python
+    assert set(ids) == {python, mixed, tagged}
+
+    client.put(f"/discussions/{python}", json={"text": "now about rust", "hashtags": []}, headers=headers)
+    client.delete(f"/discussions/{mixed}", headers=headers)
+    assert [d["id"] for d in client.get("/discussions/search", params={"q": "python"}).json()] == [tagged]
+    assert [d["id"] for d in client.get("/discussions/search", params={"q": "rust"}).json()] == [python]
+
+
+def test_user_search_matches_prefixes_and_ranks_exact_first(client, signup):
+    alison_id, _ = signup("alison")
+    ali_id, _ = signup("ali")
+    signup("bob")
+    assert [u["id"] for u in client.get("/users/search/", params={"name": "ali"}).json()] == [ali_id, alison_id]
+    assert [u["id"] for u in client.get("/users/search/", params={"name": "alis"}).json()] == [alison_id]
+    assert client.get("/users/search/", params={"name": "carol"}).json() == []
+
+
+def test_user_search_cursor_pages_follow_the_ranking(client, signup):
+    alison_id, _ = signup("alison")
+    ali_id, _ = signup("ali")
+    first = client.get("/users/search/", params={"name": "ali", "limit": 1, "cursor": ""}).json()
+    second = client.get("/users/search/", params={"name": "ali", "limit": 1, "cursor": first["next_cursor"]}).json()
+    assert [u["id"] for u in first["items"] + second["items"]] == [ali_id, alison_id]
+    assert second["next_cursor"] is None
+
+
+def test_inverted_index_bm25_and_removal():
+    index = InvertedIndex()
+    index.add(1, "the quick brown fox")
+    index.add(2, "the lazy dog")
+    index.add(3, "quick quick quick")
+    assert index.search("quick") == [3, 1]
+    assert index.search("quick", limit=1) == [3]
+    assert index.search("quick", skip=1) == [1]
+    index.remove(3)
+    index.add(1, "slow turtle")
+    assert index.search("quick") == []
+    assert len(index) == 2
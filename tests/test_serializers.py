@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import List
+
+import pytest
+from pydantic import TypeAdapter
+
+from app import crud, models, response_cache, schemas, serializers
+
+
+def pydantic_json(response_type, value):
+    adapter = TypeAdapter(response_type)
+    return adapter.dump_json(adapter.validate_python(value, from_attributes=True))
+
+
+@pytest.fixture
+def edge_cases(db, seed):
+    seed(discussions=3, depth=3)
+    user = db.query(models.User).first()
+    db.add(models.Discussion(text="ünïcødé \"quotes\" \\ and\nnewlines 🎉", image="https://example.com/a.png",
+                             user_id=user.id, view_count=7, created_on=datetime(2024, 2, 29, 23, 59, 59, 123456)))
+    db.add(models.Discussion(text="whole second", user_id=user.id, view_count=0, created_on=datetime(2024, 1, 1)))
+    db.commit()
+
+
+@pytest.fixture
+def no_response_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", False)
+
+
+@pytest.mark.read_endpoints("/discussions/?cursor=", "/users/?cursor=", "/discussions/1/comments/?cursor=",
+                            "/discussions/hashtag/python?cursor=", "/users/search/?name=user&cursor=")
+def test_fast_path_is_byte_identical(client, monkeypatch, no_response_cache, edge_cases, url):
+    monkeypatch.setattr(serializers, "FAST_JSON", False)
+    slow = client.get(url)
+    monkeypatch.setattr(serializers, "FAST_JSON", True)
+    fast = client.get(url)
+    assert slow.status_code == fast.status_code == 200
+    assert fast.headers["content-type"] == "application/json"
+    assert fast.content == slow.content
+
+
+def test_serializers_match_schemas_for_orm_objects(db, edge_cases):
+    discussions = [crud.get_discussion_detail(db, row.id) for row in db.query(models.Discussion.id).order_by(models.Discussion.id)]
+    comments = [comment for comment in discussions[0].comments if comment.parent_id is None]
+    users = [crud.get_user_detail(db, row.id) for row in db.query(models.User.id).order_by(models.User.id)]
+    cases = [
+        (List[schemas.Discussion], discussions),
+        (schemas.Discussion, discussions[-2]),
+        (List[schemas.Comment], comments),
+        (List[schemas.User], users),
+        (schemas.User, crud.get_user_detail(db, users[0].id)),
+        (schemas.DiscussionPage, {"items": discussions, "next_cursor": "abc"}),
+        (schemas.CommentPage, {"items": [], "next_cursor": None}),
+    ]
+    for response_type, value in cases:
+        assert serializers.dumps(response_type, value) == pydantic_json(response_type, value)
+
+
+def test_serializers_accept_core_rows(db, edge_cases):
+    rows = db.execute(models.Discussion.__table__.select().order_by(models.Discussion.id)).all()
+    assert serializers.dumps(List[schemas.Discussion], rows) == pydantic_json(List[schemas.Discussion], rows)
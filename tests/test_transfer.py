@@ -0,0 +1,88 @@
+import orjson
+import pytest
+
+from app import models, transfer
+from app.database import SessionLocal, engine
+
+
+def seed_graph(client, signup):
+    alice_id, alice = signup("alice")
+    bob_id, bob = signup("bob")
+    client.post(f"/users/{alice_id}/follow/{bob_id}", headers=alice)
+    discussion = client.post("/discussions/", json={"text": "hello #python", "hashtags": ["python"]}, headers=alice).json()
+    comment = client.post(f"/discussions/{discussion['id']}/comments/", json={"text": "first"}, headers=bob).json()
+    client.post(f"/comments/{comment['id']}/reply", json={"text": "second"}, headers=alice)
+    client.post(f"/discussions/{discussion['id']}/like", headers=bob)
+    client.post(f"/comments/{comment['id']}/like", headers=alice)
+    return discussion["id"], comment["id"]
+
+
+def export_all(**kwargs):
+    return b"".join(transfer.export_ndjson(**kwargs))
+
+
+def test_export_import_round_trip(client, signup):
+    discussion_id, comment_id = seed_graph(client, signup)
+    dump = export_all(include_password_hashes=True)
+    records = [orjson.loads(line) for line in dump.splitlines()]
+    assert [r["type"] for r in records] == sorted((r["type"] for r in records), key=transfer.TYPES.index)
+    assert {r["type"] for r in records} == set(transfer.TYPES)
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    counts = transfer.import_ndjson(dump.splitlines(keepends=True), batch_size=2)
+    assert counts["user"] == 2 and counts["comment"] == 2 and counts["follow"] == 1
+
+    assert export_all(include_password_hashes=True) == dump
+    assert client.post("/token", data={"username": "alice@example.com", "password": "secret"}).status_code == 200
+    thread = client.get(f"/comments/{comment_id}/thread").json()
+    assert [reply["text"] for reply in thread["replies"]] == ["second"]
+    discussion = client.get(f"/discussions/{discussion_id}").json()
+    assert discussion["like_count"] == 1 and [h["name"] for h in discussion["hashtags"]] == ["python"]
+
+
+def test_users_imported_without_hashes_cannot_log_in(client, signup):
+    seed_graph(client, signup)
+    dump = export_all(types=["user"])
+    assert b"hashed_password" not in dump
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    transfer.import_ndjson(dump.splitlines())
+    response = client.post("/token", data={"username": "alice@example.com", "password": "secret"})
+    assert response.status_code == 401
+
+
+def test_export_streams_with_server_side_batches(client, signup):
+    seed_graph(client, signup)
+    db = SessionLocal()
+    try:
+        lines = list(transfer.export_rows(db, "user", batch_size=1))
+    finally:
+        db.close()
+    assert [orjson.loads(line)["email"] for line in lines] == ["alice@example.com", "bob@example.com"]
+
+
+def test_export_endpoint(client, signup, monkeypatch):
+    seed_graph(client, signup)
+    _, headers = signup("carol")
+    assert client.get("/export").status_code == 401
+    # An ordinary account cannot dump everyone's contact details
+    assert client.get("/export", headers=headers).status_code == 403
+    monkeypatch.setattr(transfer, "EXPORT_ADMIN_EMAILS", {"carol@example.com"})
+
+    response = client.get("/export", params={"types": "user,follow"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    records = [orjson.loads(line) for line in response.content.splitlines()]
+    assert [r["type"] for r in records] == ["user", "user", "user", "follow"]
+    assert all("hashed_password" not in r for r in records)
+
+    assert client.get("/export", params={"types": "user,secrets"}, headers=headers).status_code == 400
+
+
+def test_import_rejects_unknown_records():
+    with pytest.raises(ValueError, match="Line 2"):
+        transfer.import_ndjson([b'{"type": "hashtag", "id": 1, "name": "python"}\n', b'{"type": "password"}\n'])
+    with pytest.raises(ValueError, match="Line 1: invalid JSON"):
+        transfer.import_ndjson([b"not json\n"])
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from app import models
+from app.trending import TrendingCounter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000 * 60.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_windows_slide():
+    clock = Clock()
+    counter = TrendingCounter(clock=clock)
+    counter.record(["python", "python", "rust"])
+    clock.now += 30 * 60
+    counter.record(["rust"])
+    assert counter.top("1h") == [("python", 2), ("rust", 2)]
+
+    clock.now += 45 * 60
+    assert counter.top("1h") == [("rust", 1)]
+    assert counter.top("24h") == [("python", 2), ("rust", 2)]
+
+    clock.now += 24 * 60 * 60
+    assert counter.top("24h") == []
+    counter.record(["go"])
+    assert counter.top("24h", limit=1) == [("go", 1)]
+
+
+def test_recording_in_the_past_only_counts_in_matching_windows():
+    clock = Clock()
+    counter = TrendingCounter(clock=clock)
+    counter.record(["old"], at=clock.now - 2 * 60 * 60)
+    counter.record(["ancient"], at=clock.now - 48 * 60 * 60)
+    assert counter.top("1h") == []
+    assert counter.top("24h") == [("old", 1)]
+
+
+def test_trending_endpoint_and_rebuild(client, signup, db):
+    _, headers = signup("author")
+    client.post("/discussions/", json={"text": "a", "hashtags": ["python", "fastapi"]}, headers=headers)
+    discussion_id = client.post("/discussions/", json={"text": "b", "hashtags": ["python"]}, headers=headers).json()["id"]
+    client.put(f"/discussions/{discussion_id}", json={"text": "b", "hashtags": ["python", "sql"]}, headers=headers)
+
+    expected = [{"name": "python", "count": 2}, {"name": "fastapi", "count": 1}, {"name": "sql", "count": 1}]
+    assert client.get("/hashtags/trending").json() == expected
+    assert client.get("/hashtags/trending", params={"window": "1w"}).status_code == 400
+
+    stale = models.Discussion(text="old", user_id=1, view_count=0, created_on=datetime.utcnow() - timedelta(days=2))
+    stale.hashtags.append(db.query(models.Hashtag).filter_by(name="sql").one())
+    db.add(stale)
+    db.commit()
+    counter = TrendingCounter()
+    counter.rebuild(db)
+    assert counter.top("24h") == [("python", 2), ("fastapi", 1), ("sql", 1)]
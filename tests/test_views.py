@@ -0,0 +1,92 @@
+from app import crud, models, ranking
+from app.views import ViewAggregator, view_aggregator
+
+
+def make_discussion(db):
+    user = models.User(name="author", email="author@example.com", mobile_no="5550000", hashed_password="x")
+    db.add(user)
+    db.flush()
+    discussion = models.Discussion(text="hot", user_id=user.id, view_count=0)
+    db.add(discussion)
+    db.commit()
+    return discussion
+
+
+def test_views_are_buffered_until_flush(client, db):
+    discussion = make_discussion(db)
+    for _ in range(5):
+        response = client.post(f"/discussions/{discussion.id}/view")
+        assert response.status_code == 202
+        assert response.json() == {"message": "View recorded"}
+    assert view_aggregator.pending() == {discussion.id: 5}
+
+    view_aggregator.flush()
+    db.refresh(discussion)
+    assert discussion.view_count == 5
+    assert view_aggregator.pending() == {}
+
+
+def test_threshold_triggers_flush(db):
+    discussion = make_discussion(db)
+    aggregator = ViewAggregator(flush_threshold=3)
+    aggregator.record(discussion.id)
+    aggregator.record(discussion.id)
+    db.refresh(discussion)
+    assert discussion.view_count == 0
+    aggregator.record(discussion.id)
+    db.refresh(discussion)
+    assert discussion.view_count == 3
+
+
+def test_stop_drains_pending_views(db):
+    discussion = make_discussion(db)
+    aggregator = ViewAggregator(flush_interval=3600)
+    aggregator.start()
+    for _ in range(7):
+        aggregator.record(discussion.id)
+    aggregator.stop()
+    db.refresh(discussion)
+    assert discussion.view_count == 7
+
+
+def test_failed_flush_is_retried_but_committed_views_are_not(db, monkeypatch):
+    discussion = make_discussion(db)
+    aggregator = ViewAggregator()
+    aggregator.record(discussion.id, 2)
+    add_view_counts = crud.add_view_counts
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("unavailable")
+
+    monkeypatch.setattr(crud, "add_view_counts", fail)
+    assert aggregator.flush() == 0
+    assert aggregator.pending() == {discussion.id: 2}
+
+    # The write succeeds but ranking fails afterwards: the views must not be written twice
+    monkeypatch.setattr(crud, "add_view_counts", add_view_counts)
+    monkeypatch.setattr(ranking.discussion_ranking, "record", fail)
+    assert aggregator.flush() == 1
+    assert aggregator.pending() == {}
+    aggregator.flush()
+    db.refresh(discussion)
+    assert discussion.view_count == 2
+
+
+def test_flushed_views_leave_cached_responses_alone(client, db):
+    discussion = make_discussion(db)
+    before = client.get(f"/discussions/{discussion.id}")
+    client.post(f"/discussions/{discussion.id}/view")
+    view_aggregator.flush()
+    after = client.get(f"/discussions/{discussion.id}")
+    assert after.headers["etag"] == before.headers["etag"]
+    assert after.json()["view_count"] == 0
+
+
+def test_views_of_unknown_discussions_are_dropped_at_flush(client, db):
+    discussion = make_discussion(db)
+    client.post(f"/discussions/{discussion.id}/view")
+    client.post("/discussions/999/view")
+    assert view_aggregator.flush() == 1
+    assert view_aggregator.pending() == {}
+    db.refresh(discussion)
+    assert discussion.view_count == 1